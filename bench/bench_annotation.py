@@ -0,0 +1,93 @@
+#!/usr/bin/env python
+"""Benchmarks building the annotation index of a synthetic GTF file and
+looking up CCDS entries in it. Usage:
+  python bench_annotation.py [n_genes ...]
+"""
+
+import os
+import sys
+import time
+import shutil
+import tempfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.realpath(__file__)), '..', 'src'))
+
+import annotationindex as ai
+import annotationloader as al
+import synthetic
+
+
+
+# Number of CCDS ids looked up in each run
+N_LOOKUPS = 1000
+
+
+
+def write_gtf(filepath, n_genes):
+  """Writes a GTF file of n_genes genes with two transcripts each that share
+  their CCDS coding exons. Returns a dict of the exon edges of each CCDS id."""
+
+  edges = {}
+  with open(filepath, 'w') as gtf:
+    gtf.write('##description: synthetic annotation\n')
+    for n in xrange(n_genes):
+      chrom = 'chr%d' % (n % 22 + 1)
+      strand = '+' if n % 2 == 0 else '-'
+      exon_edges = synthetic.make_exon_edges(12, start=1000000 + 100000 * n, seed=n)
+      edges[str(n + 1)] = exon_edges
+
+      for transcript in xrange(2):
+        attributes = ('gene_id "G%d"; transcript_id "T%d.%d"; ccdsid "CCDS%d.1";'
+                      % (n, n, transcript, n + 1))
+        for first, last in exon_edges:
+          # Annotation coordinates are 1-based
+          for feature in ['exon', 'CDS']:
+            gtf.write('\t'.join([chrom, 'SYN', feature, str(first + 1), str(last + 1),
+                                 '.', strand, '0', attributes]) + '\n')
+  return edges
+
+
+
+def run(n_genes, tmpdir):
+
+  filepath = os.path.join(tmpdir, 'synthetic_%d.gtf' % n_genes)
+  edges = write_gtf(filepath, n_genes)
+  cache_dir = os.path.join(tmpdir, 'cache_%d' % n_genes)
+
+  start = time.time()
+  index = ai.AnnotationIndex(filepath, cache_dir)
+  build_time = time.time() - start
+
+  start = time.time()
+  ai.AnnotationIndex(filepath, cache_dir)
+  open_time = time.time() - start
+
+  ids = [str(n % n_genes + 1) for n in xrange(N_LOOKUPS)]
+  start = time.time()
+  entries = [index.get(ccds_id) for ccds_id in ids]
+  lookup_time = (time.time() - start) / N_LOOKUPS
+
+  loader = al.AnnotationLoader(filepath, cache_dir=cache_dir)
+  start = time.time()
+  for ccds_id in ids:
+    loader.load({'CCDS_ID' : 'CCDS%s.1' % ccds_id, 'strand_conflict' : 'ccds'})
+  load_time = (time.time() - start) / N_LOOKUPS
+
+  correct = all(entry[0] == edges[ccds_id] for ccds_id, entry in zip(ids, entries))
+
+  print '%6d genes   build %7.2fs   reopen %6.2f ms   get %6.3f ms   load %6.3f ms   %s' % (
+          n_genes, build_time, open_time * 1000, lookup_time * 1000, load_time * 1000,
+          'identical' if correct else 'MISMATCH')
+
+
+
+if __name__ == '__main__':
+
+  sizes = [int(arg) for arg in sys.argv[1:]] or [1000, 20000]
+
+  tmpdir = tempfile.mkdtemp()
+  try:
+    for n_genes in sizes:
+      run(n_genes, tmpdir)
+  finally:
+    shutil.rmtree(tmpdir)
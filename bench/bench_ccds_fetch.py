@@ -0,0 +1,127 @@
+#!/usr/bin/env python
+"""Checks and benchmarks CcdsLoader.load_many against a local HTTP stand-in
+for the CCDS browser that serves the saved pages in bench/fixtures. Every
+requested id is served the fixture page of CCDS1 or CCDS2 (by parity) after
+a simulated network delay, and ids ending in 0 are answered with a 404.
+Usage:
+  python bench_ccds_fetch.py [--delay SECONDS] [--workers N ...] [n_ids ...]
+"""
+
+import os
+import sys
+import time
+import urlparse
+import argparse
+import threading
+import SocketServer
+import SimpleHTTPServer
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.realpath(__file__)), '..', 'src'))
+
+import ccdsloader as ccds
+
+
+FIXTURE_DIR = os.path.join(os.path.dirname(os.path.realpath(__file__)), 'fixtures')
+
+# The entries of the fixture pages
+EXPECTED = { '1' : ([(1000000, 1000120), (1002000, 1002210), (1005500, 1005642)], '+') ,
+             '2' : ([(2400000, 2400088), (2403100, 2403301), (2407000, 2407150),
+                     (2409900, 2410013)], '-') }
+
+
+
+class FixtureHandler(SimpleHTTPServer.SimpleHTTPRequestHandler):
+  """Serves the fixture page for the DATA id of a CcdsBrowse.cgi request."""
+
+  delay = 0.0
+
+  def do_GET(self):
+    time.sleep(self.delay)
+    self.server.requests += 1
+
+    ccds_id = urlparse.parse_qs(urlparse.urlparse(self.path).query).get('DATA', [''])[0]
+    if not ccds_id.isdigit() or ccds_id.endswith('0'):
+      self.send_error(404)
+      return
+
+    with open(os.path.join(FIXTURE_DIR, 'CCDS%d.html' % (2 - int(ccds_id) % 2)), 'rb') as page:
+      content = page.read()
+    self.send_response(200)
+    self.send_header('Content-Type', 'text/html')
+    self.send_header('Content-Length', str(len(content)))
+    self.end_headers()
+    self.wfile.write(content)
+
+  def log_message(self, format, *args):
+    pass
+
+
+
+class FixtureServer(SocketServer.ThreadingMixIn, SocketServer.TCPServer):
+  daemon_threads = True
+  allow_reuse_address = True
+  requests = 0
+
+
+
+def expected_entry(ccds_id):
+  if ccds_id.endswith('0'):
+    return None
+  return EXPECTED[str(2 - int(ccds_id) % 2)]
+
+
+
+def load(url_base, ccds_ids, workers):
+
+  settings = { 'ccds_cache_dir' : 'none',
+               'ccds_workers'   : workers,
+               'ccds_retries'   : 0 }
+
+  loader = ccds.CcdsLoader(url_base=url_base)
+  start = time.time()
+  entries = loader.load_many(ccds_ids, settings)
+  return time.time() - start, entries
+
+
+
+def run(n_ids, worker_counts, url_base, server):
+
+  # Duplicates and version suffixes are fetched once per id
+  ccds_ids = ['CCDS%d' % n for n in xrange(1, n_ids + 1)] + ['CCDS1.2', 'ccds2']
+  unique_ids = set(ccds_id.upper().split('.')[0][4:] for ccds_id in ccds_ids)
+
+  results = []
+  for workers in worker_counts:
+    server.requests = 0
+    seconds, entries = load(url_base, ccds_ids, workers)
+    correct = all(entries[ccds_id] == expected_entry(ccds_id.upper().split('.')[0][4:])
+                  for ccds_id in ccds_ids)
+    results.append('%2d workers %7.3fs %4d requests %s' % (
+                    workers, seconds, server.requests,
+                    'correct' if correct and server.requests == len(unique_ids) else 'MISMATCH'))
+
+  print '%6d ids   %s' % (n_ids, '   '.join(results))
+
+
+
+if __name__ == '__main__':
+
+  parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+  parser.add_argument('--delay', type=float, default=0.05)
+  parser.add_argument('--workers', type=int, nargs='*', default=[1, 8])
+  parser.add_argument('sizes', type=int, nargs='*', default=[20, 100])
+  args = parser.parse_args()
+
+  FixtureHandler.delay = args.delay
+  server = FixtureServer(('127.0.0.1', 0), FixtureHandler)
+  thread = threading.Thread(target=server.serve_forever)
+  thread.daemon = True
+  thread.start()
+
+  url_base = 'http://127.0.0.1:%d/CcdsBrowse.cgi?REQUEST=CCDS&GO=MainBrowse&DATA=' % server.server_address[1]
+  try:
+    for n_ids in args.sizes:
+      run(n_ids, args.workers, url_base, server)
+  finally:
+    server.shutdown()
+    server.server_close()
@@ -0,0 +1,95 @@
+#!/usr/bin/env python
+"""Benchmarks the lxml extraction of CCDS pages in CcdsLoader against the
+previous full BeautifulSoup parse (requires bs4). Usage:
+  python bench_ccds_parse.py [saved_ccds_page.html ...]
+Synthetic pages are used if no saved pages are given.
+"""
+
+import os
+import sys
+import time
+import resource
+import multiprocessing
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.realpath(__file__)), '..', 'src'))
+
+from bs4 import BeautifulSoup
+import ccdsloader as ccds
+import synthetic
+
+
+REPEATS = 20
+
+
+
+def soup_parse(content):
+  """The previous parse: a full BeautifulSoup tree of the page."""
+
+  soup = BeautifulSoup(content, 'lxml')
+
+  extable = soup.find('small', string="Chromosome").parent.parent.parent
+  exon_edges = [tuple([int(cell.get_text()) for cell in row.find_all('td')[1:3]])
+                          for row in extable.find_all('tr')[1:]]
+
+  strandline = filter(lambda s: 'strand of chromosome' in s.lower(),
+                          map(lambda tag: str(tag.get_text()), soup.findAll('b')))[0]
+  return exon_edges, strandline.split("'")[1], soup
+
+
+
+def lxml_parse(content):
+  return ccds.CcdsLoader._parse_page(content)
+
+
+
+def measure(parse, content, queue):
+  """Parses content REPEATS times (in a fresh process) and reports the
+  seconds per parse, the peak RSS growth in kB and the parsed entry."""
+
+  rss_start = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+  start = time.time()
+  for i in xrange(REPEATS):
+    result = parse(content)
+  seconds = (time.time() - start) / REPEATS
+
+  rss_peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+  queue.put((seconds, rss_peak - rss_start, result[:2]))
+
+
+
+def run_in_process(parse, content):
+  queue = multiprocessing.Queue()
+  process = multiprocessing.Process(target=measure, args=(parse, content, queue))
+  process.start()
+  result = queue.get()
+  process.join()
+  return result
+
+
+
+def run(name, content):
+
+  soup_time, soup_rss, soup_entry = run_in_process(soup_parse, content)
+  lxml_time, lxml_rss, lxml_entry = run_in_process(lxml_parse, content)
+
+  print '%-30s %7d kB   soup %8.2f ms %8d kB   lxml %8.2f ms %8d kB   speedup %5.1fx   %s' % (
+          name[-30:], len(content) // 1024,
+          soup_time * 1000, soup_rss, lxml_time * 1000, lxml_rss,
+          soup_time / max(lxml_time, 1e-9),
+          'identical' if soup_entry == lxml_entry else 'MISMATCH')
+
+
+
+if __name__ == '__main__':
+
+  if len(sys.argv) > 1:
+    for filepath in sys.argv[1:]:
+      with open(filepath, 'r') as pagefile:
+        run(filepath, pagefile.read())
+
+  else:
+    for n_exons, filler_rows in [(10, 500), (40, 2000), (80, 8000)]:
+      exon_edges = synthetic.make_exon_edges(n_exons)
+      run('synthetic %d exons' % n_exons,
+          synthetic.make_ccds_page(exon_edges, filler_rows=filler_rows))
@@ -0,0 +1,135 @@
+#!/usr/bin/env python
+"""Benchmarks the memory-budgeted external sort of the pairs (sort_memory
+setting) against the in-memory sort of build_pairs on large synthetic genes,
+checking that both give the same order for every sort key. Usage:
+  python bench_external_sort.py [--sort-memory MB] [n_rows ...]
+"""
+
+import os
+import sys
+import time
+import shutil
+import argparse
+import resource
+import tempfile
+import multiprocessing
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.realpath(__file__)), '..', 'src'))
+
+import guidebuilder as gb
+import instrumentation as instr
+import synthetic
+
+
+SORT_KEYS = ['deletion_count', 'deletion_fraction', 'genomic_separation', 'genomic_location',
+             'deletion_count,genomic_separation', 'gen_sep,del_frac,gnm_loc']
+
+
+
+def pair_keys(pairs):
+  return [(p.seq1.sequence, p.seq1.gnm_loc, p.seq2.sequence, p.seq2.gnm_loc,
+           p.deletion_count, p.deletion_fraction, p.deletion_pct) for p in pairs]
+
+
+
+def make_builder(filepath, exon_edges, strand, sort_key, sort_memory, profile=None):
+
+  settings = { 'input_file'        : filepath,
+               'CCDS_ID'           : 'CCDS0',
+               'strand'            : strand,
+               'max_offtargets'    : (0, 1, 5, 20),
+               'separation_limit'  : 20000,
+               'latest_gRNA2'      : 1.0,
+               'sort_key'          : sort_key,
+               'sort_memory'       : sort_memory,
+               'table_cache_dir'   : 'none' }
+
+  builder = gb.GuideBuilder(settings, profile=profile)
+  builder.set_exon_edges(exon_edges)
+  return builder
+
+
+
+def measure(filepath, exon_edges, sort_memory, queue):
+  """Sorts the pairs of a gene (in a fresh process) and reports the peak RSS
+  growth in kB and the time. The pairs are consumed one at a time, as the
+  output writer does."""
+
+  rss_start = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+  builder = make_builder(filepath, exon_edges, '+', 'deletion_count', sort_memory)
+
+  start = time.time()
+  if sort_memory is None:
+    builder.build_pairs()
+    n_pairs = sum(1 for pair in builder.get_pairs())
+  else:
+    n_pairs = sum(1 for pair in builder.iter_sorted_pairs())
+  seconds = time.time() - start
+
+  rss_peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+  queue.put((rss_peak - rss_start, seconds, n_pairs))
+
+
+
+def run_in_process(filepath, exon_edges, sort_memory):
+  queue = multiprocessing.Queue()
+  process = multiprocessing.Process(target=measure, args=(filepath, exon_edges, sort_memory, queue))
+  process.start()
+  result = queue.get()
+  process.join()
+  return result
+
+
+
+def check_orders(filepath, exon_edges, sort_memory):
+  """Returns the number of runs spilled and the sort keys (with strand) whose
+  external order differs from the in-memory order."""
+
+  mismatches = []
+  n_runs = 0
+  for strand in ['+', '-']:
+    for sort_key in SORT_KEYS:
+      builder = make_builder(filepath, exon_edges, strand, sort_key, None)
+      builder.build_pairs()
+      expected = pair_keys(builder.get_pairs())
+
+      profile = instr.RunProfile()
+      builder = make_builder(filepath, exon_edges, strand, sort_key, sort_memory, profile)
+      if pair_keys(builder.iter_sorted_pairs()) != expected:
+        mismatches.append('%s (%s)' % (sort_key, strand))
+      n_runs = max(n_runs, profile.counters.get('sort_runs_spilled', 0))
+
+  return n_runs, mismatches
+
+
+
+def run(n_rows, sort_memory, tmpdir):
+
+  exon_edges = synthetic.make_exon_edges(40, exon_size=400, intron_size=1500)
+  filepath = os.path.join(tmpdir, 'synthetic_%d.txt' % n_rows)
+  synthetic.write_results_table(filepath, exon_edges, n_rows, g_start_rate=0.6)
+
+  memory_rss, memory_time, n_pairs = run_in_process(filepath, exon_edges, None)
+  external_rss, external_time, n_external = run_in_process(filepath, exon_edges, sort_memory)
+  n_runs, mismatches = check_orders(filepath, exon_edges, sort_memory)
+
+  print '%8d rows %10d pairs   in memory %9d kB %7.2fs   external %9d kB %7.2fs (%d runs)   %s' % (
+          n_rows, n_pairs, memory_rss, memory_time, external_rss, external_time, n_runs,
+          'identical' if not mismatches and n_pairs == n_external else
+          'MISMATCH: ' + ', '.join(mismatches))
+
+
+
+if __name__ == '__main__':
+
+  parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+  parser.add_argument('--sort-memory', type=float, default=8)
+  parser.add_argument('sizes', type=int, nargs='*', default=[2000, 4000])
+  args = parser.parse_args()
+
+  tmpdir = tempfile.mkdtemp()
+  try:
+    for n_rows in args.sizes:
+      run(n_rows, args.sort_memory, tmpdir)
+  finally:
+    shutil.rmtree(tmpdir)
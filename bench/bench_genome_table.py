@@ -0,0 +1,92 @@
+#!/usr/bin/env python
+"""Benchmarks pairing many genes from one genome-wide ChopChop table
+(genome_wide setting) against pairing them from per-gene tables. Usage:
+  python bench_genome_table.py [n_genes ...]
+"""
+
+import os
+import sys
+import time
+import shutil
+import tempfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.realpath(__file__)), '..', 'src'))
+
+import guidebuilder as gb
+import synthetic
+
+
+
+# Rows per gene and the number of chromosomes the genes are spread over
+ROWS_PER_GENE = 1000
+N_CHROMOSOMES = 4
+
+
+
+def pair_keys(pairs):
+  return [(p.seq1.sequence, p.seq1.gnm_loc, p.seq2.sequence, p.seq2.gnm_loc) for p in pairs]
+
+
+
+def build(filepath, exon_edges, chromosome=None):
+
+  settings = { 'input_file'        : filepath,
+               'CCDS_ID'           : 'CCDS0',
+               'strand'            : '+',
+               'max_offtargets'    : (0, 1, 5, 20),
+               'table_cache_dir'   : 'none',
+               'genome_wide'       : chromosome is not None,
+               'chromosome'        : chromosome }
+
+  builder = gb.GuideBuilder(settings)
+  builder.set_exon_edges(exon_edges)
+  builder.build_pairs()
+  return pair_keys(builder.get_pairs())
+
+
+
+def run(n_genes, tmpdir):
+
+  genes = []
+  genome_file = os.path.join(tmpdir, 'genome_%d.txt' % n_genes)
+  with open(genome_file, 'w') as genome:
+    genome.write('\t'.join(synthetic.HEADER) + '\n')
+
+    for n in xrange(n_genes):
+      # Genes on different chromosomes share coordinates
+      chromosome = 'chr%d' % (n % N_CHROMOSOMES + 1)
+      exon_edges = synthetic.make_exon_edges(20, start=1000000 + 200000 * (n // N_CHROMOSOMES), seed=n)
+      rows = synthetic.make_rows(exon_edges, ROWS_PER_GENE, chromosome=chromosome, seed=n)
+
+      gene_file = os.path.join(tmpdir, 'gene_%d_%d.txt' % (n_genes, n))
+      synthetic.write_results_table(gene_file, exon_edges, ROWS_PER_GENE,
+                                    chromosome=chromosome, seed=n)
+      for row in rows:
+        genome.write('\t'.join(row) + '\n')
+
+      genes.append((gene_file, exon_edges, chromosome))
+
+  start = time.time()
+  split_pairs = [build(gene_file, exon_edges) for gene_file, exon_edges, chromosome in genes]
+  split_time = time.time() - start
+
+  start = time.time()
+  genome_pairs = [build(genome_file, exon_edges, chromosome) for gene_file, exon_edges, chromosome in genes]
+  genome_time = time.time() - start
+
+  print '%5d genes %9d rows   per-gene files %7.2fs   genome-wide file %7.2fs   %s' % (
+          n_genes, n_genes * ROWS_PER_GENE, split_time, genome_time,
+          'identical' if genome_pairs == split_pairs else 'MISMATCH')
+
+
+
+if __name__ == '__main__':
+
+  sizes = [int(arg) for arg in sys.argv[1:]] or [20, 100]
+
+  tmpdir = tempfile.mkdtemp()
+  try:
+    for n_genes in sizes:
+      run(n_genes, tmpdir)
+  finally:
+    shutil.rmtree(tmpdir)
@@ -0,0 +1,118 @@
+#!/usr/bin/env python
+"""Benchmarks the memory of the slotted TargetSequence and GuidePair objects
+against the previous representation (a __dict__ per object and a logger
+stored on every TargetSequence), and of the PairTable of built pairs
+against a list of GuidePairs, on a large synthetic gene. Usage:
+  python bench_memory.py [n_rows ...]
+"""
+
+import os
+import sys
+import time
+import shutil
+import resource
+import tempfile
+import multiprocessing
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.realpath(__file__)), '..', 'src'))
+
+import log
+import guidebuilder as gb
+import targetsequence as ts
+import guidepair as gp
+import synthetic
+
+
+
+class LegacyTargetSequence(ts.TargetSequence):
+  """The previous TargetSequence: instances carry a __dict__ and a logger."""
+
+  logger = None
+
+  def __init__(self, **kwargs):
+    self.logger = log.getLogger(ts.__name__)
+    super(LegacyTargetSequence, self).__init__(**kwargs)
+
+
+
+class LegacyGuidePair(gp.GuidePair):
+  """The previous GuidePair: instances carry a __dict__."""
+  pass
+
+
+
+def use_legacy_classes():
+  # truncate_front and the GuideBuilder look the classes up on their modules
+  ts.TargetSequence = LegacyTargetSequence
+  gp.GuidePair = LegacyGuidePair
+
+
+
+def measure(filepath, exon_edges, legacy, table, queue):
+  """Builds the pairs of a gene (in a fresh process) and reports the peak RSS
+  growth in kB, the build time and the number of pairs. Unless table is True
+  the pairs are held as a list of GuidePairs."""
+
+  if legacy:
+    use_legacy_classes()
+
+  rss_start = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+  settings = { 'input_file'        : filepath,
+               'CCDS_ID'           : 'CCDS0',
+               'strand'            : '+',
+               'max_offtargets'    : (0, 1, 5, 20),
+               'separation_limit'  : 20000,
+               'latest_gRNA2'      : 1.0,
+               'table_cache_dir'   : 'none' }
+
+  start = time.time()
+  builder = gb.GuideBuilder(settings)
+  builder.set_exon_edges(exon_edges)
+  builder.build_pairs()
+  pairs = builder.get_pairs() if table else list(builder.get_pairs())
+  seconds = time.time() - start
+
+  rss_peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+  queue.put((rss_peak - rss_start, seconds, len(pairs)))
+
+
+
+def run_in_process(filepath, exon_edges, legacy, table=False):
+  queue = multiprocessing.Queue()
+  process = multiprocessing.Process(target=measure, args=(filepath, exon_edges, legacy, table, queue))
+  process.start()
+  result = queue.get()
+  process.join()
+  return result
+
+
+
+def run(n_rows, tmpdir):
+
+  exon_edges = synthetic.make_exon_edges(40, exon_size=400, intron_size=1500)
+  filepath = os.path.join(tmpdir, 'synthetic_%d.txt' % n_rows)
+  synthetic.write_results_table(filepath, exon_edges, n_rows, g_start_rate=0.6)
+
+  legacy_rss, legacy_time, legacy_pairs = run_in_process(filepath, exon_edges, True)
+  slots_rss, slots_time, slots_pairs = run_in_process(filepath, exon_edges, False)
+  table_rss, table_time, table_pairs = run_in_process(filepath, exon_edges, False, True)
+
+  print ('%8d rows %10d pairs   legacy %9d kB %7.2fs   slots %9d kB %7.2fs   '
+         'table %9d kB %7.2fs   memory %5.2fx %5.2fx   %s') % (
+          n_rows, slots_pairs, legacy_rss, legacy_time, slots_rss, slots_time, table_rss, table_time,
+          float(legacy_rss) / max(slots_rss, 1), float(slots_rss) / max(table_rss, 1),
+          'identical' if legacy_pairs == slots_pairs == table_pairs else 'MISMATCH')
+
+
+
+if __name__ == '__main__':
+
+  sizes = [int(arg) for arg in sys.argv[1:]] or [2000, 4000]
+
+  tmpdir = tempfile.mkdtemp()
+  try:
+    for n_rows in sizes:
+      run(n_rows, tmpdir)
+  finally:
+    shutil.rmtree(tmpdir)
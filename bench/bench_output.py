@@ -0,0 +1,78 @@
+#!/usr/bin/env python
+"""Benchmarks the output formats of OutputFormatter (CSV, gzip CSV, JSON
+Lines and Parquet if pyarrow is installed), with full gene blocks and with
+gene blocks by reference. Usage:
+  python bench_output.py [n_rows ...]
+"""
+
+import os
+import sys
+import time
+import shutil
+import tempfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.realpath(__file__)), '..', 'src'))
+
+import guidebuilder as gb
+import outputformatter as of
+import outputwriters as ow
+import synthetic
+
+
+
+def run(n_rows, tmpdir):
+
+  exon_edges = synthetic.make_exon_edges(40, exon_size=400, intron_size=1500)
+  filepath = os.path.join(tmpdir, 'synthetic_%d.txt' % n_rows)
+  synthetic.write_results_table(filepath, exon_edges, n_rows)
+
+  settings = { 'input_file'        : filepath,
+               'CCDS_ID'           : 'CCDS0',
+               'strand'            : '+',
+               'max_offtargets'    : (0, 1, 5, 20),
+               'separation_limit'  : 20000,
+               'latest_gRNA2'      : 1.0 }
+
+  builder = gb.GuideBuilder(settings)
+  builder.set_exon_edges(exon_edges)
+  builder.build_pairs()
+  pairs = builder.get_pairs()
+
+  outputter = of.OutputFormatter(os.path.join(os.path.dirname(os.path.realpath(__file__)),
+                                              '..', 'gene_block_constants.const'))
+
+  print '%8d rows %10d pairs' % (n_rows, len(pairs))
+
+  baseline = None
+  for output_format in ['csv', 'csv.gz', 'jsonl', 'parquet']:
+    if output_format == 'parquet' and ow.pyarrow is None:
+      print '    %-8s skipped: pyarrow is not installed' % output_format
+      continue
+
+    for gene_blocks in ['full', 'reference']:
+      output_file = os.path.join(tmpdir, 'pairs_%d_%s%s' % (n_rows, gene_blocks,
+                                                            ow.default_extension(output_format)))
+      start = time.time()
+      outputter.write(pairs, output_file, output_format=output_format, gene_blocks=gene_blocks)
+      seconds = time.time() - start
+      megabytes = os.path.getsize(output_file) / float(1 << 20)
+      os.remove(output_file)
+
+      if baseline is None:
+        baseline = (seconds, megabytes)
+      print '    %-8s %-9s %7.2fs (%4.2fx)  %8.1f MB (%5.1fx smaller)' % (
+              output_format, gene_blocks, seconds, baseline[0] / seconds,
+              megabytes, baseline[1] / megabytes)
+
+
+
+if __name__ == '__main__':
+
+  sizes = [int(arg) for arg in sys.argv[1:]] or [2000, 4000]
+
+  tmpdir = tempfile.mkdtemp()
+  try:
+    for n_rows in sizes:
+      run(n_rows, tmpdir)
+  finally:
+    shutil.rmtree(tmpdir)
@@ -0,0 +1,125 @@
+#!/usr/bin/env python
+"""Benchmarks GuideBuilder.build_pairs against the previous list-based
+pairing window, which also rebuilt the G-start variants of seq2 for every
+seq1, on large synthetic genes. Usage:
+  python bench_pairing.py [n_rows ...]
+"""
+
+import os
+import sys
+import time
+import shutil
+import tempfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.realpath(__file__)), '..', 'src'))
+
+import guidebuilder as gb
+import guidepair as gp
+import synthetic
+
+
+
+def legacy_build_pairs(builder):
+  """The previous pairing loop: iterates a copy of the window for every seq2,
+  prunes it with list.pop(0) and calls find_G_starts() for every pair."""
+
+  builder.guidepairs = []
+  builder.sort_sequences(keystr="cut_site")
+
+  start_seqs = []
+  candidates = []
+
+  for seq2 in builder.sequences:
+    for seq1 in list(start_seqs):
+      if abs(seq2.cut_site - seq1.cut_site) > builder.settings['separation_limit']:
+        start_seqs.pop(0)
+        continue
+      elif seq1.overlap_Q(seq2):
+        continue
+      else:
+        if builder.settings['gRNA2_start_G']:
+          candidates += [(seq1, g_seq2) for g_seq2 in seq2.find_G_starts()]
+        else:
+          candidates.append((seq1, seq2))
+
+    if len(candidates) >= gb.GuideBuilder._PAIR_BATCH_SIZE:
+      builder.guidepairs += legacy_pairs_from_candidates(builder, candidates)
+      candidates = []
+
+    start_seqs += seq2.find_G_starts()
+
+    if seq2.gene_loc_frac > builder.settings['latest_gRNA2']:
+      break
+
+  builder.guidepairs += legacy_pairs_from_candidates(builder, candidates)
+  builder.sort_pairs(keystr="del_count")
+
+
+
+def legacy_pairs_from_candidates(builder, candidates):
+  """Returns the GuidePairs of the (seq1, seq2) candidates that delete enough exon bps."""
+
+  stats = gp.batch_deletion_stats(builder.get_exon_index(),
+                                  [seq1.cut_site for seq1, seq2 in candidates],
+                                  [seq2.cut_site for seq1, seq2 in candidates])
+  pairs = []
+  for k in range(len(candidates)):
+    if stats['deletion_count'][k] >= builder.settings['min_exon_deletion']:
+      pair = gp.GuidePair(*candidates[k])
+      pair.set_deletion_stats(int(stats['deletion_count'][k]),
+                              float(stats['deletion_fraction'][k]),
+                              int(stats['deletion_pct'][k]))
+      pairs.append(pair)
+  return pairs
+
+
+
+def pair_keys(pairs):
+  return [(p.seq1.sequence, p.seq1.gnm_loc, p.seq2.sequence, p.seq2.gnm_loc) for p in pairs]
+
+
+
+def run(n_rows, tmpdir):
+
+  # Dense guides and a wide window give large pairing windows
+  exon_edges = synthetic.make_exon_edges(40, exon_size=400, intron_size=1500)
+  filepath = os.path.join(tmpdir, 'synthetic_%d.txt' % n_rows)
+  synthetic.write_results_table(filepath, exon_edges, n_rows, g_start_rate=0.6)
+
+  settings = { 'input_file'        : filepath,
+               'CCDS_ID'           : 'CCDS0',
+               'strand'            : '+',
+               'separation_limit'  : 20000,
+               'latest_gRNA2'      : 1.0,
+               'min_exon_deletion' : 0 }
+
+  builder = gb.GuideBuilder(settings)
+  builder.set_exon_edges(exon_edges)
+
+  start = time.time()
+  legacy_build_pairs(builder)
+  legacy_time = time.time() - start
+  legacy_pairs = pair_keys(builder.get_pairs())
+
+  start = time.time()
+  builder.build_pairs()
+  current_time = time.time() - start
+  current_pairs = pair_keys(builder.get_pairs())
+
+  print '%8d rows %10d pairs   legacy %8.3fs   deque %8.3fs   speedup %5.2fx   %s' % (
+          len(builder.get_sequences()), len(current_pairs), legacy_time, current_time,
+          legacy_time / max(current_time, 1e-9),
+          'identical' if legacy_pairs == current_pairs else 'MISMATCH')
+
+
+
+if __name__ == '__main__':
+
+  sizes = [int(arg) for arg in sys.argv[1:]] or [500, 1000, 2000, 4000]
+
+  tmpdir = tempfile.mkdtemp()
+  try:
+    for n_rows in sizes:
+      run(n_rows, tmpdir)
+  finally:
+    shutil.rmtree(tmpdir)
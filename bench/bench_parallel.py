@@ -0,0 +1,78 @@
+#!/usr/bin/env python
+"""Benchmarks the parallel build_pairs (workers setting) against the serial
+build on large synthetic genes. Usage:
+  python bench_parallel.py [--workers N ...] [n_rows ...]
+"""
+
+import os
+import sys
+import time
+import shutil
+import argparse
+import tempfile
+import multiprocessing
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.realpath(__file__)), '..', 'src'))
+
+import guidebuilder as gb
+import synthetic
+
+
+
+def pair_keys(pairs):
+  return [(p.seq1.sequence, p.seq1.gnm_loc, p.seq2.sequence, p.seq2.gnm_loc) for p in pairs]
+
+
+
+def build(filepath, exon_edges, workers):
+
+  settings = { 'input_file'        : filepath,
+               'CCDS_ID'           : 'CCDS0',
+               'strand'            : '+',
+               'max_offtargets'    : (0, 1, 5, 20),
+               'separation_limit'  : 20000,
+               'latest_gRNA2'      : 1.0,
+               'workers'           : workers }
+
+  builder = gb.GuideBuilder(settings)
+  builder.set_exon_edges(exon_edges)
+
+  start = time.time()
+  builder.build_pairs()
+  return time.time() - start, pair_keys(builder.get_pairs())
+
+
+
+def run(n_rows, worker_counts, tmpdir):
+
+  exon_edges = synthetic.make_exon_edges(40, exon_size=400, intron_size=1500)
+  filepath = os.path.join(tmpdir, 'synthetic_%d.txt' % n_rows)
+  synthetic.write_results_table(filepath, exon_edges, n_rows, g_start_rate=0.6)
+
+  serial_time, serial_pairs = build(filepath, exon_edges, 1)
+  results = ['serial %7.2fs' % serial_time]
+
+  for workers in worker_counts:
+    parallel_time, parallel_pairs = build(filepath, exon_edges, workers)
+    results.append('%d workers %7.2fs (%4.2fx) %s' % (
+                    workers, parallel_time, serial_time / max(parallel_time, 1e-9),
+                    'identical' if parallel_pairs == serial_pairs else 'MISMATCH'))
+
+  print '%8d rows %10d pairs   %s' % (n_rows, len(serial_pairs), '   '.join(results))
+
+
+
+if __name__ == '__main__':
+
+  parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+  parser.add_argument('--workers', type=int, nargs='*',
+                      default=sorted(set([2, multiprocessing.cpu_count()])))
+  parser.add_argument('sizes', type=int, nargs='*', default=[2000, 4000])
+  args = parser.parse_args()
+
+  tmpdir = tempfile.mkdtemp()
+  try:
+    for n_rows in args.sizes:
+      run(n_rows, args.workers, tmpdir)
+  finally:
+    shutil.rmtree(tmpdir)
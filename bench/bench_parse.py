@@ -0,0 +1,59 @@
+#!/usr/bin/env python
+"""Benchmarks the chunk-parallel, memory-mapped results table reader
+against the serial reader on large synthetic tables. Usage:
+  python bench_parse.py [--workers N ...] [n_rows ...]
+"""
+
+import os
+import sys
+import time
+import shutil
+import argparse
+import tempfile
+import multiprocessing
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.realpath(__file__)), '..', 'src'))
+
+import tablecache as tc
+import synthetic
+
+
+
+def run(n_rows, worker_counts, tmpdir):
+
+  exon_edges = synthetic.make_exon_edges(2000)
+  filepath = os.path.join(tmpdir, 'synthetic_%d.txt' % n_rows)
+  synthetic.write_results_table(filepath, exon_edges, n_rows)
+  megabytes = os.path.getsize(filepath) / float(1 << 20)
+
+  start = time.time()
+  serial = tc.read_table(filepath)
+  serial_time = time.time() - start
+  results = ['serial %7.1f MB/s' % (megabytes / serial_time)]
+
+  for workers in worker_counts:
+    start = time.time()
+    parallel = tc.read_table(filepath, workers=workers)
+    parallel_time = time.time() - start
+    results.append('%d workers %7.1f MB/s (%4.2fx) %s' % (
+                    workers, megabytes / parallel_time, serial_time / parallel_time,
+                    'identical' if (parallel == serial).all() else 'MISMATCH'))
+
+  print '%9d rows %7.1f MB   %s' % (n_rows, megabytes, '   '.join(results))
+
+
+
+if __name__ == '__main__':
+
+  parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+  parser.add_argument('--workers', type=int, nargs='*',
+                      default=sorted(set([2, multiprocessing.cpu_count()])))
+  parser.add_argument('sizes', type=int, nargs='*', default=[200000, 1000000])
+  args = parser.parse_args()
+
+  tmpdir = tempfile.mkdtemp()
+  try:
+    for n_rows in args.sizes:
+      run(n_rows, args.workers, tmpdir)
+  finally:
+    shutil.rmtree(tmpdir)
@@ -0,0 +1,199 @@
+#!/usr/bin/env python
+"""Benchmarks the stages of the read / pair / write pipeline on synthetic
+genes of increasing size and reports them as JSON. Each case runs in a fresh
+process so that its peak memory is its own. Usage:
+  python bench_pipeline.py [--rows N ...] [--density D ...] [--exons N]
+                           [--strand +|-] [--json FILE] [--compare OLD_JSON]
+Timed stages: GuideBuilder.read, set_exon_edges, build_pairs (unsorted),
+sort_pairs and OutputFormatter.write. Peak RSS (kB) is reported after each
+stage. With --compare, the stage times are compared to an earlier report.
+"""
+
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import platform
+import resource
+import tempfile
+import subprocess
+import multiprocessing
+
+bench_dir = os.path.dirname(os.path.realpath(__file__))
+sys.path.insert(0, os.path.join(bench_dir, '..', 'src'))
+
+import guidebuilder as gb
+import outputformatter as of
+import synthetic
+
+
+STAGES = ['read', 'set_exon_edges', 'build_pairs', 'sort_pairs', 'write']
+
+# Stage times that grow by more than this factor are flagged by --compare
+REGRESSION_FACTOR = 1.25
+
+
+
+def peak_rss():
+  return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+
+def measure(case, tmpdir, queue):
+  """Runs every stage of the pipeline for one case (in a fresh process) and
+  reports the wall time and peak RSS after each stage."""
+
+  exon_edges = synthetic.make_exon_edges(case['exons'])
+  n_rows = case['rows']
+  if n_rows is None:
+    n_rows = synthetic.rows_for_density(exon_edges, case['density'])
+
+  input_file = os.path.join(tmpdir, 'synthetic_%d.txt' % n_rows)
+  synthetic.write_results_table(input_file, exon_edges, n_rows, gene_strand=case['strand'])
+
+  settings = { 'input_file'        : input_file,
+               'CCDS_ID'           : 'CCDS0',
+               'strand'            : case['strand'],
+               'max_offtargets'    : (0, 1, 5, 20),
+               'separation_limit'  : case['separation_limit'],
+               'latest_gRNA2'      : 1.0,
+               'sort_key'          : 'none' }
+
+  stages = {}
+  def timed(name, function, *args):
+    start = time.time()
+    result = function(*args)
+    stages[name] = { 'seconds'     : round(time.time() - start, 6) ,
+                     'peak_rss_kb' : peak_rss() }
+    return result
+
+  # The constructor's read warms the file cache, so the timed read measures parsing
+  builder = gb.GuideBuilder(settings)
+  timed('read', builder.read)
+  timed('set_exon_edges', builder.set_exon_edges, exon_edges)
+  timed('build_pairs', builder.build_pairs)
+  timed('sort_pairs', builder.sort_pairs, 'deletion_count')
+
+  outputter = of.OutputFormatter(os.path.join(bench_dir, '..', 'gene_block_constants.const'))
+  output_file = os.path.join(tmpdir, 'synthetic_%d_pairs.csv' % n_rows)
+  timed('write', outputter.write, builder.get_pairs(), output_file)
+
+  n_pairs = len(builder.get_pairs())
+  total = sum(stage['seconds'] for stage in stages.values())
+
+  result = dict(case)
+  result.update({ 'rows'               : n_rows ,
+                  'sequences'          : len(builder.get_sequences()) ,
+                  'pairs'              : n_pairs ,
+                  'stages'             : stages ,
+                  'total_seconds'      : round(total, 6) ,
+                  'peak_rss_kb'        : peak_rss() ,
+                  'pairs_per_second'   : round(n_pairs / max(stages['build_pairs']['seconds'], 1e-9), 1) ,
+                  'output_bytes'       : os.path.getsize(output_file) if n_pairs > 0 else 0 })
+  queue.put(result)
+
+
+
+def run_in_process(case, tmpdir):
+  queue = multiprocessing.Queue()
+  process = multiprocessing.Process(target=measure, args=(case, tmpdir, queue))
+  process.start()
+  result = queue.get()
+  process.join()
+  return result
+
+
+
+def git_revision():
+  try:
+    return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], cwd=bench_dir,
+                                   stderr=open(os.devnull, 'w')).strip()
+  except (OSError, subprocess.CalledProcessError):
+    return None
+
+
+
+def case_name(result):
+  return '%d rows / %d exons / %s strand' % (result['rows'], result['exons'], result['strand'])
+
+
+
+def compare(old_report, new_report):
+  """Prints the ratio of new to old stage times for the cases both reports
+  share. Returns the number of stages slower by more than REGRESSION_FACTOR."""
+
+  old_cases = dict((case_name(result), result) for result in old_report['cases'])
+
+  regressions = 0
+  for result in new_report['cases']:
+    old = old_cases.get(case_name(result))
+    if old is None:
+      continue
+    ratios = []
+    for stage in STAGES:
+      ratio = result['stages'][stage]['seconds'] / max(old['stages'][stage]['seconds'], 1e-9)
+      flag = ''
+      if ratio > REGRESSION_FACTOR and result['stages'][stage]['seconds'] > 0.05:
+        flag = '!'
+        regressions += 1
+      ratios.append('%s %.2fx%s' % (stage, ratio, flag))
+    print >>sys.stderr, '%-32s %s' % (case_name(result), '   '.join(ratios))
+
+  return regressions
+
+
+
+if __name__ == '__main__':
+
+  parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+  parser.add_argument('--rows', type=int, nargs='*', default=[],
+                      help='results table sizes in rows')
+  parser.add_argument('--density', type=float, nargs='*', default=[],
+                      help='results table sizes in guides per kbp of exon')
+  parser.add_argument('--exons', type=int, default=40, help='number of exons of the gene')
+  parser.add_argument('--strand', choices=['+', '-'], default='+', help='strand of the gene')
+  parser.add_argument('--separation-limit', type=int, default=10000,
+                      help='max separation between cut sites in bp')
+  parser.add_argument('--json', metavar='FILE', help='write the report to FILE (default: stdout)')
+  parser.add_argument('--compare', metavar='OLD_JSON', help='compare stage times to an earlier report')
+  args = parser.parse_args()
+
+  cases = ([{ 'rows' : rows, 'density' : None } for rows in args.rows] +
+           [{ 'rows' : None, 'density' : density } for density in args.density])
+  if len(cases) == 0:
+    cases = [{ 'rows' : rows, 'density' : None } for rows in [1000, 2000, 4000, 8000]]
+
+  for case in cases:
+    case.update({ 'exons'            : args.exons ,
+                  'strand'           : args.strand ,
+                  'separation_limit' : args.separation_limit })
+
+  report = { 'revision'  : git_revision() ,
+             'python'    : platform.python_version() ,
+             'platform'  : platform.platform() ,
+             'timestamp' : time.strftime('%Y-%m-%dT%H:%M:%S') ,
+             'cases'     : [] }
+
+  tmpdir = tempfile.mkdtemp()
+  try:
+    for case in cases:
+      result = run_in_process(case, tmpdir)
+      report['cases'].append(result)
+      print >>sys.stderr, '%-32s %9d pairs %8.3fs %9d kB %12.0f pairs/s' % (
+              case_name(result), result['pairs'], result['total_seconds'],
+              result['peak_rss_kb'], result['pairs_per_second'])
+  finally:
+    shutil.rmtree(tmpdir)
+
+  if args.json is not None:
+    with open(args.json, 'w') as outfile:
+      json.dump(report, outfile, indent=2, sort_keys=True)
+  else:
+    print json.dumps(report, indent=2, sort_keys=True)
+
+  if args.compare is not None:
+    with open(args.compare, 'r') as infile:
+      if compare(json.load(infile), report) > 0:
+        sys.exit(1)
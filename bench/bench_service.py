@@ -0,0 +1,94 @@
+#!/usr/bin/env python
+"""Benchmarks the per-gene latency of service mode against one pair-guides
+process per gene. Exon edges come from a synthetic annotation file, so no
+network access is needed. Usage:
+  python bench_service.py [n_rows ...]
+"""
+
+import os
+import sys
+import time
+import shutil
+import tempfile
+import threading
+import subprocess
+
+src_dir = os.path.join(os.path.dirname(os.path.realpath(__file__)), '..', 'src')
+sys.path.insert(0, src_dir)
+
+import service as svc
+import synthetic
+
+
+
+# Requests timed per run
+N_REQUESTS = 5
+
+
+
+def write_gtf(filepath, exon_edges):
+  with open(filepath, 'w') as gtf:
+    for first, last in exon_edges:
+      # Annotation coordinates are 1-based
+      gtf.write('\t'.join(['chr1', 'SYN', 'CDS', str(first + 1), str(last + 1), '.', '+', '0',
+                           'gene_id "G0"; ccdsid "CCDS1.1";']) + '\n')
+
+
+
+def run(n_rows, tmpdir, address):
+
+  exon_edges = synthetic.make_exon_edges(20)
+  results_file = os.path.join(tmpdir, 'synthetic_%d.txt' % n_rows)
+  synthetic.write_results_table(results_file, exon_edges, n_rows)
+
+  values = { 'CCDS_ID'          : 'CCDS1',
+             'input_file'       : results_file,
+             'annotation_file'  : os.path.join(tmpdir, 'synthetic.gtf'),
+             'ccds_cache_dir'   : os.path.join(tmpdir, 'cache'),
+             'table_cache_dir'  : os.path.join(tmpdir, 'cache'),
+             'max_offtargets'   : '0 1 5 20' }
+
+  settings_file = os.path.join(tmpdir, 'settings_%d.inp' % n_rows)
+  with open(settings_file, 'w') as settings:
+    for key, value in values.items():
+      settings.write('%s %s\n' % (key, value))
+
+  # Warms the table cache and annotation index for both modes
+  svc.request(address, values)
+
+  start = time.time()
+  for n in xrange(N_REQUESTS):
+    subprocess.check_call([sys.executable, os.path.join(src_dir, 'pair-guides.py'), settings_file],
+                          stdout=open(os.devnull, 'w'), stderr=subprocess.STDOUT)
+  process_time = (time.time() - start) / N_REQUESTS
+
+  start = time.time()
+  for n in xrange(N_REQUESTS):
+    response = svc.request(address, values)
+  service_time = (time.time() - start) / N_REQUESTS
+
+  print '%8d rows %8d pairs   process per gene %7.3fs   service %7.3fs   (%5.1fx)' % (
+          n_rows, response['pairs'], process_time, service_time, process_time / service_time)
+
+
+
+if __name__ == '__main__':
+
+  sizes = [int(arg) for arg in sys.argv[1:]] or [200, 2000]
+
+  tmpdir = tempfile.mkdtemp()
+  try:
+    write_gtf(os.path.join(tmpdir, 'synthetic.gtf'), synthetic.make_exon_edges(20))
+    address = os.path.join(tmpdir, 'service.sock')
+
+    service = svc.PairService(os.path.join(src_dir, '..', 'gene_block_constants.const'))
+    thread = threading.Thread(target=service.serve, args=(address,))
+    thread.daemon = True
+    thread.start()
+    while not os.path.exists(address):
+      time.sleep(0.01)
+
+    for n_rows in sizes:
+      run(n_rows, tmpdir, address)
+  finally:
+    shutil.rmtree(tmpdir)
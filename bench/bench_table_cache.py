@@ -0,0 +1,72 @@
+#!/usr/bin/env python
+"""Benchmarks loading parsed ChopChop tables from the binary table cache
+against parsing the text tables. Usage:
+  python bench_table_cache.py [n_rows ...]
+"""
+
+import os
+import sys
+import time
+import shutil
+import tempfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.realpath(__file__)), '..', 'src'))
+
+import guidebuilder as gb
+import tablecache as tc
+import synthetic
+
+
+
+def run(n_rows, tmpdir):
+
+  exon_edges = synthetic.make_exon_edges(200)
+  filepath = os.path.join(tmpdir, 'synthetic_%d.txt' % n_rows)
+  synthetic.write_results_table(filepath, exon_edges, n_rows)
+
+  cache_dir = os.path.join(tmpdir, 'cache_%d' % n_rows)
+  cache = tc.TableCache(cache_dir)
+
+  start = time.time()
+  records = tc.read_table(filepath)
+  parse_time = time.time() - start
+
+  start = time.time()
+  key = tc.file_key(filepath)
+  hash_time = time.time() - start
+
+  cache.put(key, records)
+
+  start = time.time()
+  cached = cache.get(key)
+  load_time = time.time() - start
+
+  # Full GuideBuilder reads without and with the cache (the cache is warm)
+  read_times = []
+  for table_cache_dir in ['none', cache_dir]:
+    settings = { 'input_file'      : filepath,
+                 'CCDS_ID'         : 'CCDS0',
+                 'strand'          : '+',
+                 'max_offtargets'  : (0, 1, 5, 20),
+                 'table_cache_dir' : table_cache_dir }
+    start = time.time()
+    gb.GuideBuilder(settings)
+    read_times.append(time.time() - start)
+
+  print '%8d rows   parse %8.1f ms   hash %6.1f ms   cached load %6.2f ms   read() %7.3fs -> %7.3fs   %s' % (
+          n_rows, parse_time * 1000, hash_time * 1000, load_time * 1000,
+          read_times[0], read_times[1],
+          'identical' if (cached == records).all() else 'MISMATCH')
+
+
+
+if __name__ == '__main__':
+
+  sizes = [int(arg) for arg in sys.argv[1:]] or [10000, 100000]
+
+  tmpdir = tempfile.mkdtemp()
+  try:
+    for n_rows in sizes:
+      run(n_rows, tmpdir)
+  finally:
+    shutil.rmtree(tmpdir)
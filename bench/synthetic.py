@@ -0,0 +1,104 @@
+import random
+
+
+# Column header of a ChopChop results table
+HEADER = ['Rank', 'Target sequence', 'Genomic location', 'Exon', 'Strand',
+          'GC content (%)', 'Self-complementarity', 'MM0', 'MM1', 'MM2', 'MM3',
+          'Efficiency']
+
+
+
+def make_exon_edges(n_exons, exon_size=150, intron_size=3000, start=1000000, seed=0):
+  """Returns a list of n_exons (first, last) exon edge tuples (INCLUSIVE).
+  Exon and intron sizes vary by up to 50% around the given sizes."""
+
+  rng = random.Random(seed)
+
+  edges = []
+  pos = start
+  for i in xrange(n_exons):
+    size = rng.randint(exon_size // 2, exon_size * 3 // 2)
+    edges.append((pos, pos + size - 1))
+    pos += size + rng.randint(intron_size // 2, intron_size * 3 // 2)
+  return edges
+
+
+
+def rows_for_density(exon_edges, density):
+  """Returns the number of rows that gives density guides per kbp of exon."""
+
+  total = sum(edge[1] - edge[0] for edge in exon_edges)
+  return max(int(round(density * total / 1000.0)), 1)
+
+
+
+def make_rows(exon_edges, n_rows, chromosome='chr1', gene_strand='+', g_start_rate=0.5,
+              offtarget_rate=0.2, guide_length=20, seed=0):
+  """Returns n_rows ChopChop results rows (lists of column strings) for guides
+  whose cut sites fall inside the given exons. Guides lie on the gene strand
+  with the given probability skew and start with G at roughly g_start_rate."""
+
+  rng = random.Random(seed)
+
+  exon_sizes = [edge[1] - edge[0] for edge in exon_edges]
+  total = sum(exon_sizes)
+
+  rows = []
+  for rank in xrange(1, n_rows + 1):
+
+    # Picks a cut site uniformly over the exon content
+    offset = rng.randrange(total)
+    for exon_num, size in enumerate(exon_sizes):
+      if offset < size:
+        break
+      offset -= size
+    cut_site = exon_edges[exon_num][0] + offset
+
+    strand = gene_strand if rng.random() < 0.5 else ('-' if gene_strand == '+' else '+')
+    gnm_loc = cut_site - (guide_length - 4 if strand == '+' else 5)
+
+    bases = [rng.choice('ACGT') for i in xrange(guide_length)]
+    bases[0] = 'G' if rng.random() < g_start_rate else rng.choice('ACT')
+    sequence = ''.join(bases) + rng.choice('ACGT') + 'GG'
+
+    gc_content = int(round(100 * (sequence.count('G') + sequence.count('C')) / len(sequence)))
+    offtargets = [(rng.randint(1, 3) if rng.random() < offtarget_rate else 0) for i in xrange(4)]
+
+    rows.append([str(rank), sequence, '%s:%d' % (chromosome, gnm_loc), str(exon_num + 1),
+                 strand, str(gc_content), '0'] + [str(n) for n in offtargets] +
+                ['%.2f' % rng.random()])
+  return rows
+
+
+
+def write_results_table(filepath, exon_edges, n_rows, **kwargs):
+  """Writes a synthetic ChopChop results table to filepath.
+  Keyword arguments are passed to make_rows()."""
+
+  with open(filepath, 'w') as outfile:
+    outfile.write('\t'.join(HEADER) + '\n')
+    for row in make_rows(exon_edges, n_rows, **kwargs):
+      outfile.write('\t'.join(row) + '\n')
+
+
+
+def make_ccds_page(exon_edges, strand='+', chromosome='1', filler_rows=2000):
+  """Returns the HTML of a page laid out like a CCDS browser report for the
+  given exon edges and strand. filler_rows rows of unrelated tables pad the
+  page out to the size of a real report."""
+
+  filler = '\n'.join('<tr><td><a href="#r%d">Row %d</a></td><td><b>Field</b> value %d</td></tr>'
+                     % (i, i, i) for i in xrange(filler_rows))
+
+  exon_rows = '\n'.join('<tr><td>%d</td><td>%d</td><td>%d</td><td>%d</td><td>%d</td></tr>'
+                        % (i + 1, start, end, end + 1 - start, 0)
+                        for i, (start, end) in enumerate(exon_edges))
+
+  return ('<html><head><title>CCDS Report for Consensus CDS</title></head><body>\n'
+          '<table>%s</table>\n'
+          '<p><b>Chromosome:</b> %s</p>\n'
+          "<p><b>Located on the '%s' strand of chromosome %s</b></p>\n"
+          '<table><tr><th>Exon</th><th><small>Chromosome</small></th><th></th>'
+          '<th>Length</th><th>Frame</th></tr>\n%s</table>\n'
+          '<table>%s</table>\n'
+          '</body></html>\n') % (filler, chromosome, strand, chromosome, exon_rows, filler)
@@ -76,13 +76,13 @@ source ~/.bashrc
 
 
 
-# easy_installs requests, bs4, lxml on OS X systems
+# easy_installs requests, lxml, numpy on OS X systems
 # pip installs the same modules on Linux systems
 echo "Installing python modules."
 if [[ $OSTYPE == darwin* ]] ; then
-  sudo easy_install requests bs4 lxml
+  sudo easy_install requests lxml numpy
 elif [[ $OSTYPE == linux* ]] ; then
-  pip install requests bs4 lxml
+  pip install requests lxml numpy
 fi
 
 
@@ -0,0 +1,283 @@
+import log
+import os
+import re
+import gzip
+import json
+import sqlite3
+import hashlib
+import tempfile
+
+
+class AnnotationIndex(object):
+  """A persistent SQLite index of the CCDS entries (exon edges, strand and
+  chromosome) of a local GTF, GFF3 or GenBank annotation file. The index is
+  built in one pass over the annotation the first time it is opened and
+  rebuilt whenever the annotation file changes.
+
+  The exons of a CCDS entry are the coding (CDS and stop codon) features
+  tagged with its CCDS id. Annotations are 1-based, so the edges are moved
+  to the 0-based coordinates of the CCDS pages.
+  Usage:
+    index = AnnotationIndex('gencode.gtf.gz', '~/.pair-guides')
+    exon_edges, strand, chrom = index.get('7612', '1')
+  """
+
+  SUBDIR = 'annotations'
+
+  # Bumped whenever the index layout or the parsing changes
+  FORMAT_VERSION = 1
+
+  # Added to annotation coordinates to give CCDS page coordinates
+  COORDINATE_OFFSET = -1
+
+  # Features whose spans make up the CCDS exons
+  CODING_FEATURES = ['CDS', 'stop_codon']
+
+  _CCDS_PATTERN = re.compile(r'CCDS(\d+)(?:\.(\d+))?')
+
+  def __init__(self, annotation_file, cache_dir):
+
+    self.logger = log.getLogger(__name__)
+
+    self.annotation_file = os.path.realpath(os.path.expanduser(annotation_file))
+
+    index_dir = os.path.join(os.path.expanduser(cache_dir), AnnotationIndex.SUBDIR)
+    if not os.path.isdir(index_dir):
+      try:
+        os.makedirs(index_dir)
+      except OSError:
+        # Another process may have created it first
+        if not os.path.isdir(index_dir):
+          raise
+
+    name = hashlib.sha1(self.annotation_file).hexdigest()[:16]
+    self.filepath = os.path.join(index_dir, '%s.v%d.sqlite' % (name, AnnotationIndex.FORMAT_VERSION))
+
+    if self._source_stamp() != self._indexed_stamp():
+      self.build()
+
+
+
+  def _connect(self, filepath=None):
+    # A new connection is opened for each operation so that the index can be
+    # shared across threads and processes.
+    return sqlite3.connect(filepath or self.filepath, timeout=30)
+
+
+
+  def _source_stamp(self):
+    """Returns the path, size and modification time of the annotation file."""
+    stat = os.stat(self.annotation_file)
+    return json.dumps([self.annotation_file, stat.st_size, stat.st_mtime])
+
+
+
+  def _indexed_stamp(self):
+    """Returns the stamp of the annotation file the index was built from,
+    or None if there is no readable index."""
+
+    if not os.path.exists(self.filepath):
+      return
+
+    conn = self._connect()
+    try:
+      row = conn.execute("SELECT value FROM meta WHERE key = 'source'").fetchone()
+    except sqlite3.DatabaseError:
+      return
+    finally:
+      conn.close()
+
+    return row[0] if row is not None else None
+
+
+
+  def build(self):
+    """Parses the annotation file and writes the index of its CCDS entries."""
+
+    self.logger.info('Indexing CCDS entries of %s' % os.path.basename(self.annotation_file))
+
+    exons = {}
+    for ccds_id, version, chrom, strand, first, last in self._iter_features():
+      entry = exons.setdefault((ccds_id, version), [chrom, strand, set()])
+      entry[2].add((first + AnnotationIndex.COORDINATE_OFFSET,
+                    last + AnnotationIndex.COORDINATE_OFFSET))
+
+    # Writes to a temporary file first so that readers never see a partial index
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(self.filepath), suffix='.tmp')
+    os.close(fd)
+    conn = self._connect(tmp_path)
+    try:
+      with conn:
+        conn.execute('CREATE TABLE meta (key TEXT PRIMARY KEY, value TEXT)')
+        conn.execute('CREATE TABLE entries ('
+                     '  ccds_id TEXT, version TEXT, chrom TEXT, strand TEXT, exon_edges TEXT,'
+                     '  PRIMARY KEY (ccds_id, version))')
+        conn.executemany('INSERT INTO entries VALUES (?, ?, ?, ?, ?)',
+                         ((ccds_id, version, chrom, strand, json.dumps(self._merge(spans)))
+                          for (ccds_id, version), (chrom, strand, spans) in exons.items()))
+        conn.execute("INSERT INTO meta VALUES ('source', ?)", (self._source_stamp(),))
+    finally:
+      conn.close()
+    os.rename(tmp_path, self.filepath)
+
+    self.logger.info('Indexed %d CCDS entries' % len(exons))
+
+
+
+  @staticmethod
+  def _merge(spans):
+    """Returns the sorted (first, last) exon edges (INCLUSIVE) covered by a set
+    of feature spans. Overlapping and adjacent spans, such as a CDS and its
+    stop codon, are merged into one exon."""
+
+    edges = []
+    for first, last in sorted(spans):
+      if len(edges) > 0 and first <= edges[-1][1] + 1:
+        edges[-1][1] = max(edges[-1][1], last)
+      else:
+        edges.append([first, last])
+    return edges
+
+
+
+  def get(self, ccds_id, version=''):
+    """Returns the (exon_edges, strand, chrom) of a CCDS id (digits only) and
+    version, or None if the annotation has no such entry. Without a version,
+    the latest version in the annotation is returned."""
+
+    conn = self._connect()
+    try:
+      if version:
+        rows = conn.execute('SELECT exon_edges, strand, chrom, version FROM entries '
+                            'WHERE ccds_id = ? AND version = ?', (ccds_id, version)).fetchall()
+      else:
+        rows = conn.execute('SELECT exon_edges, strand, chrom, version FROM entries '
+                            'WHERE ccds_id = ?', (ccds_id,)).fetchall()
+    finally:
+      conn.close()
+
+    if len(rows) == 0:
+      return
+
+    row = max(rows, key=lambda row: int(row[3]) if row[3].isdigit() else -1)
+    return [tuple(edge) for edge in json.loads(row[0])], str(row[1]), str(row[2])
+
+
+
+  def _open(self):
+    if self.annotation_file.endswith('.gz'):
+      return gzip.open(self.annotation_file, 'rb')
+    return open(self.annotation_file, 'r')
+
+
+
+  def _iter_features(self):
+    """Generator that yields the (ccds_id, version, chrom, strand, first, last)
+    of each coding feature of the annotation tagged with a CCDS id."""
+
+    name = self.annotation_file[:-3] if self.annotation_file.endswith('.gz') else self.annotation_file
+    if name.split('.')[-1].lower() in ['gb', 'gbk', 'gbff', 'genbank']:
+      features = self._iter_genbank_features()
+    else:
+      features = self._iter_gff_features()
+
+    for feature in features:
+      yield feature
+
+
+
+  def _iter_gff_features(self):
+    """Reads the CCDS-tagged coding features of a GTF or GFF3 file. The CCDS
+    id is found in the attributes column (ccdsid "CCDS7612.1" in GTF or
+    Dbxref=CCDS:CCDS7612.1 in GFF3)."""
+
+    with self._open() as annotation:
+      for line in annotation:
+
+        if line.startswith('#'):
+          continue
+
+        columns = line.rstrip('\n').split('\t')
+        if len(columns) < 9 or columns[2] not in AnnotationIndex.CODING_FEATURES:
+          continue
+
+        match = AnnotationIndex._CCDS_PATTERN.search(columns[8])
+        if match is None:
+          continue
+
+        yield (match.group(1), match.group(2) or '', columns[0], columns[6],
+               int(columns[3]), int(columns[4]))
+
+
+
+  def _iter_genbank_features(self):
+    """Reads the CCDS-tagged CDS features of a GenBank file. The CCDS id is
+    given by a /db_xref="CCDS:CCDS7612.1" qualifier and the exons by the
+    join() location of the feature."""
+
+    chrom = None
+    feature = None
+    in_features = False
+
+    with self._open() as annotation:
+      for line in annotation:
+
+        if line.startswith('LOCUS'):
+          chrom = line.split()[1]
+          continue
+
+        if not line.startswith('     '):
+          # Only the FEATURES section is read; the next header line ends it
+          for entry in self._genbank_entries(feature, chrom):
+            yield entry
+          feature = None
+          in_features = line.startswith('FEATURES')
+          continue
+
+        if not in_features:
+          continue
+
+        key, value = line[5:21].strip(), line[21:].strip()
+
+        if key:
+          for entry in self._genbank_entries(feature, chrom):
+            yield entry
+          feature = { 'key' : key, 'location' : value, 'qualifiers' : [] }
+
+        elif feature is not None:
+          if value.startswith('/'):
+            feature['qualifiers'].append(value)
+          elif len(feature['qualifiers']) == 0:
+            feature['location'] += value
+          else:
+            feature['qualifiers'][-1] += value
+
+          # The source feature names the chromosome of the record
+          if feature['key'] == 'source' and value.startswith('/chromosome='):
+            chrom = 'chr' + value.split('=')[1].strip('"')
+
+      for entry in self._genbank_entries(feature, chrom):
+        yield entry
+
+
+
+  @staticmethod
+  def _genbank_entries(feature, chrom):
+    """Returns the feature tuples of a parsed GenBank CDS feature."""
+
+    if feature is None or feature['key'] != 'CDS':
+      return []
+
+    match = None
+    for qualifier in feature['qualifiers']:
+      if qualifier.startswith('/db_xref="CCDS:'):
+        match = AnnotationIndex._CCDS_PATTERN.search(qualifier)
+    if match is None:
+      return []
+
+    location = feature['location']
+    strand = '-' if location.startswith('complement(') else '+'
+    spans = re.findall(r'<?(\d+)\.\.>?(\d+)', location)
+
+    return [(match.group(1), match.group(2) or '', chrom, strand, int(first), int(last))
+            for first, last in spans]
@@ -0,0 +1,104 @@
+#!/usr/bin/env python
+
+import ccdsloader as ccds
+import annotationindex as ai
+
+
+class AnnotationLoader(ccds.CcdsLoader):
+  """A CcdsLoader that reads CCDS entries from a local GTF, GFF3 or GenBank
+  annotation file instead of the NCBI pages, with no network access.
+  The annotation is indexed once (see AnnotationIndex) and entries are then
+  looked up in the index. The chromosome of the entry is assigned to the
+  chromosome setting if it is not set, for genome-wide results files.
+  Usage:
+    loader = AnnotationLoader('gencode.gtf.gz')
+    loader.load(settings)
+    loader.get_exon_edges()
+  """
+
+  def __init__(self, annotation_file, settings=None, cache_dir=None, profile=None):
+
+    self.annotation_file = annotation_file
+
+    # The index is kept in the CCDS cache directory unless one is given
+    if cache_dir is None:
+      cache_dir = (settings or {}).get('ccds_cache_dir', ccds.CcdsLoader._DEFAULTS['ccds_cache_dir'])
+    # The index is kept even if the CCDS cache is disabled ('none')
+    if str(cache_dir).lower() == 'none':
+      cache_dir = ccds.CcdsLoader._DEFAULTS['ccds_cache_dir']
+    self.index = ai.AnnotationIndex(annotation_file, cache_dir)
+
+    self.chromosome = None
+
+    super(AnnotationLoader, self).__init__(settings=settings, profile=profile)
+
+
+
+  def _load(self, settings):
+    self.exon_edges = None
+    self.exon_index = None
+    self.strand = None
+    self.chromosome = None
+
+    self.settings = settings
+
+    self._fill_defaults(self.settings)
+
+    self.ccds_id = self.settings['CCDS_ID']
+    self._clean_id()
+    if not self.valid_id:
+      return
+
+    entry = self.index.get(self.ccds_id, self.ccds_version)
+    if entry is None:
+      self.logger.error("Cannot load CCDS%s: no entry in %s" % (self.ccds_id, self.annotation_file))
+      return
+
+    self.exon_edges, self.strand, self.chromosome = entry
+    self.profile.count('annotation_entries_loaded')
+    self.logger.info("CCDS%s entry loaded from annotation" % self.ccds_id)
+
+    self._add_strand_to_settings()
+
+    if self.settings.get('chromosome') is None:
+      self.settings['chromosome'] = self.chromosome
+
+
+
+  def load_many(self, ccds_ids, settings=None):
+    """Loads many CCDS entries from the annotation index. Returns a dict that
+    maps each given id to its (exon_edges, strand), or to None if the entry
+    is not in the annotation. Unlike load(), this does not assign settings."""
+
+    if settings is not None:
+      self.settings = settings
+    if self.settings is None:
+      self.settings = {}
+    self._fill_defaults(self.settings)
+
+    entries = {}
+    for ccds_id in ccds_ids:
+      key = self._split_id(ccds_id)
+      if key is None:
+        self.logger.warning("Cannot load %s: invalid CCDS id" % ccds_id)
+        entries[ccds_id] = None
+        continue
+
+      entry = self.index.get(*key)
+      entries[ccds_id] = entry[:2] if entry is not None else None
+
+    self.logger.info("Loaded %d of %d CCDS entries from annotation" %
+                     (len([entry for entry in entries.values() if entry is not None]), len(entries)))
+
+    return entries
+
+
+
+  def get_chromosome(self):
+    """Reports the chromosome of the loaded entry as named in the annotation."""
+
+    if self.chromosome is None or not(self.valid_id):
+      self.logger.warning("Cannot get chromosome: no CCDS entry loaded")
+      return
+
+    return self.chromosome
@@ -0,0 +1,219 @@
+import log
+import os
+import csv
+import copy
+import time
+import traceback
+import collections
+import multiprocessing
+import exonindex as ei
+import settingsreader as sr
+import pipeline
+
+
+class BatchRunner(object):
+  """Runs pair-guides for many genes listed in a manifest file.
+  Each manifest line holds either the path to a settings file or a
+  CCDS_ID and input_file (with an optional output_file). Relative paths
+  are taken relative to the manifest or settings file that gives them.
+  CCDS entries are fetched concurrently up front (once for each set of
+  CCDS loading settings among the genes), strand conflicts are resolved by
+  the strand_conflict policy and the genes are paired over a process pool.
+  One output is written per gene along with a summary table, which also
+  reports the manifest lines that could not be read.
+  Usage:
+    runner = BatchRunner(constants_file, defaults_file)
+    runner.read(manifest_file)
+    runner.run(summary_file)
+  """
+
+  SUMMARY_FIELDS = ['CCDS_ID', 'input_file', 'output_file', 'strand',
+                    'sequences', 'pairs', 'seconds', 'status', 'cached']
+
+  # Settings that decide how the CCDS entries of a gene are loaded
+  LOADER_SETTINGS = ['annotation_file', 'offline', 'ccds_cache_dir', 'ccds_cache_ttl',
+                     'ccds_cache_size', 'ccds_workers', 'ccds_retries']
+
+  def __init__(self, constants_file, defaults_file=None, workers=None):
+
+    self.logger = log.getLogger(__name__)
+
+    self.constants_file = constants_file
+    self.workers = workers if workers else multiprocessing.cpu_count()
+
+    # Settings shared by every gene (e.g. max_offtargets) can be given in a
+    # settings file. Manifest rows override them.
+    self.defaults = {}
+    if defaults_file is not None:
+      self.defaults = sr.SettingsReader(defaults_file).settings
+      for key in ['CCDS_ID', 'input_file', 'output_file']:
+        self.defaults.pop(key, None)
+
+    self.jobs = []
+
+    # The summaries of the manifest lines that could not be read
+    self.rejected = []
+
+
+
+  def read(self, manifest_file):
+    """Reads the settings of each gene listed in the manifest file. Lines
+    that cannot be read are logged and reported in the run summaries."""
+
+    self.jobs = []
+    self.rejected = []
+    manifest_dir = os.path.dirname(os.path.abspath(manifest_file))
+
+    with open(manifest_file, 'r') as manifest:
+      for line_number, line in enumerate(manifest, 1):
+
+        # Strips all text after the first hash mark
+        if line.find('#') >= 0:
+          line = line[ : line.find('#')]
+
+        tokens = line.strip().split()
+
+        if len(tokens) == 0:
+          continue
+
+        settings = copy.deepcopy(self.defaults)
+
+        if len(tokens) == 1:
+          settings_file = self._resolve(manifest_dir, tokens[0])
+          settings_dir = os.path.dirname(settings_file)
+
+          try:
+            gene_settings = sr.SettingsReader(settings_file).settings
+          except IOError as e:
+            self._reject(manifest_file, line_number, {}, 'cannot read %s: %s' % (tokens[0], e.strerror))
+            continue
+          missing = [key for key in ['CCDS_ID', 'input_file'] if key not in gene_settings]
+          if len(missing) > 0:
+            self._reject(manifest_file, line_number, gene_settings,
+                         'no %s in %s' % (' or '.join(missing), tokens[0]))
+            continue
+
+          settings.update(gene_settings)
+          for key in ['input_file', 'output_file', 'annotation_file']:
+            if key in gene_settings:
+              settings[key] = self._resolve(settings_dir, settings[key])
+
+        else:
+          settings['CCDS_ID'] = tokens[0]
+          settings['input_file'] = self._resolve(manifest_dir, tokens[1])
+          if len(tokens) >= 3:
+            settings['output_file'] = self._resolve(manifest_dir, tokens[2])
+          else:
+            settings['output_file'] = sr.SettingsReader.default_output_file(settings['input_file'],
+                                                                               settings.get('output_format'))
+
+        self.jobs.append(settings)
+
+    self.logger.info('Read %d genes from %s' % (len(self.jobs), manifest_file))
+
+
+
+  def _reject(self, manifest_file, line_number, settings, reason):
+    """Logs a manifest line that cannot be read and keeps its error summary."""
+
+    self.logger.error('Skipping line %d of %s: %s' % (line_number, manifest_file, reason))
+    self.rejected.append({ 'CCDS_ID'    : settings.get('CCDS_ID', '') ,
+                           'input_file' : settings.get('input_file', '') ,
+                           'status'     : 'error: manifest line %d: %s' % (line_number, reason) })
+
+
+
+  @staticmethod
+  def _resolve(base_dir, path):
+    return os.path.normpath(os.path.join(base_dir, os.path.expanduser(path)))
+
+
+
+  def run(self, summary_file=None):
+    """Pairs the guides of every gene and returns the list of run summaries,
+    followed by those of the manifest lines that could not be read. Writes
+    the summaries to summary_file if given."""
+
+    start = time.time()
+
+    for settings in self.jobs:
+      # Batch runs cannot stop to ask about strand conflicts
+      if settings.get('strand_conflict', 'ask') == 'ask':
+        settings['strand_conflict'] = 'ccds'
+
+      # Genes are already paired in parallel, and pool workers cannot start pools
+      settings['workers'] = 1
+
+    # Genes whose settings load CCDS entries the same way are loaded together
+    groups = collections.OrderedDict()
+    for n, settings in enumerate(self.jobs):
+      key = tuple(settings.get(name) for name in BatchRunner.LOADER_SETTINGS)
+      groups.setdefault(key, []).append(n)
+
+    # Fetches every CCDS entry concurrently before any pairing starts
+    entries = [None] * len(self.jobs)
+    for key, jobs in groups.items():
+      loader_settings = dict((name, value) for name, value in zip(BatchRunner.LOADER_SETTINGS, key)
+                             if value is not None)
+      loader = pipeline.make_loader(loader_settings)
+      loaded = loader.load_many([self.jobs[n]['CCDS_ID'] for n in jobs], loader_settings)
+
+      for n in jobs:
+        entries[n] = loaded.get(self.jobs[n]['CCDS_ID'])
+        if entries[n] is not None:
+          loader.assign_strand(self.jobs[n], entries[n][1])
+
+    tasks = [(settings, self.constants_file, entry) for settings, entry in zip(self.jobs, entries)]
+
+    pool = multiprocessing.Pool(min(self.workers, max(len(tasks), 1)))
+    try:
+      summaries = pool.map(_run_task, tasks, chunksize=1)
+    finally:
+      pool.close()
+      pool.join()
+    summaries += self.rejected
+
+    n_ok = len([summary for summary in summaries if summary['status'] == 'ok'])
+    self.logger.info('Paired %d of %d genes in %.1f s' %
+                     (n_ok, len(summaries), time.time() - start))
+
+    if summary_file is not None:
+      self.write_summary(summaries, summary_file)
+
+    return summaries
+
+
+
+  def write_summary(self, summaries, summary_file):
+    """Writes the run summaries to a csv table."""
+
+    with open(summary_file, 'w') as outfile:
+      writer = csv.writer(outfile, dialect='excel')
+      writer.writerow(BatchRunner.SUMMARY_FIELDS)
+      for summary in summaries:
+        writer.writerow([summary.get(field, '') for field in BatchRunner.SUMMARY_FIELDS])
+
+    self.logger.info('Successfully wrote batch summary to %s' % summary_file.split('/')[-1])
+
+
+
+def _run_task(task):
+  """Runs the pipeline for one gene in a pool worker.
+  Failures are reported in the summary rather than raised."""
+
+  settings, constants_file, entry = task
+
+  summary = { 'CCDS_ID'    : settings['CCDS_ID'] ,
+              'input_file' : settings['input_file'] }
+
+  if entry is None:
+    summary['status'] = 'error: cannot load CCDS entry'
+    return summary
+
+  try:
+    return pipeline.run(settings, constants_file, ei.ExonIndex(entry[0]))
+  except Exception as e:
+    log.getLogger(__name__).error('Failed to pair guides for %s:\n%s' %
+                                  (settings['CCDS_ID'], traceback.format_exc()))
+    summary['status'] = 'error: %s' % e
+    return summary
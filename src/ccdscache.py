@@ -0,0 +1,125 @@
+import log
+import os
+import json
+import time
+import sqlite3
+
+
+class CcdsCache(object):
+  """A persistent SQLite cache of parsed CCDS entries (exon edges and strand)
+  keyed by CCDS id and version. Entries expire after ttl days and the least
+  recently used entries are evicted beyond max_entries."""
+
+  FILENAME = 'ccds_cache.sqlite'
+
+  def __init__(self, cache_dir, ttl=30, max_entries=1000):
+
+    self.logger = log.getLogger(__name__)
+
+    self.cache_dir = os.path.expanduser(cache_dir)
+    self.ttl = ttl
+    self.max_entries = max_entries
+
+    if not os.path.isdir(self.cache_dir):
+      os.makedirs(self.cache_dir)
+    self.filepath = os.path.join(self.cache_dir, CcdsCache.FILENAME)
+
+    conn = self._connect()
+    try:
+      with conn:
+        conn.execute('CREATE TABLE IF NOT EXISTS entries ('
+                     '  ccds_id TEXT, version TEXT, exon_edges TEXT, strand TEXT,'
+                     '  fetched REAL, accessed REAL,'
+                     '  PRIMARY KEY (ccds_id, version))')
+    finally:
+      conn.close()
+
+
+
+  def _connect(self):
+    # A new connection is opened for each operation so that the cache can be
+    # shared across threads and processes.
+    return sqlite3.connect(self.filepath, timeout=30)
+
+
+
+  def _expired(self, fetched):
+    return self.ttl is not None and time.time() - fetched > self.ttl * 86400
+
+
+
+  def get(self, ccds_id, version='', allow_stale=False):
+    """Returns the cached (exon_edges, strand) for a CCDS id and version,
+    or None on a miss. Expired entries are misses unless allow_stale is set."""
+
+    conn = self._connect()
+    try:
+      with conn:
+        row = conn.execute('SELECT exon_edges, strand, fetched FROM entries '
+                           'WHERE ccds_id = ? AND version = ?',
+                           (ccds_id, version)).fetchone()
+        if row is None:
+          return
+
+        if self._expired(row[2]):
+          if not allow_stale:
+            conn.execute('DELETE FROM entries WHERE ccds_id = ? AND version = ?',
+                         (ccds_id, version))
+            return
+          self.logger.warning('Using expired cache entry for CCDS%s' % ccds_id)
+
+        conn.execute('UPDATE entries SET accessed = ? WHERE ccds_id = ? AND version = ?',
+                     (time.time(), ccds_id, version))
+    finally:
+      conn.close()
+
+    return [tuple(edge) for edge in json.loads(row[0])], str(row[1])
+
+
+
+  def put(self, ccds_id, version, exon_edges, strand):
+    """Stores the exon edges and strand of a CCDS entry and evicts the least
+    recently used entries beyond max_entries."""
+
+    now = time.time()
+
+    conn = self._connect()
+    try:
+      with conn:
+        conn.execute('INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?, ?, ?)',
+                     (ccds_id, version, json.dumps([list(edge) for edge in exon_edges]),
+                      strand, now, now))
+        if self.max_entries is not None:
+          conn.execute('DELETE FROM entries WHERE rowid NOT IN '
+                       '(SELECT rowid FROM entries ORDER BY accessed DESC LIMIT ?)',
+                       (self.max_entries,))
+    finally:
+      conn.close()
+
+
+
+  def remove(self, ccds_id, version=None):
+    """Removes the entries for a CCDS id (all versions by default)."""
+
+    conn = self._connect()
+    try:
+      with conn:
+        if version is None:
+          conn.execute('DELETE FROM entries WHERE ccds_id = ?', (ccds_id,))
+        else:
+          conn.execute('DELETE FROM entries WHERE ccds_id = ? AND version = ?',
+                       (ccds_id, version))
+    finally:
+      conn.close()
+
+
+
+  def clear(self):
+    """Removes every cache entry."""
+
+    conn = self._connect()
+    try:
+      with conn:
+        conn.execute('DELETE FROM entries')
+    finally:
+      conn.close()
@@ -2,7 +2,14 @@
 
 import log
 import requests
-from bs4 import BeautifulSoup
+from requests.adapters import HTTPAdapter
+from requests.packages.urllib3.util.retry import Retry
+from multiprocessing.pool import ThreadPool
+import exonindex as ei
+import ccdscache as cc
+import instrumentation as instr
+import lxml.html
+import lxml.etree
 
 
 class CcdsLoader(object):
@@ -14,16 +21,33 @@ class CcdsLoader(object):
   #   WITHOUT the 'CCDS' prefix (already built into the URL)
   URL_BASE = "https://www.ncbi.nlm.nih.gov/CCDS/CcdsBrowse.cgi?REQUEST=CCDS&GO=MainBrowse&DATA=CCDS"
 
-  def __init__(self, settings=None):
+  # A container for default settings
+  _DEFAULTS = { 'ccds_cache_dir'  : '~/.pair-guides' , # 'none' disables the cache
+                'ccds_cache_ttl'  : 30 ,     # Days before a cached entry expires
+                'ccds_cache_size' : 1000 ,   # Max number of cached entries
+                'offline'         : False ,  # True to never fetch CCDS pages
+                'ccds_workers'    : 8 ,      # Concurrent page fetches in load_many()
+                'ccds_retries'    : 3 ,      # Retries (with backoff) of a failed fetch
+                'strand_conflict' : 'ask'    # 'ask', 'ccds' or 'settings' strand on a mismatch
+               }
+
+  def __init__(self, settings=None, cache=None, url_base=None, profile=None):
 
     self.logger = log.getLogger(__name__)
+    self.profile = instr.as_profile(profile)
 
     self.settings = settings
+    self.cache = cache
+
+    # The URL base can be pointed at a local stand-in server
+    self.url_base = url_base if url_base is not None else CcdsLoader.URL_BASE
+    self.session = None
 
     self.ccds_id = None
+    self.ccds_version = None
     self.valid_id = None
-    self.soup = None
     self.exon_edges = None
+    self.exon_index = None
     self.strand = None
 
     # init with a protein id is optional
@@ -32,17 +56,87 @@ class CcdsLoader(object):
 
 
   def load(self, settings):
-    self.soup = None
+    with self.profile.stage('ccds_load'):
+      self._load(settings)
+
+
+  def _load(self, settings):
     self.exon_edges = None
+    self.exon_index = None
+    self.strand = None
 
     self.settings = settings
 
+    self._fill_defaults(self.settings)
+
     self.ccds_id = self.settings['CCDS_ID']
     self._clean_id()
-    if self.valid_id:
-      self._get_soup()
+    if not self.valid_id:
+      return
+
+    if self._load_from_cache():
+      self.profile.count('ccds_cache_hits')
+      self.logger.info("CCDS%s entry loaded from cache" % self.ccds_id)
+
+    elif self.settings['offline']:
+      self.logger.error("Cannot load CCDS%s: entry is not cached and offline mode is set"
+                        % self.ccds_id)
+      return
+
+    elif self._load_page():
+      self.profile.count('ccds_pages_fetched')
+      self._save_to_cache()
       self.logger.info("CCDS%s entry loaded" % self.ccds_id)
 
+    else:
+      return
+
+    self._add_strand_to_settings()
+
+
+  def _open_cache(self):
+    """Opens the CCDS cache given by the settings unless one was given at init."""
+
+    if self.cache is None and str(self.settings['ccds_cache_dir']).lower() != 'none':
+      self.cache = cc.CcdsCache(self.settings['ccds_cache_dir'],
+                                ttl=self.settings['ccds_cache_ttl'],
+                                max_entries=self.settings['ccds_cache_size'])
+    return self.cache
+
+
+  def _load_from_cache(self):
+    """Sets the exon edges and strand from the cache. Returns True on a hit."""
+
+    if self._open_cache() is None:
+      return False
+
+    # Expired entries are still used when the network is off limits
+    entry = self.cache.get(self.ccds_id, self.ccds_version,
+                           allow_stale=self.settings['offline'])
+    if entry is None:
+      return False
+
+    self.exon_edges, self.strand = entry
+    return True
+
+
+  def _save_to_cache(self):
+    """Stores the exon edges and strand parsed from the page in the cache."""
+
+    if self._open_cache() is None:
+      return
+
+    self.cache.put(self.ccds_id, self.ccds_version, self.exon_edges, self.strand)
+
+
+  @staticmethod
+  def _fill_defaults(settings):
+    """Copies unspecified fields to settings from _DEFAULTS"""
+    for key, value in CcdsLoader._DEFAULTS.items():
+      if key not in settings.keys():
+        settings[key] = value
+
+
 
   def _clean_id(self):
     """Cleans the ccds_id attr to just the id digits and removes the version suffix."""
@@ -53,92 +147,252 @@ class CcdsLoader(object):
       self.logger.warning("failed to clean CCDS id: value not set")
       return
 
-    new_id = self.ccds_id
+    cleaned = self._split_id(self.ccds_id)
+    if cleaned is None:
+      self.logger.warning("Failed to clean CCDS id: invalid format")
+      return
+
+    self.ccds_id, self.ccds_version = cleaned
+    self.valid_id = True
+
+
+
+  @staticmethod
+  def _split_id(ccds_id):
+    """Returns the (id digits, version suffix) of a CCDS id, or None if invalid."""
 
-    new_id = str(new_id).strip().lower()
+    new_id = str(ccds_id).strip().lower()
 
-    # Strips everything after the '.' character
+    # Strips everything after the '.' character (the version suffix)
+    version = ''
     if new_id.find('.') > 0:
+      version = new_id[new_id.find('.')+1 : ]
       new_id = new_id[ : new_id.find('.')]
 
     if new_id[:4] == "ccds":
       new_id = new_id[4:]
 
     if not new_id.isdigit():
-      self.logger.warning("Failed to clean CCDS id: invalid format")
       return
 
-    self.ccds_id = new_id
-    self.valid_id = True
+    return new_id, version
 
 
 
-  def _get_soup(self):
-    """Retrieves and sets the soup attr to a BeautifulSoup object for CCDS page."""
+  def _get_session(self):
+    """Returns the shared requests session. Its connection pool is sized for
+    ccds_workers concurrent fetches and failed fetches are retried with backoff."""
+
+    if self.session is None:
+      settings = self.settings if self.settings is not None else {}
+      self._fill_defaults(settings)
+
+      retries = Retry(total=settings['ccds_retries'], backoff_factor=0.5,
+                      status_forcelist=[429, 500, 502, 503, 504])
+      adapter = HTTPAdapter(pool_connections=1, pool_maxsize=settings['ccds_workers'],
+                            max_retries=retries)
+
+      self.session = requests.Session()
+      self.session.mount('http://', adapter)
+      self.session.mount('https://', adapter)
+
+    return self.session
+
+
+
+  def _fetch(self, ccds_id):
+    """Fetches the CCDS page for the cleaned ccds_id and returns its content."""
+
+    response = self._get_session().get(self.url_base + ccds_id)
+    response.raise_for_status()
+    return response.content
+
+
+
+  def _load_page(self):
+    """Fetches the CCDS page and sets the exon edges and strand parsed from it.
+    Returns True on success."""
 
     if not self.valid_id:
-      self.logger.warning("Cannot get soup: invalid CCDS id")
+      self.logger.warning("Cannot load page: invalid CCDS id")
+      return False
 
-    self.soup = BeautifulSoup(requests.get(CcdsLoader.URL_BASE + self.ccds_id).content, 'lxml')
+    entry = self._fetch_entry(self.ccds_id)
+    if entry is None:
+      return False
+
+    self.exon_edges, self.strand = entry
+    return True
+
+
+
+  def load_many(self, ccds_ids, settings=None):
+    """Loads many CCDS entries, fetching the uncached pages concurrently over a
+    pool of ccds_workers threads that share one pooled session. Duplicate ids
+    are fetched once. Returns a dict that maps each given id to its
+    (exon_edges, strand), or to None if the entry could not be loaded.
+    Unlike load(), this does not assign the strand setting."""
+
+    if settings is not None:
+      self.settings = settings
+    if self.settings is None:
+      self.settings = {}
+    self._fill_defaults(self.settings)
+
+    # Coalesces duplicate requests by their cleaned (id, version) key
+    keys = {}
+    for ccds_id in ccds_ids:
+      keys[ccds_id] = self._split_id(ccds_id)
+      if keys[ccds_id] is None:
+        self.logger.warning("Cannot load %s: invalid CCDS id" % ccds_id)
+
+    entries = {}
+    for key in set(keys.values()) - set([None]):
+      if self._open_cache() is not None:
+        entries[key] = self.cache.get(key[0], key[1], allow_stale=self.settings['offline'])
+
+    missing = sorted(set(key[0] for key in keys.values()
+                         if key is not None and entries.get(key) is None))
+
+    if len(missing) > 0 and self.settings['offline']:
+      self.logger.error("Cannot load %d CCDS entries: not cached and offline mode is set"
+                        % len(missing))
+    elif len(missing) > 0:
+      # The session is made before the threads start, so they all share it
+      self._get_session()
+      pool = ThreadPool(min(self.settings['ccds_workers'], len(missing)))
+      try:
+        fetched = dict(zip(missing, pool.map(self._fetch_entry, missing)))
+      finally:
+        pool.close()
+        pool.join()
+
+      self.profile.count('ccds_pages_fetched',
+                         len([entry for entry in fetched.values() if entry is not None]))
+
+      for key in set(keys.values()) - set([None]):
+        if entries.get(key) is None and fetched.get(key[0]) is not None:
+          entries[key] = fetched[key[0]]
+          if self.cache is not None:
+            self.cache.put(key[0], key[1], *entries[key])
+
+    self.logger.info("Loaded %d of %d CCDS entries" %
+                     (len([key for key in entries if entries[key] is not None]), len(entries)))
+
+    return dict((ccds_id, entries.get(key)) for ccds_id, key in keys.items())
+
+
+
+  def _fetch_entry(self, ccds_id):
+    """Fetches and parses the page for a cleaned ccds_id. Returns the
+    (exon_edges, strand) of the entry, or None if the fetch failed."""
+
+    try:
+      return self._parse_page(self._fetch(ccds_id))
+    except (requests.RequestException, lxml.etree.LxmlError, IndexError, ValueError) as e:
+      self.logger.warning("Failed to load CCDS%s: %s" % (ccds_id, e))
+      return
+
+
+
+  @staticmethod
+  def _parse_page(content):
+    """Extracts the exon edges and the strand from the content of a CCDS page.
+    Only the exon table and the strand line are read; the parsed page is
+    dropped as soon as they are extracted."""
+
+    page = lxml.html.fromstring(content)
+
+    # The exon table holds a 'Chromosome' header with the start and stop
+    # columns of each exon row beneath it
+    extable = page.xpath('//small[. = "Chromosome"]/../../..')[0]
+    exon_edges = [tuple([int(cell.text_content()) for cell in list(row.iter('td'))[1:3]])
+                    for row in list(extable.iter('tr'))[1:]]
+
+    strandline = [str(tag.text_content()) for tag in page.iter('b')
+                  if 'strand of chromosome' in tag.text_content().lower()][0]
+    strand = strandline.split("'")[1]
+
+    return exon_edges, strand
 
-    self._add_strand_to_settings()
 
 
   def _add_strand_to_settings(self):
-    """Gets strand from soup and assigns settings['strand'] to the fetched value."""
+    """Gets strand from the CCDS entry and assigns settings['strand'] to the fetched value."""
 
     # This is not strictly necessary because get_strand() assigns the local strand attr.
     self.strand = self.get_strand()
 
-    if 'strand' in self.settings.keys() and self.settings['strand'] != self.strand:
-      use_ccds_strand = raw_input("\n> Strand specified in settings does not match CCDS info.\n" + \
-                                   "> Use '%s' strand from CCDS? [Y/n]\n> " % self.strand)
-      print
-      if use_ccds_strand.lower() == 'y' or use_ccds_strand.lower() == 'yes':
-        self.settings['strand'] = self.strand
-        self.logger.info("Overwriting strand to '%s'." % self.strand)
+    self.assign_strand(self.settings, self.strand)
+
+
+
+  def assign_strand(self, settings, strand):
+    """Assigns settings['strand'] to the CCDS strand. If the settings already
+    give a different strand, the strand_conflict setting decides which is used:
+    'ask' prompts the user, 'ccds' uses the CCDS strand and 'settings' keeps
+    the strand from the settings."""
+
+    if 'strand' in settings.keys() and settings['strand'] != strand:
+      policy = settings.get('strand_conflict', 'ask')
+
+      if policy == 'ask':
+        use_ccds_strand = raw_input("\n> Strand specified in settings does not match CCDS info.\n" + \
+                                     "> Use '%s' strand from CCDS? [Y/n]\n> " % strand)
+        print
+        use_ccds_strand = use_ccds_strand.lower() == 'y' or use_ccds_strand.lower() == 'yes'
+      else:
+        self.logger.warning("Strand specified in settings for %s does not match CCDS info."
+                            % settings.get('CCDS_ID'))
+        use_ccds_strand = policy == 'ccds'
+
+      if use_ccds_strand:
+        settings['strand'] = strand
+        self.logger.info("Overwriting strand to '%s'." % strand)
     else:
-      self.settings['strand'] = self.strand
+      settings['strand'] = strand
 
 
 
 
 
   def get_exon_edges(self):
-    """Scrapes soup for and reports exon boundaries in a list of tuples."""
-
-    if self.exon_edges is not None:
-      return self.exon_edges
+    """Reports exon boundaries in a list of tuples."""
 
-    if self.soup is None or not(self.valid_id):
-      self.logger.warning("Cannot get exon edges: no soup")
+    # exon_edges is cached until a new load command is executed.
+    if self.exon_edges is None or not(self.valid_id):
+      self.logger.warning("Cannot get exon edges: no CCDS entry loaded")
       return
-    
-    extable = self.soup.find('small', string="Chromosome").parent.parent.parent
 
-    # Caches exon_edges until a new load command is executed.
-    self.exon_edges = [tuple([int(cell.get_text()) for cell in row.find_all('td')[1:3]])
-                            for row in extable.find_all('tr')[1:]]
     return self.exon_edges
 
 
 
+  def get_exon_index(self):
+    """Reports the exon edges as an ExonIndex shared by the pairing modules."""
+
+    if self.exon_index is not None:
+      return self.exon_index
+
+    if self.get_exon_edges() is None:
+      return
+
+    # Caches exon_index until a new load command is executed.
+    self.exon_index = ei.ExonIndex(self.exon_edges)
+    return self.exon_index
+
+
+
   def get_strand(self):
-    """Scrapes soup for and reports the gene strand (either '+' or '-')."""
+    """Reports the gene strand (either '+' or '-')."""
 
-    # This method is called when the soup is loaded and the return value
+    # This method is called when the entry is loaded and the return value
     # is assigned to settings['strand']
 
-    if self.strand is not None:
-      return self.strand
-
-    if self.soup is None or not(self.valid_id):
-      self.logger.warning("Cannot get strand: no soup")
+    if self.strand is None or not(self.valid_id):
+      self.logger.warning("Cannot get strand: no CCDS entry loaded")
       return
 
-    strandline = filter(lambda s: 'strand of chromosome' in s.lower(), 
-                            map(lambda tag: str(tag.get_text()), self.soup.findAll('b')))[0]
-    self.strand = strandline.split("'")[1]
     return self.strand
 
 
@@ -151,7 +405,7 @@ if __name__ == "__main__":
   grk5 = 'CCDS7612.1'
 
   loader = CcdsLoader()
-  loader.load(bcor)
+  loader.load({'CCDS_ID' : bcor})
   
   loader.get_strand()
   print bcor
@@ -0,0 +1,172 @@
+import log
+import numpy as np
+from bisect import bisect_right
+
+
+class ExonIndex(object):
+  """An immutable index over the exon edges of a gene.
+  Holds the sorted exon starts and ends along with the cumulative exon
+  lengths so that exon geometry queries are answered by binary search."""
+
+  # The exon_edges input must be a list of tuples which mark the exon boundaries.
+  # The boundaries for an exon are the indices of the first and last base pair
+  #   of that exon (INCLUSIVE)
+
+  def __init__(self, exon_edges):
+
+    self.logger = log.getLogger(__name__)
+
+    edges = []
+    for edge in exon_edges:
+      # Each boundary is a 2-element list or tuple of ints
+      if len(edge) < 2:
+        self.logger.warning('Cannot index exon: improper exon boundary shape')
+        continue
+      if edge[0] >= edge[1]:
+        self.logger.error('Cannot index exon: invalid exon boundary specification')
+        continue
+      edges.append((int(edge[0]), int(edge[1])))
+    edges.sort()
+
+    self._edges = tuple(edges)
+    self._starts = tuple(edge[0] for edge in edges)
+    self._ends = tuple(edge[1] for edge in edges)
+
+    # _cumulative_sizes[i] is the count of exon bps in the exons before exon i.
+    # The final entry is the size of the gene in bps.
+    cumulative_sizes = [0]
+    for start, end in edges:
+      cumulative_sizes.append(cumulative_sizes[-1] + end+1 - start)
+    self._cumulative_sizes = tuple(cumulative_sizes)
+
+    # Read-only array copies for the batch (searchsorted) queries
+    self._start_array = self._frozen_array(self._starts)
+    self._end_array = self._frozen_array(self._ends)
+    self._cumulative_array = self._frozen_array(self._cumulative_sizes)
+
+
+  @staticmethod
+  def _frozen_array(values):
+    array = np.array(values, dtype=np.int64)
+    array.flags.writeable = False
+    return array
+
+
+  def __len__(self):
+    return len(self._edges)
+
+
+  @property
+  def edges(self):
+    return self._edges
+
+  @property
+  def starts(self):
+    return self._starts
+
+  @property
+  def ends(self):
+    return self._ends
+
+  @property
+  def cumulative_sizes(self):
+    return self._cumulative_sizes
+
+  @property
+  def size(self):
+    """The size of the gene in exon bps."""
+    return self._cumulative_sizes[-1]
+
+
+
+  def _exon_at(self, site):
+    """Returns the index of the last exon that starts at or before site (-1 if none)."""
+    return bisect_right(self._starts, site) - 1
+
+
+
+  def cut_in_exon(self, cut_site):
+    """Returns True if the cut site falls inside an exon."""
+
+    # A target site is indexed by the preceding base on the + strand.
+    #   i.e. for a target site i, the cut falls between bases i and i+1,
+    #   so a cut after the last base of an exon is not inside it.
+    i = self._exon_at(cut_site)
+    return i >= 0 and cut_site <= self._ends[i]-1
+
+
+
+  def cut_in_exon_many(self, cut_sites):
+    """Returns a boolean array of whether each cut site falls inside an exon.
+    The batch equivalent of cut_in_exon()."""
+
+    cut_sites = np.asarray(cut_sites, dtype=np.int64)
+    if len(self) == 0:
+      return np.zeros(cut_sites.shape, dtype=bool)
+
+    exon = np.searchsorted(self._start_array, cut_sites, side='right') - 1
+    return (exon >= 0) & (cut_sites <= self._end_array[np.maximum(exon, 0)]-1)
+
+
+
+  def exon_bp_upstream(self, cut_site):
+    """Returns the number of exon bps at or before the cut site (on the + strand)."""
+
+    i = self._exon_at(cut_site)
+    if i < 0:
+      return 0
+    return self._cumulative_sizes[i] + min(cut_site, self._ends[i])+1 - self._starts[i]
+
+
+
+  def exon_bp_between(self, cut_site1, cut_site2):
+    """Returns the number of exon bps between two cut sites, given in either order."""
+
+    left_cut = min(cut_site1, cut_site2)
+    right_cut = max(cut_site1, cut_site2)
+    return self.exon_bp_upstream(right_cut) - self.exon_bp_upstream(left_cut)
+
+
+
+  def exon_bp_upstream_many(self, cut_sites):
+    """Returns an array of the number of exon bps at or before each cut site.
+    The batch equivalent of exon_bp_upstream()."""
+
+    cut_sites = np.asarray(cut_sites, dtype=np.int64)
+    if len(self) == 0:
+      return np.zeros(cut_sites.shape, dtype=np.int64)
+
+    exon = np.searchsorted(self._start_array, cut_sites, side='right') - 1
+    upstream = np.maximum(exon, 0)
+    counts = (self._cumulative_array[upstream] +
+              np.minimum(cut_sites, self._end_array[upstream])+1 - self._start_array[upstream])
+    return np.where(exon >= 0, counts, 0)
+
+
+
+  def exon_bp_between_many(self, cut_sites1, cut_sites2):
+    """Returns an array of the number of exon bps between each pair of cut sites.
+    The batch equivalent of exon_bp_between()."""
+
+    cut_sites1 = np.asarray(cut_sites1, dtype=np.int64)
+    cut_sites2 = np.asarray(cut_sites2, dtype=np.int64)
+    return (self.exon_bp_upstream_many(np.maximum(cut_sites1, cut_sites2)) -
+            self.exon_bp_upstream_many(np.minimum(cut_sites1, cut_sites2)))
+
+
+
+  def gene_loc_frac(self, cut_site, gene_strand):
+    """Returns the number of exon bps upstream of the cut site divided by the
+    gene size, measured along the coding direction of the gene."""
+
+    frac = float(self.exon_bp_upstream(cut_site)) / self.size
+    return frac if gene_strand == '+' else 1 - frac
+
+
+
+def as_exon_index(exon_edges):
+  """Returns exon_edges as an ExonIndex, building one if given a list of edges."""
+
+  if isinstance(exon_edges, ExonIndex):
+    return exon_edges
+  return ExonIndex(exon_edges)
@@ -0,0 +1,137 @@
+import log
+import os
+import heapq
+import tempfile
+import itertools
+import numpy as np
+
+
+class ExternalSorter(object):
+  """Sorts a stream of numpy record arrays that may not fit in memory.
+  Records are added in batches. Whenever more than max_records are held,
+  they are sorted by the key fields and spilled to a temporary .npy run file.
+  merged() then k-way merges the runs (read back as memory maps) into one
+  sorted stream of record tuples. The keys must order the records fully
+  (e.g. end with a unique sequence number) for the merge to be stable.
+  Usage:
+    sorter = ExternalSorter(dtype, ['key', 'order'], max_records=10**6)
+    for records in batches:
+      sorter.add(records)
+    for record in sorter.merged():
+      ...
+    sorter.close()
+  """
+
+  # Records read from each run at a time during the merge
+  _MERGE_CHUNK_SIZE = 4096
+
+  def __init__(self, dtype, keys, max_records, tmp_dir=None):
+
+    self.logger = log.getLogger(__name__)
+
+    self.dtype = np.dtype(dtype)
+    self.keys = list(keys)
+    self.max_records = max(int(max_records), 1)
+    self.tmp_dir = tmp_dir
+
+    self.buffer = []
+    self.n_buffered = 0
+    self.run_files = []
+
+
+
+  @staticmethod
+  def records_for_budget(dtype, megabytes):
+    """Returns the number of records of dtype that can be held and sorted
+    within megabytes of memory (sorting needs about twice the records)."""
+    return max(int(megabytes * (1 << 20)) // (2 * np.dtype(dtype).itemsize), 1)
+
+
+
+  def add(self, records):
+    """Adds a record array, spilling a sorted run if the buffer is full."""
+
+    if len(records) == 0:
+      return
+
+    self.buffer.append(records)
+    self.n_buffered += len(records)
+    if self.n_buffered >= self.max_records:
+      self._spill()
+
+
+
+  def _sorted_buffer(self):
+    """Returns the buffered records sorted by the keys and empties the buffer."""
+
+    if len(self.buffer) == 0:
+      return np.empty(0, dtype=self.dtype)
+
+    records = np.concatenate(self.buffer)
+    self.buffer = []
+    self.n_buffered = 0
+
+    # lexsort sorts by its last key first
+    return records[np.lexsort([records[key] for key in reversed(self.keys)])]
+
+
+
+  def _spill(self):
+    """Writes the sorted buffer to a new run file."""
+
+    records = self._sorted_buffer()
+
+    fd, path = tempfile.mkstemp(dir=self.tmp_dir, suffix='.run.npy')
+    self.run_files.append(path)
+    with os.fdopen(fd, 'wb') as run_file:
+      np.save(run_file, records)
+
+
+
+  @property
+  def n_runs(self):
+    return len(self.run_files)
+
+
+
+  def merged(self):
+    """Generator that yields every added record as a tuple, in key order.
+    If nothing was spilled the records are sorted in memory."""
+
+    if len(self.run_files) == 0:
+      for record in self._iter_run(self._sorted_buffer()):
+        yield record[1]
+      return
+
+    if self.n_buffered > 0:
+      self._spill()
+
+    runs = [np.load(path, mmap_mode='r') for path in self.run_files]
+    for key, record in heapq.merge(*[self._iter_run(run) for run in runs]):
+      yield record
+
+
+
+  def _iter_run(self, run):
+    """Generator that yields the (key tuple, record tuple) of each record of
+    a sorted run, reading the run in chunks."""
+
+    for start in xrange(0, len(run), ExternalSorter._MERGE_CHUNK_SIZE):
+      chunk = np.asarray(run[start : start + ExternalSorter._MERGE_CHUNK_SIZE])
+      for item in itertools.izip(itertools.izip(*[chunk[key].tolist() for key in self.keys]),
+                                 chunk.tolist()):
+        yield item
+
+
+
+  def close(self):
+    """Removes the run files."""
+
+    for path in self.run_files:
+      try:
+        os.remove(path)
+      except OSError:
+        pass
+    self.run_files = []
+    self.buffer = []
+    self.n_buffered = 0
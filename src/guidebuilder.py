@@ -1,8 +1,18 @@
 #!/usr/bin/env python
 
 import log
+import threading
+import multiprocessing
+import itertools
+import numpy as np
+from collections import deque
 import targetsequence as ts
 import guidepair as gp
+import exonindex as ei
+import tablecache as tc
+import pairtable as pt
+import externalsort as es
+import instrumentation as instr
 
 
 
@@ -15,6 +25,11 @@ class GuideBuilder(object):
     builder.set_exon_edges(edges)
     builder.build_pairs()
     pairs = builder.get_pairs()
+  The pairs are held in a pairtable.PairTable, which builds GuidePairs only
+  as they are read. An optional instrumentation.RunProfile records the
+  stage times and row and pair counters of the builder, and an optional
+  tablecache.TableMemo shares parsed tables between the builders of a
+  long-running process.
   """
 
   # A GuideBuilder can be initialized with settings which are used for
@@ -27,18 +42,48 @@ class GuideBuilder(object):
                 'separation_limit'  : 10000 , # Max separation between cut sites in bp
                 'latest_gRNA2'      : 0.5 ,   # Latest location for gRNA2 as a
                                               #   as a fraction of gene sequence
-                'min_exon_deletion' : 0       # min count of exon bps to delete
+                'min_exon_deletion' : 0 ,     # min count of exon bps to delete
+                'sort_key'          : 'deletion_count' , # Order of the pairs ('none' to skip sorting)
+                'top_k'             : None ,  # Keeps only the first k pairs if set
+                'sort_memory'       : None ,  # MB for an external sort of the pairs (None sorts in memory)
+                'workers'           : 1 ,     # Processes that parse the table and build pairs
+                'genome_wide'       : False , # True if input_file holds the rows of many genes
+                'chromosome'        : None ,  # Chromosome of the gene in a genome-wide input_file
+                'table_cache_dir'   : '~/.pair-guides' , # Parsed table cache ('none' disables)
+                'table_cache_size'  : 100     # Max number of cached parsed tables
                }
 
+  # The sort key names by each key string sort_pairs accepts
+  _SORT_KEYS = { 'gnm_loc'            : 'genomic_location' ,
+                 'genomic_location'   : 'genomic_location' ,
+                 'gen_sep'            : 'genomic_separation' ,
+                 'genomic_separation' : 'genomic_separation' ,
+                 'del_count'          : 'deletion_count' ,
+                 'deletion_count'     : 'deletion_count' ,
+                 'del_frac'           : 'deletion_fraction' ,
+                 'deletion_fraction'  : 'deletion_fraction' }
 
-  def __init__(self, settings=_DEFAULTS):
+  # Number of candidate pairs whose deletion stats are computed in one batch
+  _PAIR_BATCH_SIZE = 65536
+
+  # Chunks of gRNA 2 indices per worker in a parallel build (for load balance)
+  _CHUNKS_PER_WORKER = 4
+
+
+  def __init__(self, settings=_DEFAULTS, profile=None, tables=None):
     
     self.logger = log.getLogger(__name__)
+    self.profile = instr.as_profile(profile)
+
+    # An optional tablecache.TableMemo of tables shared with other builders
+    self.tables = tables
 
     self.sequences = []
     self.guidepairs = []
     self.exon_edges = None
+    self.exon_index = None
     self.gene_size = None
+    self.g_starts = None
 
     self.settings = settings
 
@@ -62,7 +107,9 @@ class GuideBuilder(object):
     self.sequences = []
     self.guidepairs = []
     self.exon_edges = None
+    self.exon_index = None
     self.gene_size = None
+    self.g_starts = None
     self.settings = GuideBuilder._DEFAULTS
 
 
@@ -80,41 +127,163 @@ class GuideBuilder(object):
 
     self.sequences = []
     self.guidepairs = []
+    self.g_starts = None
 
-    file = open(self.settings['input_file'], 'r')
-
-    for i, line in enumerate(file):
+    # The rows of a gene in a genome-wide table are found by its exon span,
+    # so they are read once the exon edges are set
+    if self.settings['genome_wide'] and self.exon_index is None:
+      self.logger.info('Reading input file %s once exon edges are set' %
+                       self.settings['input_file'].split('/')[-1])
+      return
 
-      if i == 0:  # The first line is a text header
-        continue
+    with self.profile.stage('read'):
+      # Rows are filtered as they stream in; the table is sorted only once at the end.
+      self.sequences = list(self._iter_sequences(self.settings['input_file']))
 
-      # All ChopChop results tables have these columns in order:
-      #   Rank, Target_sequence, Genomic_location, Exon, Strand, GC_content,
-      #   Self_complementarity, MM0, MM1, MM2, MM3, Efficiency
-      # We discard the Rank, Self_complementarity, GC_content and Efficiency fields.
-      # We also discard the PAM sites from the target sequences.
-      tokens = line.split()
-      self.sequences.append(
-                   ts.TargetSequence(sequence=tokens[1][:-3], gnm_loc=tokens[2],
-                                     exon_num=tokens[3], strand=tokens[4],
-                                     offtargets=tokens[7:11]))
-      
       # The sequence table is sorted by ascending genomic location
       self.sort_sequences(keystr="cut_site")
 
-      self._filter_offtargets()
-
-      # Filters and sets locations for sequences if exon_edges already set
-      if self.exon_edges is not None:
-        self.gene_size = reduce(lambda tot, edge: tot + edge[1]+1 - edge[0],
-                          self.exon_edges, 0)
-        self._filter_targets_in_exons()
+      # Sets locations for sequences if exon_edges already set
+      if self.exon_index is not None:
         for seq in self.sequences:
-          seq.set_gene_loc_frac(self.exon_edges, self.settings['strand'])
+          seq.set_gene_loc_frac(self.exon_index, self.settings['strand'])
 
     self.logger.info('Successfully read input file %s' % self.settings['input_file'].split('/')[-1])
 
-      
+
+
+  def _iter_sequences(self, filepath):
+    """Generator that yields a TargetSequence for each row of the ChopChop
+    results file in filepath that passes the off-target filter (and the exon
+    filter if exon edges are already set). The filters run on the parsed
+    table so that TargetSequences are only built for the rows that pass."""
+
+    max_offtargets = self.settings['max_offtargets']
+    if len(max_offtargets) != 4:
+      self.logger.warning("Cannot filter targets: specify all four max offsite values")
+      max_offtargets = None
+
+    if self.settings['genome_wide']:
+      records = self._read_gene_rows(filepath)
+    else:
+      records = self._read_table(filepath)
+
+    keep = np.ones(len(records), dtype=bool)
+    if max_offtargets is not None:
+      keep &= np.all(records['offtargets'] <= np.array(max_offtargets), axis=1)
+    n_offtarget_drops = len(records) - np.count_nonzero(keep)
+
+    n_exon_drops = 0
+    if self.exon_index is not None:
+      in_exon = self.exon_index.cut_in_exon_many(tc.cut_sites(records))
+      n_exon_drops = np.count_nonzero(keep & ~in_exon)
+      keep &= in_exon
+
+    self.profile.count('rows_parsed', len(records))
+    self.profile.count('rows_dropped_offtargets', int(n_offtarget_drops))
+    self.profile.count('rows_dropped_exons', int(n_exon_drops))
+
+    keep = np.flatnonzero(keep)
+    for sequence, gnm_loc, exon_num, strand, offtargets in zip(
+            *[records[field][keep].tolist() for field in tc.FIELDS]):
+      yield ts.TargetSequence(sequence=sequence, gnm_loc=gnm_loc,
+                              exon_num=exon_num, strand=strand,
+                              offtargets=offtargets)
+
+
+
+  def _read_table(self, filepath):
+    """Returns the parsed ChopChop results table in filepath as a record array.
+    Tables are loaded from the table cache when the file contents were parsed
+    before, and saved to it otherwise. Large tables are parsed over the
+    workers setting processes. If the builder was given a TableMemo, tables
+    already loaded by this process are taken from it."""
+
+    if self.tables is not None:
+      records = self.tables.get(filepath)
+      if records is None:
+        records = self._load_table(filepath)
+        self.tables.put(filepath, records)
+      else:
+        self.profile.count('table_memo_hits')
+      return records
+
+    return self._load_table(filepath)
+
+
+
+  def _load_table(self, filepath):
+    """Returns the parsed table in filepath from the table cache or the file."""
+
+    if str(self.settings['table_cache_dir']).lower() == 'none':
+      return tc.read_table(filepath, workers=self.settings['workers'])
+
+    cache = tc.TableCache(self.settings['table_cache_dir'],
+                          max_entries=self.settings['table_cache_size'])
+    key = tc.file_key(filepath)
+
+    records = cache.get(key)
+    if records is not None:
+      self.profile.count('table_cache_hits')
+      return records
+
+    records = tc.read_table(filepath, workers=self.settings['workers'])
+    cache.put(key, records)
+    return records
+
+
+
+  def _read_gene_rows(self, filepath):
+    """Returns the records of a genome-wide ChopChop results table in filepath
+    whose guides lie within the exon span of the gene. The table is indexed
+    by chromosome and location once per process, so the rows of many genes are
+    pulled from one file without reading it again."""
+
+    global _genome_table
+
+    key = tc.file_stamp(filepath)
+    if _genome_table[0] == key:
+      self.profile.count('genome_table_hits')
+    else:
+      # Drops the previous table before the next one is read
+      _genome_table = (None, None)
+      _genome_table = (key, tc.GenomeTable(self._read_table(filepath)))
+    table = _genome_table[1]
+
+    # A guide's location is at most one guide length from its cut site
+    pad = table.records['sequence'].itemsize
+    first = self.exon_index.starts[0] - pad
+    last = max(self.exon_index.ends) + pad
+
+    records = table.rows_in_span(self._gene_chromosome(table, first, last), first, last)
+    self.profile.count('rows_outside_gene', len(table) - len(records))
+    return records
+
+
+
+  def _gene_chromosome(self, table, first, last):
+    """Returns the chromosome of the gene in a GenomeTable: the chromosome
+    setting if given, else the only chromosome of the table, else the
+    chromosome with the most guides cutting in the exons of the gene."""
+
+    if self.settings['chromosome'] is not None:
+      chrom = table.find_chromosome(self.settings['chromosome'])
+      if chrom is None:
+        self.logger.warning('No rows on chromosome %s in %s' %
+                            (self.settings['chromosome'], self.settings['input_file'].split('/')[-1]))
+      return chrom
+
+    if len(table.chromosomes) <= 1:
+      return (table.chromosomes or [None])[0]
+
+    counts = [(np.count_nonzero(self.exon_index.cut_in_exon_many(
+                                  tc.cut_sites(table.rows_in_span(chrom, first, last)))), chrom)
+              for chrom in table.chromosomes]
+    chrom = max(counts)[1]
+    self.logger.warning('No chromosome set for %s: using %s, which has the most guides in its exons' %
+                        (self.settings['CCDS_ID'], chrom))
+    return chrom
+
 
 
   def sort_sequences(self, keystr=None):
@@ -122,29 +291,72 @@ class GuideBuilder(object):
     By default (no keystr), sequences are sorted by genomic location.
     If the strand setting is '-', the sequences are sorted in descending order."""
 
+    sign = -1 if self.settings['strand'] == '-' else 1
     if keystr is None or keystr == "gnm_loc":
-      self.sequences.sort(key=lambda seq: seq.gnm_loc * (-1 if self.settings['strand'] == '-' else 1))
-    if keystr == "cut_site":
-      self.sequences.sort(key=lambda seq: seq.cut_site * (-1 if self.settings['strand'] == '-' else 1))
+      order = sorted(xrange(len(self.sequences)), key=lambda n: self.sequences[n].gnm_loc * sign)
+    elif keystr == "cut_site":
+      order = sorted(xrange(len(self.sequences)), key=lambda n: self.sequences[n].cut_site * sign)
     else:
       self.logger.warning("Cannot sort pair list: invalid key string")
+      return
+
+    # The cached G-start variants are kept aligned with the sequences
+    self.sequences = [self.sequences[n] for n in order]
+    if self.g_starts is not None:
+      self.g_starts = [self.g_starts[n] for n in order]
 
 
 
   def sort_pairs(self, keystr=None):
-    """Sorts the list of GuidePairs in place by a given field. 
-    Pairs are sorted by genomic location of seq1 by default (no keystr)"""
-
-    if keystr is None or keystr == "gnm_loc" or keystr == "genomic_location":
-      self.guidepairs.sort(key=lambda pair: pair.seq1.gnm_loc * (-1 if self.settings['strand'] == '-' else 1))
-    elif keystr == "gen_sep" or keystr == "genomic_separation":
-      self.guidepairs.sort(key=lambda pair: pair.genomic_separation)
-    elif keystr == "del_count" or keystr == "deletion_count":
-      self.guidepairs.sort(key=lambda pair: -1 * pair.deletion_count)
-    elif keystr == "del_frac" or keystr == "deletion_fraction":
-      self.guidepairs.sort(key=lambda pair: -1 * pair.deletion_fraction)
-    else:
+    """Sorts the built pairs in place by a given field: the PairTable of
+    build_pairs on its arrays, or a list of GuidePairs by key functions.
+    Pairs are sorted by genomic location of seq1 by default (no keystr).
+    A keystr of comma-separated keys orders the pairs by each key in turn."""
+
+    names = self._sort_key_names(keystr)
+    if names is None:
       self.logger.warning("Cannot sort pair list: invalid key string")
+      return
+
+    with self.profile.stage('sort_pairs'):
+      if isinstance(self.guidepairs, pt.PairTable):
+        self.guidepairs.sort(names, self.settings['strand'])
+      else:
+        self.guidepairs.sort(key=self._pair_sort_key(names))
+
+
+
+  def _pair_sort_key(self, names):
+    """Returns the sort key function for GuidePairs given by a list of sort
+    key names, matching the key columns of PairTable.sort_keys."""
+
+    # The strand is checked once here rather than once per pair
+    sign = -1 if self.settings['strand'] == '-' else 1
+    getters = { 'genomic_location'   : lambda pair: pair.seq1.gnm_loc * sign ,
+                'genomic_separation' : lambda pair: pair.genomic_separation ,
+                'deletion_count'     : lambda pair: -1 * pair.deletion_count ,
+                'deletion_fraction'  : lambda pair: -1 * pair.deletion_fraction }
+
+    if len(names) == 1:
+      return getters[names[0]]
+
+    keys = [getters[name] for name in names]
+    return lambda pair: tuple([key(pair) for key in keys])
+
+
+
+  @staticmethod
+  def _sort_key_names(keystr=None):
+    """Returns the list of sort key names given by the comma-separated keys
+    of keystr (None if any key is invalid). No keystr sorts by location."""
+
+    if keystr is None:
+      return ['genomic_location']
+
+    names = [GuideBuilder._SORT_KEYS.get(key.strip()) for key in keystr.split(',')]
+    if None in names:
+      return None
+    return names
 
 
 
@@ -152,34 +364,44 @@ class GuideBuilder(object):
 
 
   def set_exon_edges(self, exon_edges):
-    self.exon_edges = exon_edges
+    """Sets the exon edges (a list of edge tuples or an ExonIndex),
+    then filters and locates the sequences within the gene."""
 
-    self.gene_size = reduce(lambda tot, edge: tot + edge[1]+1 - edge[0],
-                          self.exon_edges, 0)
-    
-    self._filter_targets_in_exons()
-    
-    for seq in self.sequences:
-      seq.set_gene_loc_frac(self.exon_edges, self.settings['strand'])
+    with self.profile.stage('set_exon_edges'):
+      self.exon_index = ei.as_exon_index(exon_edges)
+      self.exon_edges = list(self.exon_index.edges)
+      self.gene_size = self.exon_index.size
+
+      if not self.settings['genome_wide']:
+        self._filter_targets_in_exons()
+
+        for seq in self.sequences:
+          seq.set_gene_loc_frac(self.exon_index, self.settings['strand'])
+
+      # Variants copy the gene location of their sequence, so they are rebuilt
+      self.g_starts = None
+
+    # The rows of the gene are pulled from a genome-wide table by its exon span
+    if self.settings['genome_wide'] and 'input_file' in self.settings.keys():
+      self.read()
 
 
 
   def _filter_targets_in_exons(self):
     """Removes the sequences for which the target site falls outside an exon."""
 
-    # The exon_edges input must be a list of tuples which mark the exon boundaries.
-    # The boundaries for an exon are the indices of the first and last base pair
-    #   of that exon (INCLUSIVE)
-
-    if self.exon_edges is None:
+    if self.exon_index is None:
       self.logger.warning("Cannot filter targets: assign exon edges first")
       return
 
     # A target site is indexed by the preceding base on the + strand.
     #   i.e. for a target site i, the cut falls between bases i and i+1.
-    # These computations are done by each TargetSequence instance
-    self.sequences = filter(lambda seq: seq.cut_in_range(self.exon_edges),
+    # These computations are done by the shared ExonIndex
+    n_sequences = len(self.sequences)
+    self.sequences = filter(lambda seq: self.exon_index.cut_in_exon(seq.cut_site),
                             self.sequences)
+    self.g_starts = None
+    self.profile.count('rows_dropped_exons', n_sequences - len(self.sequences))
 
 
 
@@ -194,62 +416,392 @@ class GuideBuilder(object):
       self.logger.warning("Cannot filter targets: specify all four max offsite values")
       return
 
-    self.sequences = filter(lambda seq: all([seq.offtargets[i] <= max_offtargets[i] for i in range(4)]),
+    self.sequences = filter(lambda seq: self._offtargets_ok(seq, max_offtargets),
                             self.sequences)
+    self.g_starts = None
+
+
+  @staticmethod
+  def _offtargets_ok(seq, max_offtargets):
+    """Returns True if no offsite count of seq exceeds the given max values."""
+    return all([seq.offtargets[i] <= max_offtargets[i] for i in range(4)])
 
 
   
 
   def build_pairs(self):
-    """Builds GuidePair objects for all valid sequence pairs."""
+    """Builds the table of all valid sequence pairs, sorted by the sort_key
+    setting. If the top_k setting is given, only the first top_k pairs of
+    that sort are kept. The pairs are held in a PairTable, which builds
+    GuidePair objects only as its rows are read."""
 
-    if self.exon_edges is None:
+    if self.exon_index is None:
       self.logger.warning("Cannot filter targets: assign exon edges first")
       return
 
-    self.guidepairs = []
+    # The sort runs after the build_pairs stage, so the two stages never overlap
+    with self.profile.cprofiled():
+      names = self._sort_setting_names()
+      with self.profile.stage('build_pairs'):
+        table = self._collect_pairs(names, *self._pair_batches())
+      self.guidepairs = self._order_table(table, names)
+
+    self.logger.info('Guide pairs compiled')
 
 
+
+  def _collect_pairs(self, names, table, batches):
+    """Adds the (guide1, guide2, stats) batches to an empty PairTable and
+    returns it. If the top_k setting is given, the table is cut back to its
+    top_k best rows by the sort key names (or to the first top_k rows if
+    names is None) as it grows, but is left for _order_table to sort."""
+
+    top_k = self.settings['top_k']
+
+    for guide1, guide2, stats in batches:
+      table.extend(guide1, guide2, stats)
+
+      if top_k and names is None and len(table) >= top_k:
+        # The first top_k pairs are built, so pairing stops
+        batches.close()
+        break
+
+      if top_k and names is not None and len(table) >= 2 * max(top_k, GuideBuilder._PAIR_BATCH_SIZE):
+        # Keeps only the best top_k rows while pairs are generated. The sort
+        # is stable and later rows are added after the kept ones, so ties
+        # match the full sort.
+        table.sort(names, self.settings['strand'])
+        table = table.head(top_k)
+
+    return table
+
+
+
+  def _order_table(self, table, names):
+    """Returns a PairTable sorted by the sort key names (unsorted if None)
+    and cut to the first top_k rows if the top_k setting is given."""
+
+    if names is not None:
+      with self.profile.stage('sort_pairs'):
+        table.sort(names, self.settings['strand'])
+
+    if self.settings['top_k']:
+      table = table.head(self.settings['top_k'])
+    return table
+
+
+
+  def _sort_setting_names(self):
+    """Returns the sort key names of the sort_key setting, or None if the
+    pairs are not sorted."""
+
+    if self.settings['sort_key'] == 'none':
+      return None
+
+    names = self._sort_key_names(self.settings['sort_key'])
+    if names is None:
+      self.logger.warning("Cannot sort pair list: invalid key string")
+    return names
+
+
+
+  def iter_pairs(self):
+    """Generator that yields GuidePairs as they are built without storing them.
+    Pairs are not sorted: they come in order of gRNA 2 location. If the top_k
+    setting is given, only the first top_k pairs are yielded."""
+
+    if self.exon_index is None:
+      self.logger.warning("Cannot filter targets: assign exon edges first")
+      return
+
+    pairs = self._generate_pairs()
+    if self.settings['top_k']:
+      pairs = itertools.islice(pairs, self.settings['top_k'])
+
+    for pair in pairs:
+      yield pair
+
+
+
+  def iter_sorted_pairs(self):
+    """Generator that yields GuidePairs in sort_key order without holding them
+    all in memory. The pairs are kept as compact index and key records, and
+    whenever the records fill the sort_memory setting (in MB) they are
+    sorted and spilled to a temporary run file. The runs are then merged, and
+    a GuidePair is only built as it is yielded. Ties keep the order in which
+    the pairs were built, so the order matches build_pairs."""
+
+    if self.exon_index is None:
+      self.logger.warning("Cannot filter targets: assign exon edges first")
+      return
+
+    names = self._sort_setting_names() or []
+
+    table, batches = self._pair_batches()
+
+    dtype = np.dtype([(name, dtype) for name, dtype in pt.PairTable.COLUMNS
+                      if name != 'genomic_separation'] + [('order', np.int64)] +
+                     [(name + '_key', np.float64 if name == 'deletion_fraction' else np.int64)
+                      for name in names])
+
+    memory = self.settings['sort_memory']
+    max_records = (es.ExternalSorter.records_for_budget(dtype, memory) if memory
+                   else np.iinfo(np.int64).max)
+    sorter = es.ExternalSorter(dtype, [name + '_key' for name in names] + ['order'], max_records)
+
+    try:
+      with self.profile.stage('build_pairs'):
+        n_pairs = 0
+        for guide1, guide2, stats in batches:
+          batch = table.head(0)
+          batch.extend(guide1, guide2, stats)
+
+          records = np.empty(len(batch), dtype=dtype)
+          for name, column in batch.columns.items():
+            if name in records.dtype.names:
+              records[name] = column
+          records['order'] = np.arange(n_pairs, n_pairs + len(batch))
+          n_pairs += len(batch)
+          for name, key in zip(names, batch.sort_keys(names, self.settings['strand'])):
+            records[name + '_key'] = key
+          sorter.add(records)
+
+      self.profile.count('sort_runs_spilled', sorter.n_runs)
+
+      pairs = sorter.merged()
+      if self.settings['top_k']:
+        pairs = itertools.islice(pairs, self.settings['top_k'])
+
+      guides = table.guides
+      for record in pairs:
+        guide1, guide2, count, frac, pct = record[:5]
+        pair = gp.GuidePair(guides[guide1], guides[guide2])
+        pair.set_deletion_stats(count, frac, pct)
+        yield pair
+
+    finally:
+      sorter.close()
+
+
+
+  def expand_G_starts(self):
+    """Computes the G-start variants of every sequence once and caches them.
+    Returns a list that holds the list of variants of each sequence, aligned
+    with self.sequences (sort_sequences keeps the two in the same order)."""
+
+    # A sequence list replaced from outside the builder is expanded again
+    if self.g_starts is None or len(self.g_starts) != len(self.sequences):
+      self.g_starts = [seq.find_G_starts() for seq in self.sequences]
+      self.profile.count('g_start_variants', sum(len(g_seqs) for g_seqs in self.g_starts))
+    return self.g_starts
+
+
+
+  def _generate_pairs(self):
+    """Generator that yields a GuidePair for each valid sequence pair."""
+
+    table, batches = self._pair_batches()
+    for guide1, guide2, stats in batches:
+      batch = table.head(0)
+      batch.extend(guide1, guide2, stats)
+      for pair in batch:
+        yield pair
+
+
+
+  def _pair_batches(self):
+    """Returns an empty PairTable over the ordered guide list of the gene and
+    a generator of (guide1, guide2, stats) batches for every valid sequence
+    pair, where guide1 and guide2 are arrays of indices into that list.
+    If the workers setting is above 1, the pairs are built over a process pool."""
+
     # Sorts sequences by location of cut_site
     # Ascending if gene falls on +strand, descending on -strand
     self.sort_sequences(keystr="cut_site")
 
-    # A queue of gRNAs awaiting second sequences to pair
-    start_seqs = []
-
-    for seq2 in self.sequences:
-
-      # Iterates across a *copy* of start_seqs so that some sequences
-      # can be removed from the original during iteration
-      for seq1 in list(start_seqs):
-        # Pops start sequences that are too far upstream
-        if abs(seq2.cut_site - seq1.cut_site) > self.settings['separation_limit']:
-          start_seqs.pop(0)
-          continue
-        
-        # Skips overlapping sequences
-        elif seq1.overlap_Q(seq2):
-          continue
-
-        else:
-          if self.settings['gRNA2_start_G']:
-            self.guidepairs += filter(lambda pair: pair.deletion_count >= self.settings['min_exon_deletion'],
-                        [gp.GuidePair(seq1, g_seq2, self.exon_edges) for g_seq2 in seq2.find_G_starts()])
+    # The G-start variants of each sequence are built once, not once per pair
+    variants = self.expand_G_starts()
+
+    # The guides are every variant followed by every sequence (the gRNA 2 of
+    # the candidate rows with m = -1)
+    offsets = np.cumsum([0] + [len(seq_variants) for seq_variants in variants])
+    table = pt.PairTable([g_seq for seq_variants in variants for g_seq in seq_variants] +
+                         self.sequences)
+
+    stop = self._gRNA2_stop()
+
+    if self.settings['workers'] > 1 and stop > 1:
+      chunks = self._iter_parallel_candidates(stop)
+    else:
+      chunks = self._iter_serial_candidates(stop)
+
+    return table, self._guide_index_batches(chunks, offsets)
+
+
+
+  @staticmethod
+  def _guide_index_batches(chunks, offsets):
+    """Generator that turns the (i, k, j, m) rows of (rows, stats) candidate
+    batches into (guide1, guide2, stats) batches of guide list indices."""
+
+    try:
+      for rows, stats in chunks:
+        guide1 = offsets[rows[:, 0]] + rows[:, 1]
+        guide2 = np.where(rows[:, 3] < 0, offsets[-1] + rows[:, 2], offsets[rows[:, 2]] + rows[:, 3])
+        yield guide1, guide2, stats
+    finally:
+      chunks.close()
+
+
+
+  def _gRNA2_stop(self):
+    """Returns the index after the last sequence that can be gRNA 2: pairing
+    stops once gRNA 2 has passed the latest allowed location."""
+
+    for j, seq in enumerate(self.sequences):
+      if seq.gene_loc_frac > self.settings['latest_gRNA2']:
+        return j + 1
+    return len(self.sequences)
+
+
+
+  def _iter_serial_candidates(self, stop):
+    """Generator that yields the (rows, stats) candidate batches of every
+    gRNA 2 before stop and reports the pairing counters to the profile."""
+
+    counts = {}
+    try:
+      for batch in self._candidate_batches(0, stop, counts):
+        yield batch
+    finally:
+      for name, n in counts.items():
+        self.profile.count(name, n)
+
+
+
+  def _iter_parallel_candidates(self, stop):
+    """Generator that yields the (rows, stats) candidate batches of every
+    gRNA 2 before stop, paired in chunks over a pool of worker processes.
+    Each chunk owns a range of gRNA 2 indices, so no pair is built twice, and
+    the chunks are merged in order, so the pairs come in the serial order."""
+
+    n_chunks = min(self.settings['workers'] * GuideBuilder._CHUNKS_PER_WORKER, stop)
+    bounds = [stop * n // n_chunks for n in xrange(n_chunks + 1)]
+    chunks = zip(bounds[:-1], bounds[1:])
+
+    # Forked workers inherit the builder, so only chunk bounds and
+    # index arrays pass between processes
+    # The pool forks its workers when it starts, so the builder is only
+    # needed until then (the lock keeps concurrent builds apart)
+    global _chunk_builder
+    with _chunk_lock:
+      _chunk_builder = self
+      try:
+        pool = multiprocessing.Pool(min(self.settings['workers'], n_chunks))
+      finally:
+        _chunk_builder = None
+    results = pool.imap(_pair_chunk, chunks)
+    try:
+      for batches, counts in results:
+        for name, n in counts.items():
+          self.profile.count(name, n)
+        for batch in batches:
+          yield batch
+    finally:
+      # A worker terminated while sending its batches can leave the result
+      # queue locked and the pool hung, so if the batches are not all read
+      # (e.g. top_k pairs were found) the remaining chunks are let finish
+      pool.close()
+      try:
+        for result in results:
+          pass
+      except Exception:
+        pass
+      pool.join()
+
+
+
+  def _candidate_batches(self, first, stop, counts):
+    """Generator that yields (rows, stats) batches for the candidate pairs whose
+    gRNA 2 index lies in [first, stop). rows is an array of (i, k, j, m) index
+    rows: gRNA 1 is G-start variant k of sequence i, and gRNA 2 is variant m
+    of sequence j (or sequence j itself if m is -1). stats holds the deletion
+    stats of the rows that delete enough exon bps. Counters are added to counts."""
+
+    sequences = self.sequences
+    limit = self.settings['separation_limit']
+    g_starts = self.expand_G_starts()
+    cut_sites = [seq.cut_site for seq in sequences]
+
+    # Starts from the first sequence in reach of sequence first, so the
+    # window holds the same sequences as in a run over the whole gene
+    start = first
+    while start > 0 and abs(cut_sites[first] - cut_sites[start - 1]) <= limit:
+      start -= 1
+
+    # A window of (i, k, gRNA 1) awaiting second sequences to pair.
+    # The window is ordered by cut site, so its head is always the
+    # sequence furthest upstream of seq2.
+    start_seqs = deque()
+
+    # (i, k, j, m) rows awaiting deletion stats
+    candidates = []
+
+    n_considered = n_overlaps = 0
+
+    for j in xrange(start, stop):
+      seq2 = sequences[j]
+
+      # Evicts start sequences that are too far upstream
+      while len(start_seqs) > 0 and abs(seq2.cut_site - start_seqs[0][2].cut_site) > limit:
+        start_seqs.popleft()
+
+      if j >= first:
+        n_considered += len(start_seqs)
+
+        seq2_variants = range(len(g_starts[j])) if self.settings['gRNA2_start_G'] else [-1]
+
+        for i, k, seq1 in start_seqs:
+          # Skips overlapping sequences
+          if seq1.overlap_Q(seq2):
+            n_overlaps += 1
+            continue
+
           else:
-            new_guidepair = gp.GuidePair(seq1, seq2, self.exon_edges)
-            if new_guidepair.deletion_count >= self.settings['min_exon_deletion']:
-              self.guidepairs.append(new_guidepair)
-            else:
-              continue
+            candidates += [(i, k, j, m) for m in seq2_variants]
 
-      start_seqs += seq2.find_G_starts()
+        # Deletion stats are computed for a whole batch of candidates at once
+        if len(candidates) >= GuideBuilder._PAIR_BATCH_SIZE:
+          yield self._filter_candidates(candidates, cut_sites, counts)
+          candidates = []
 
+      start_seqs.extend((j, k, g_seq) for k, g_seq in enumerate(g_starts[j]))
 
-      if seq2.gene_loc_frac > self.settings['latest_gRNA2']:
-        break
+    if len(candidates) > 0:
+      yield self._filter_candidates(candidates, cut_sites, counts)
+
+    counts['pairs_considered'] = counts.get('pairs_considered', 0) + n_considered
+    counts['pairs_rejected_overlap'] = counts.get('pairs_rejected_overlap', 0) + n_overlaps
+
+
+
+  def _filter_candidates(self, candidates, cut_sites, counts):
+    """Computes the deletion stats for a batch of (i, k, j, m) candidate rows.
+    Returns the rows that delete enough exon bps and their stats."""
+
+    rows = np.array(candidates, dtype=np.int32).reshape(-1, 4)
+    stats = gp.batch_deletion_stats(self.exon_index, cut_sites, cut_sites,
+                                    seq1_idx=rows[:, 0], seq2_idx=rows[:, 2])
+
+    keep = np.flatnonzero(stats['deletion_count'] >= self.settings['min_exon_deletion'])
+
+    counts['candidate_pairs'] = counts.get('candidate_pairs', 0) + len(rows)
+    counts['pairs_rejected_min_deletion'] = (counts.get('pairs_rejected_min_deletion', 0) +
+                                             len(rows) - len(keep))
+
+    return rows[keep], dict((name, stats[name][keep]) for name in
+                            ['deletion_count', 'deletion_fraction', 'deletion_pct'])
 
-    self.sort_pairs(keystr="del_count")
-    self.logger.info('Guide pairs compiled')
 
 
   def get_pairs(self):
@@ -259,4 +811,26 @@ class GuideBuilder(object):
     return self.sequences
 
   def get_gene_size(self):
-    return self.gene_size  
+    return self.gene_size
+
+  def get_exon_index(self):
+    return self.exon_index  
+
+
+
+# The (file key, GenomeTable) of the genome-wide table last read in this process
+_genome_table = (None, None)
+
+
+# The builder whose pairs are built by the worker processes of a parallel build
+_chunk_builder = None
+_chunk_lock = threading.Lock()
+
+
+def _pair_chunk(chunk):
+  """Builds the candidate batches for a (first, stop) chunk of gRNA 2 indices
+  in a worker process. Returns the batches and the pairing counters."""
+
+  counts = {}
+  batches = list(_chunk_builder._candidate_batches(chunk[0], chunk[1], counts))
+  return batches, counts
@@ -1,11 +1,17 @@
 
 #import targetsequence as ts
+import numpy as np
+import exonindex as ei
 
 
 class GuidePair(object):
   """Container for a pair of guide RNAs (each a ts.TargetSequence object)."""
 
-  def __init__(self, seq1, seq2, exon_edges=None):
+  # Slots keep the many pair objects of a gene compact (no __dict__)
+  __slots__ = ('seq1', 'seq2', 'genomic_separation', 'deletion_count',
+               'deletion_fraction', 'deletion_pct', 'frameshift')
+
+  def __init__(self, seq1, seq2, exon_index=None):
     self.seq1 = seq1
     self.seq2 = seq2
 
@@ -15,54 +21,60 @@ class GuidePair(object):
     self.deletion_count = None
     self.deletion_fraction = None
     self.deletion_pct = None
-    if exon_edges is not None:
-      self.compute_deletion_stats(exon_edges)
+    self.frameshift = None
+    if exon_index is not None:
+      self.compute_deletion_stats(exon_index)
 
 
 
-  def compute_deletion_stats(self, exon_edges):
+  def compute_deletion_stats(self, exon_index):
     """Computes the number of deleted bps and the fraction of 
-    the full gene deleted then sets those attributes."""
-
-    # The size of the gene in bps
-    gene_size = reduce(lambda tot, edge: tot + edge[1]+1 - edge[0], 
-                                  exon_edges, 0)
-
-    self.deletion_count = 0
+    the full gene deleted then sets those attributes.
+    Accepts an ExonIndex (or a list of exon edges)."""
 
-    left_cut = min(self.seq1.cut_site, self.seq2.cut_site)
-    right_cut = max(self.seq1.cut_site, self.seq2.cut_site)
-    
-    for edge in exon_edges:
+    exon_index = ei.as_exon_index(exon_index)
 
-      if edge[1] <= left_cut:
-        # XXXXX----|---|--
-        continue
+    # Counts the exon bps that fall between the two cut sites
+    self.deletion_count = exon_index.exon_bp_between(self.seq1.cut_site, self.seq2.cut_site)
 
-      elif edge[0] <= left_cut < edge[1] <= right_cut:
-        # XXX|XXXXX----|--
-        self.deletion_count += (edge[1] - left_cut)
+    self.deletion_fraction = float(self.deletion_count) / exon_index.size
+    self.deletion_pct = int(100 * self.deletion_fraction)
+    self.frameshift = self.deletion_count % 3 != 0
 
-      elif edge[0] <= left_cut and right_cut < edge[1]:
-        # XXX|XXXXXX|XXX
-        self.deletion_count += (right_cut - left_cut)
 
-      elif left_cut < edge[0] and edge[1] <= right_cut:
-        # -|--XXXXXX---|--
-        self.deletion_count += (edge[1] - edge[0] + 1)
 
-      elif left_cut < edge[0] <= right_cut < edge[1]:
-        # --|---XXXXX|XXX
-        self.deletion_count += (right_cut - edge[0] + 1)
+  def set_deletion_stats(self, deletion_count, deletion_fraction, deletion_pct):
+    """Sets precomputed deletion stats (e.g. from batch_deletion_stats)."""
 
-      else:   # self.seq2.cut_site < edge[0]
-        break
+    self.deletion_count = deletion_count
+    self.deletion_fraction = deletion_fraction
+    self.deletion_pct = deletion_pct
+    self.frameshift = self.deletion_count % 3 != 0
 
 
-    self.deletion_fraction = float(self.deletion_count) / gene_size
-    self.deletion_pct = int(100 * self.deletion_fraction)
 
+def batch_deletion_stats(exon_index, cut_sites1, cut_sites2, seq1_idx=None, seq2_idx=None):
+  """Computes the deletion stats of many guide pairs at once.
+  The cut site arrays hold the cut sites of the two guides of each pair.
+  If the (seq1_idx, seq2_idx) index arrays are given, the cut site arrays
+  are instead lookup tables indexed by them.
+  Returns a dict of arrays keyed by 'deletion_count', 'deletion_fraction',
+  'deletion_pct' and 'frameshift' that match GuidePair.compute_deletion_stats."""
 
+  exon_index = ei.as_exon_index(exon_index)
 
+  cut_sites1 = np.asarray(cut_sites1, dtype=np.int64)
+  cut_sites2 = np.asarray(cut_sites2, dtype=np.int64)
+  if seq1_idx is not None:
+    cut_sites1 = cut_sites1[np.asarray(seq1_idx)]
+  if seq2_idx is not None:
+    cut_sites2 = cut_sites2[np.asarray(seq2_idx)]
 
+  deletion_count = exon_index.exon_bp_between_many(cut_sites1, cut_sites2)
+  deletion_fraction = deletion_count / float(exon_index.size)
 
+  return { 'deletion_count'    : deletion_count ,
+           'deletion_fraction' : deletion_fraction ,
+           'deletion_pct'      : (100 * deletion_fraction).astype(np.int64) ,
+           'frameshift'        : deletion_count % 3 != 0
+          }
@@ -0,0 +1,152 @@
+import log
+import os
+import json
+import time
+import cProfile
+from contextlib import contextmanager
+
+
+class RunProfile(object):
+  """Records per-stage wall and CPU times and named counters for a run.
+  Components take an optional profile and report their stages and counters
+  to it. A stage entered more than once accumulates its times. A stage
+  entered inside another stage is reported with the name of that stage in
+  'within', since its time is also part of the enclosing stage.
+  Usage:
+    profile = RunProfile()
+    with profile.stage('read'):
+      ...
+    profile.count('rows_parsed', n)
+    profile.write(report_file)
+  """
+
+  def __init__(self, cprofile_file=None):
+
+    self.logger = log.getLogger(__name__)
+
+    # Stage names in the order they are first entered
+    self.stage_names = []
+    self.stages = {}
+    self.counters = {}
+
+    # The names of the stages being run, innermost last
+    self.active_stages = []
+
+    # If set, the pairing stage is run under cProfile and its stats dumped here
+    self.cprofile_file = cprofile_file
+
+    self.start = time.time()
+
+
+
+  @staticmethod
+  def _cpu_time():
+    times = os.times()
+    return times[0] + times[1]
+
+
+
+  @contextmanager
+  def stage(self, name):
+    """Context manager that adds the wall and CPU time of its block to a stage."""
+
+    if name not in self.stages:
+      self.stage_names.append(name)
+      self.stages[name] = { 'wall_seconds' : 0.0, 'cpu_seconds' : 0.0, 'calls' : 0 }
+    if len(self.active_stages) > 0 and self.active_stages[-1] != name:
+      self.stages[name]['within'] = self.active_stages[-1]
+
+    self.active_stages.append(name)
+    wall_start = time.time()
+    cpu_start = self._cpu_time()
+    try:
+      yield
+    finally:
+      self.active_stages.pop()
+      self.stages[name]['wall_seconds'] += time.time() - wall_start
+      self.stages[name]['cpu_seconds'] += self._cpu_time() - cpu_start
+      self.stages[name]['calls'] += 1
+
+
+
+  @contextmanager
+  def cprofiled(self):
+    """Context manager that runs its block under cProfile if a cProfile
+    dump file was given."""
+
+    if self.cprofile_file is None:
+      yield
+      return
+
+    profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+      yield
+    finally:
+      profiler.disable()
+      profiler.dump_stats(self.cprofile_file)
+      self.logger.info('Wrote cProfile stats to %s' % self.cprofile_file.split('/')[-1])
+
+
+
+  def count(self, name, n=1):
+    """Adds n to a named counter."""
+    self.counters[name] = self.counters.get(name, 0) + n
+
+
+
+  def report(self):
+    """Returns the run report as a dict."""
+
+    stages = []
+    for name in self.stage_names:
+      stage = { 'stage' : name }
+      stage.update(self.stages[name])
+      stage['wall_seconds'] = round(stage['wall_seconds'], 6)
+      stage['cpu_seconds'] = round(stage['cpu_seconds'], 6)
+      stages.append(stage)
+
+    return { 'stages'        : stages ,
+             'counters'      : dict(self.counters) ,
+             'total_seconds' : round(time.time() - self.start, 6) }
+
+
+
+  def write(self, report_file):
+    """Writes the run report to a JSON file."""
+
+    with open(report_file, 'w') as outfile:
+      json.dump(self.report(), outfile, indent=2, sort_keys=True)
+
+    self.logger.info('Successfully wrote run profile to %s' % report_file.split('/')[-1])
+
+
+
+  def log_report(self):
+    """Emits the run report as JSON through the logger."""
+    self.logger.info('Run profile: %s' % json.dumps(self.report(), sort_keys=True))
+
+
+
+class NullProfile(RunProfile):
+  """A RunProfile that records nothing. Used when no profile is given."""
+
+  def __init__(self):
+    super(NullProfile, self).__init__()
+
+  @contextmanager
+  def stage(self, name):
+    yield
+
+  @contextmanager
+  def cprofiled(self):
+    yield
+
+  def count(self, name, n=1):
+    pass
+
+
+
+def as_profile(profile):
+  """Returns profile, or a NullProfile if profile is None."""
+  return NullProfile() if profile is None else profile
@@ -1,17 +1,25 @@
 
 import log
-import csv
+import os
+import itertools
+import outputwriters as ow
+import instrumentation as instr
 
 
 class OutputFormatter(object):
-  """Writes potential gene block data to a csv file."""
+  """Writes potential gene block data to a csv file (or another format of
+  outputwriters)."""
 
-  def __init__(self, constants_file):
+  def __init__(self, constants_file, profile=None):
     self.logger = log.getLogger(__name__)
+    self.profile = instr.as_profile(profile)
 
     self.gene_block_constants = {}
     self._read_gene_block_constants(constants_file)
 
+    # The constant parts of the gene block are joined once
+    self.block_parts = self._block_parts()
+
 
 
   def _read_gene_block_constants(self, constsfilepath):
@@ -24,54 +32,136 @@ class OutputFormatter(object):
 
 
 
+  # Constants that make up the gene block around the two guide sequences:
+  #   prefix + gRNA 1 + middle + gRNA 2 + suffix
+  _PREFIX = ['u6prom__cln_hom_arm']
+  _MIDDLE = ['crispr_scaff_2', 'csy4_clvg']
+  _SUFFIX = ['crispr_scaff_1__cln_hom_arm']
+
+  HEADER = ['gRNA 1', 'genomic loc 1', 
+             'gene loc frac 1', 'exon 1',
+             'strand 1', 'GC% 1', 
+             'off-targets 1', 
+             '',
+            'gRNA 2', 'genomic loc 2',
+             'gene loc frac 2', 'exon 2',
+             'strand 2', 'GC% 2', 
+             'off-targets 2', 
+             '',
+            'gRNA separation (bp)', 
+            'del count (bp)', 'del%', 'frameshift',
+            '',
+            'full gene block']
+
+  # Rows passed to the writer at a time
+  _ROW_BATCH_SIZE = 4096
+
+
+
+  def _block_parts(self):
+    """Returns the (prefix, middle, suffix) constant parts of the gene block."""
+    return tuple(''.join(self.gene_block_constants[name] for name in names)
+                 for names in [OutputFormatter._PREFIX, OutputFormatter._MIDDLE,
+                               OutputFormatter._SUFFIX])
+
+
+
   def _assemble_gene_block(self, guidepair):
     """Assembles the gene block constants and the sequences into a full gene block string."""
 
-    return self.gene_block_constants['u6prom__cln_hom_arm'] + \
-              guidepair.seq1.sequence + \
-              self.gene_block_constants['crispr_scaff_2'] + \
-              self.gene_block_constants['csy4_clvg'] + \
-              guidepair.seq2.sequence + \
-              self.gene_block_constants['crispr_scaff_1__cln_hom_arm']
-
-
-
-  def write(self, guidepairs, outfilepath):
-
-    with open(outfilepath, 'w') as constsfile:
-      writer = csv.writer(constsfile, dialect='excel')
-
-      writer.writerow(['gRNA 1', 'genomic loc 1', 
-                        'gene loc frac 1', 'exon 1',
-                        'strand 1', 'GC% 1', 
-                        'off-targets 1', 
-                        '',
-                       'gRNA 2', 'genomic loc 2',
-                        'gene loc frac 2', 'exon 2',
-                        'strand 2', 'GC% 2', 
-                        'off-targets 2', 
-                        '',
-                       'gRNA separation (bp)', 
-                       'del count (bp)', 'del%', 'frameshift',
-                       '',
-                       'full gene block'])
-
-      for pair in guidepairs:
-        writer.writerow([pair.seq1.sequence, pair.seq1.gnm_loc,
-                          pair.seq1.gene_loc_frac, pair.seq1.exon_num,
-                          pair.seq1.strand, pair.seq1.gc_content, 
-                          pair.seq1.offtargets,
-                         '',
-                         pair.seq2.sequence, pair.seq2.gnm_loc,
-                          pair.seq2.gene_loc_frac, pair.seq2.exon_num,
-                          pair.seq2.strand, pair.seq2.gc_content, 
-                          pair.seq2.offtargets,
-                         '',
-                         pair.genomic_separation,
-                         pair.deletion_count,
-                         pair.deletion_pct,
-                         ('no' if pair.deletion_count % 3 == 0 else 'yes'),
-                         '',
-                         self._assemble_gene_block(pair)])
-
-    self.logger.info('Successfully wrote candidate pairs to %s' % outfilepath.split('/')[-1])
\ No newline at end of file
+    prefix, middle, suffix = self.block_parts
+    return prefix + guidepair.seq1.sequence + middle + guidepair.seq2.sequence + suffix
+
+
+
+  def write(self, guidepairs, outfilepath, output_format=None, gene_blocks='full'):
+    """Writes the guide pairs to outfilepath and returns the number of pairs written.
+    guidepairs may be any iterable (e.g. GuideBuilder.iter_pairs()); pairs are
+    formatted and written in batches of rows. No file is written if there are no pairs.
+    output_format is a format name of outputwriters (csv, csv.gz, jsonl or
+    parquet) and is taken from the extension of outfilepath by default.
+    With gene_blocks 'reference', the full gene block column is left out of
+    the rows and its constant parts are written once: in the header of the
+    text formats and in the metadata of the others."""
+
+    with self.profile.stage('write'):
+      return self._write(guidepairs, outfilepath, output_format, gene_blocks)
+
+
+
+  def _write(self, guidepairs, outfilepath, output_format, gene_blocks):
+
+    guidepairs = iter(guidepairs)
+    first_pair = next(guidepairs, None)
+    if first_pair is None:
+      self.profile.count('pairs_written', 0)
+      return 0
+
+    if output_format is None:
+      output_format = ow.format_of(outfilepath)
+    writer_class = ow.WRITERS[output_format]
+
+    prefix, middle, suffix = self.block_parts
+    by_reference = gene_blocks == 'reference'
+
+    columns = list(OutputFormatter.HEADER)
+    metadata = None
+    if by_reference:
+      columns.pop()
+      if writer_class.TEXT:
+        columns.append('gene block: %s + gRNA 1 + %s + gRNA 2 + %s' % (prefix, middle, suffix))
+      metadata = { 'gene_block' : { 'prefix' : prefix, 'middle' : middle, 'suffix' : suffix } }
+
+    # The fields of each guide and its gene block fragments are built once,
+    # however many pairs the guide is in
+    guide_fields = {}
+    head_fragments = {}
+    tail_fragments = {}
+
+    def fields(seq):
+      entry = guide_fields.get(id(seq))
+      if entry is None:
+        entry = (seq, [seq.sequence, seq.gnm_loc, seq.gene_loc_frac, seq.exon_num,
+                       seq.strand, seq.gc_content,
+                       str(seq.offtargets) if writer_class.TEXT else list(seq.offtargets), ''])
+        guide_fields[id(seq)] = entry
+      return entry[1]
+
+    n_written = 0
+
+    writer = writer_class(outfilepath, columns, metadata)
+    try:
+      pairs = itertools.chain([first_pair], guidepairs)
+      while True:
+        rows = []
+        for pair in itertools.islice(pairs, OutputFormatter._ROW_BATCH_SIZE):
+          row = (fields(pair.seq1) + fields(pair.seq2) +
+                 [pair.genomic_separation,
+                  pair.deletion_count,
+                  pair.deletion_pct,
+                  ('yes' if pair.frameshift else 'no'),
+                  ''])
+
+          if not by_reference:
+            head = head_fragments.get(pair.seq1.sequence)
+            if head is None:
+              head = head_fragments[pair.seq1.sequence] = prefix + pair.seq1.sequence + middle
+            tail = tail_fragments.get(pair.seq2.sequence)
+            if tail is None:
+              tail = tail_fragments[pair.seq2.sequence] = pair.seq2.sequence + suffix
+            row.append(head + tail)
+
+          rows.append(row)
+
+        if len(rows) == 0:
+          break
+        writer.write_rows(rows)
+        n_written += len(rows)
+    finally:
+      writer.close()
+
+    self.profile.count('bytes_written', os.path.getsize(outfilepath))
+    self.profile.count('pairs_written', n_written)
+
+    self.logger.info('Successfully wrote candidate pairs to %s' % outfilepath.split('/')[-1])
+    return n_written
@@ -0,0 +1,198 @@
+import csv
+import gzip
+import json
+import cStringIO
+
+try:
+  import pyarrow
+  import pyarrow.parquet
+except ImportError:
+  pyarrow = None
+
+
+# The output writers of OutputFormatter. Each writer takes the output path,
+# the column names (an empty name marks a spacer column of the text formats)
+# and a dict of metadata, writes rows (lists with one value per column) and
+# is closed once all rows are written. Writers are registered by format name
+# and file extension in WRITERS and EXTENSIONS, so a new format only needs
+# a writer class and a register_writer() call.
+
+
+
+class CsvWriter(object):
+  """Writes Excel-dialect CSV rows. The metadata is not written."""
+
+  # Text formats expect the off-target tuples already formatted as strings
+  TEXT = True
+
+  def __init__(self, filepath, columns, metadata=None):
+    self.outfile = self._open(filepath)
+
+    # Rows are formatted into a buffer and written to the file in one call
+    self.buffer = cStringIO.StringIO()
+    self.writer = csv.writer(self.buffer, dialect='excel')
+    self.write_rows([columns])
+
+  def _open(self, filepath):
+    return open(filepath, 'w')
+
+  def write_rows(self, rows):
+    self.writer.writerows(rows)
+    self.outfile.write(self.buffer.getvalue())
+    self.buffer.seek(0)
+    self.buffer.truncate()
+
+  def close(self):
+    self.outfile.close()
+
+
+
+class GzipCsvWriter(CsvWriter):
+  """Writes gzip-compressed Excel-dialect CSV rows as they are streamed."""
+
+  # Fast compression: the output is streamed while pairs are built
+  COMPRESSION_LEVEL = 1
+
+  def _open(self, filepath):
+    return gzip.open(filepath, 'wb', compresslevel=GzipCsvWriter.COMPRESSION_LEVEL)
+
+
+
+class JsonLinesWriter(object):
+  """Writes one JSON object per row, keyed by column name, without the
+  spacer columns. The metadata, if any, is written as a first line of the
+  form {"metadata": {...}}. Files ending in .gz are gzip-compressed."""
+
+  TEXT = False
+
+  def __init__(self, filepath, columns, metadata=None):
+    if filepath.endswith('.gz'):
+      self.outfile = gzip.open(filepath, 'wb', compresslevel=GzipCsvWriter.COMPRESSION_LEVEL)
+    else:
+      self.outfile = open(filepath, 'w')
+
+    self.keep = [i for i, name in enumerate(columns) if name]
+    self.names = [columns[i] for i in self.keep]
+
+    if metadata:
+      self.outfile.write(json.dumps({ 'metadata' : metadata }) + '\n')
+
+  def write_rows(self, rows):
+    self.outfile.write(''.join(json.dumps(dict(zip(self.names, [row[i] for i in self.keep]))) + '\n'
+                               for row in rows))
+
+  def close(self):
+    self.outfile.close()
+
+
+
+class ParquetWriter(object):
+  """Writes the rows as columns of a Parquet file (requires pyarrow), one
+  row group per batch of rows, without the spacer columns. The metadata is
+  stored in the file schema."""
+
+  TEXT = False
+
+  # Rows per row group
+  ROW_GROUP_SIZE = 65536
+
+  def __init__(self, filepath, columns, metadata=None):
+    if pyarrow is None:
+      raise ImportError('Cannot write Parquet output: the pyarrow module is not installed')
+
+    self.filepath = filepath
+    self.keep = [i for i, name in enumerate(columns) if name]
+    self.names = [columns[i] for i in self.keep]
+    self.metadata = dict((key, json.dumps(value)) for key, value in (metadata or {}).items())
+
+    self.writer = None
+    self.buffer = []
+
+  def write_rows(self, rows):
+    self.buffer.extend(rows)
+    if len(self.buffer) >= ParquetWriter.ROW_GROUP_SIZE:
+      self._flush()
+
+  def _flush(self):
+    if len(self.buffer) == 0:
+      return
+
+    table = pyarrow.Table.from_arrays([self._column([row[i] for row in self.buffer]) for i in self.keep],
+                                      names=self.names)
+    if self.writer is None:
+      schema = table.schema.with_metadata(self.metadata) if self.metadata else table.schema
+      self.writer = pyarrow.parquet.ParquetWriter(self.filepath, schema)
+    self.writer.write_table(table.cast(self.writer.schema))
+    self.buffer = []
+
+  @staticmethod
+  def _column(values):
+    # Byte strings are stored as utf8 text rather than binary
+    if isinstance(values[0], str):
+      return pyarrow.array(values, type=pyarrow.string())
+    return pyarrow.array(values)
+
+  def close(self):
+    self._flush()
+    if self.writer is not None:
+      self.writer.close()
+
+
+
+# Writer classes by format name
+WRITERS = {}
+
+# (extension, format name) pairs, longest extensions first
+EXTENSIONS = []
+
+# The extension of output files of each format name
+DEFAULT_EXTENSIONS = {}
+
+
+
+def register_writer(name, writer, extensions):
+  """Registers a writer class for a format name and its file extensions."""
+
+  WRITERS[name] = writer
+  DEFAULT_EXTENSIONS[name] = extensions[0]
+  for extension in extensions:
+    EXTENSIONS.append((extension, name))
+  EXTENSIONS.sort(key=lambda entry: len(entry[0]), reverse=True)
+
+
+
+register_writer('csv', CsvWriter, ['.csv'])
+register_writer('csv.gz', GzipCsvWriter, ['.csv.gz'])
+register_writer('jsonl', JsonLinesWriter, ['.jsonl', '.jsonl.gz'])
+register_writer('parquet', ParquetWriter, ['.parquet'])
+
+
+
+def format_of(filepath):
+  """Returns the format name of an output path by its extension (csv if the
+  extension is not registered)."""
+
+  for extension, name in EXTENSIONS:
+    if filepath.lower().endswith(extension):
+      return name
+  return 'csv'
+
+
+
+def split_extension(filepath):
+  """Returns the (base, extension) of an output path, where the extension
+  is a registered one (e.g. '.csv.gz') or the last extension otherwise."""
+
+  for extension, name in EXTENSIONS:
+    if filepath.lower().endswith(extension):
+      return filepath[:-len(extension)], filepath[-len(extension):]
+
+  if '.' in filepath.split('/')[-1]:
+    return filepath[:filepath.rfind('.')], filepath[filepath.rfind('.'):]
+  return filepath, ''
+
+
+
+def default_extension(name):
+  """Returns the file extension of a format name (None if not registered)."""
+  return DEFAULT_EXTENSIONS.get(name)
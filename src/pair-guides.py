@@ -4,10 +4,14 @@
 import log
 import sys
 import os
-import guidebuilder as gb
-import ccdsloader as ccds
+import argparse
+import pipeline
+import batchrunner as br
+import instrumentation as instr
+import sweep as sw
+import service as svc
 import settingsreader as sr
-import outputformatter as of
+import resultcache as rc
 
 
 
@@ -21,14 +25,85 @@ if __name__ == '__main__':
   project_dir = os.path.dirname( os.path.realpath(__file__) )
   if os.path.basename(project_dir) == 'src':
     project_dir = os.path.normpath( os.path.join(project_dir, "..") )
+  constants_file = project_dir + '/gene_block_constants.const'
+
+
+  parser = argparse.ArgumentParser(prog='pair-guides',
+                                   description='Finds viable gRNA pairs for dual-guide gene blocks.')
+  parser.add_argument('settings_file', nargs='?',
+                      help='settings file (in batch and service modes, settings shared by every gene)')
+  parser.add_argument('--batch', metavar='MANIFEST',
+                      help='run every gene listed in MANIFEST, one settings file or ' +
+                           '"CCDS_ID input_file [output_file]" per line')
+  parser.add_argument('--workers', type=int, default=None,
+                      help='number of genes paired in parallel in batch mode (default: all cores)')
+  parser.add_argument('--summary', metavar='FILE',
+                      help='batch or sweep summary table ' +
+                           '(default: MANIFEST or GRID basename + _summary.csv)')
+  parser.add_argument('--sweep', metavar='GRID',
+                      help='pair one gene for every combination of the settings in GRID, ' +
+                           'a settings file whose swept values are separated by commas')
+  parser.add_argument('--sweep-outputs', action='store_true',
+                      help='in sweep mode, also write the pairs of each combination')
+  parser.add_argument('--serve', metavar='ADDRESS',
+                      help='serve one gene per JSON request line on ADDRESS, a Unix socket ' +
+                           'path or a localhost port, keeping caches warm between genes')
+  parser.add_argument('--invalidate-results', metavar='TARGET', nargs='*',
+                      help='remove the cached run results of the given CCDS IDs or results ' +
+                           'files (all cached results if none are given), then exit')
+  parser.add_argument('--profile', metavar='FILE',
+                      help='write a JSON report of the stage times and counters of the run to FILE')
+  parser.add_argument('--cprofile', metavar='FILE',
+                      help='dump cProfile stats of the pairing stage to FILE')
+  args = parser.parse_args()
+
+
+  if args.invalidate_results is not None:
+    settings = {}
+    if args.settings_file is not None:
+      settings = sr.SettingsReader(args.settings_file).settings
+    cache = rc.ResultCache.from_settings(settings)
+    if cache is not None:
+      n_removed = cache.invalidate(args.invalidate_results)
+      logger.info('Removed %d cached run results' % n_removed)
+    sys.exit()
+
+
+  if args.batch is not None:
+    runner = br.BatchRunner(constants_file, args.settings_file, workers=args.workers)
+    runner.read(args.batch)
+    summary_file = args.summary
+    if summary_file is None:
+      summary_file = ".".join(args.batch.split('.')[:-1] or [args.batch]) + '_summary.csv'
+    runner.run(summary_file)
+    sys.exit()
+
+
+  if args.serve is not None:
+    svc.PairService(constants_file, args.settings_file).serve(args.serve)
+    sys.exit()
+
+
+  if args.sweep is not None:
+    sweep = sw.ParameterSweep(args.sweep)
+    exon_index = pipeline.load_exon_index(sweep.settings)
+    if exon_index is None:
+      logger.error('Cannot load the exon edges for %s' % sweep.settings['CCDS_ID'])
+      exit()
+    sweep.build(exon_index)
+    summary_file = args.summary
+    if summary_file is None:
+      summary_file = ".".join(args.sweep.split('.')[:-1] or [args.sweep]) + '_summary.csv'
+    sweep.write_summary(sweep.run(constants_file, args.sweep_outputs), summary_file)
+    sys.exit()
 
 
   # The settings file can be specified as a cmd-line input
   # otherwise, the script will search the working dir for
   # a file named settings.inp or gene_block_settings.inp
   settings_file = None
-  if len(sys.argv) >= 2:
-    settings_file = sys.argv[1]
+  if args.settings_file is not None:
+    settings_file = args.settings_file
   elif os.path.exists('gene_block_settings.inp'):
     settings_file = 'gene_block_settings.inp'
   elif os.path.exists('settings.inp'):
@@ -38,22 +113,21 @@ if __name__ == '__main__':
                   'run pair-guides in a directory with gene_block_settings.inp')
     exit()
 
-  settings = sr.SettingsReader(settings_file)
+  profile = None
+  if args.profile is not None or args.cprofile is not None:
+    profile = instr.RunProfile(cprofile_file=args.cprofile)
+
+  settings = sr.SettingsReader(settings_file, profile=profile)
   logger.info('Reading settings from %s' % settings_file)
 
-  loader = ccds.CcdsLoader()
-  loader.load(settings.settings)
-  edges = loader.get_exon_edges()
-  
+  exon_index = pipeline.load_exon_index(settings.settings, profile=profile)
+  if exon_index is None:
+    logger.error('Cannot load the exon edges for %s' % settings.settings['CCDS_ID'])
+    exit()
 
-  builder = gb.GuideBuilder(settings.settings)
-  builder.set_exon_edges(edges)
-  builder.build_pairs()
-  builder.sort_pairs(keystr="deletion_count")
-  pairs = builder.get_pairs()
+  pipeline.run(settings.settings, constants_file, exon_index, profile=profile)
 
-  if len(pairs) == 0:
-    logger.warning('Unable to find guide pairs with given settings.')
-  else:
-    outputter = of.OutputFormatter(project_dir + '/gene_block_constants.const')
-    outputter.write(pairs, settings.settings['output_file'])
\ No newline at end of file
+  if profile is not None:
+    profile.log_report()
+    if args.profile is not None:
+      profile.write(args.profile)
@@ -0,0 +1,181 @@
+import numpy as np
+import guidepair as gp
+
+
+class PairTable(object):
+  """The guide pairs of a gene held as columns of arrays over an ordered list
+  of guides. Each row holds the indices of its two guides in that list (as
+  int32) and the genomic separation and deletion stats of the pair, so a
+  guide found in thousands of pairs is stored once. Sorting, filtering and
+  top-N selection run on the arrays, and a GuidePair is only built when its
+  row is read (by iterating or indexing the table).
+  Usage:
+    table = PairTable(guides)
+    table.extend(guide1_idx, guide2_idx, stats)
+    table.sort(['deletion_count'], '+')
+    for pair in table.head(10):
+      ...
+  """
+
+  # The columns of the table and their types
+  COLUMNS = [('guide1',             np.int32),
+             ('guide2',             np.int32),
+             ('genomic_separation', np.int64),
+             ('deletion_count',     np.int64),
+             ('deletion_fraction',  np.float64),
+             ('deletion_pct',       np.int64)]
+
+  # Rows turned into GuidePairs at a time while iterating
+  _ITER_CHUNK_SIZE = 4096
+
+  def __init__(self, guides, _lookups=None):
+
+    self.guides = guides
+
+    # The genomic location and cut site of each guide
+    if _lookups is None:
+      _lookups = (np.array([guide.gnm_loc for guide in guides], dtype=np.int64),
+                  np.array([guide.cut_site for guide in guides], dtype=np.int64))
+    self.gnm_locs, self.cut_sites = _lookups
+
+    self._columns = dict((name, np.empty(0, dtype=dtype)) for name, dtype in PairTable.COLUMNS)
+
+    # Column batches not yet joined to the columns
+    self._batches = []
+    self._n_batched = 0
+
+
+
+  def extend(self, guide1, guide2, stats):
+    """Adds rows for the pairs of guides at the guide1 and guide2 indices,
+    given a dict of their 'deletion_count', 'deletion_fraction' and
+    'deletion_pct' arrays (as from guidepair.batch_deletion_stats)."""
+
+    guide1 = np.asarray(guide1, dtype=np.int32)
+    guide2 = np.asarray(guide2, dtype=np.int32)
+
+    batch = { 'guide1'             : guide1 ,
+              'guide2'             : guide2 ,
+              'genomic_separation' : np.abs(self.cut_sites[guide2] - self.cut_sites[guide1]) }
+    for name in ['deletion_count', 'deletion_fraction', 'deletion_pct']:
+      batch[name] = stats[name]
+
+    self._batches.append(batch)
+    self._n_batched += len(guide1)
+
+
+
+  @property
+  def columns(self):
+    """The dict of column arrays of the table, keyed by column name."""
+
+    # Batches are joined once, when the columns are next needed
+    if len(self._batches) > 0:
+      self._columns = dict((name, np.concatenate([self._columns[name]] +
+                                                 [batch[name] for batch in self._batches]).astype(dtype))
+                           for name, dtype in PairTable.COLUMNS)
+      self._batches = []
+      self._n_batched = 0
+    return self._columns
+
+
+
+  def __len__(self):
+    return len(self._columns['guide1']) + self._n_batched
+
+
+
+  def take(self, rows):
+    """Returns a new PairTable of the given rows (an index array or slice)."""
+
+    table = PairTable(self.guides, _lookups=(self.gnm_locs, self.cut_sites))
+    table._columns = dict((name, column[rows]) for name, column in self.columns.items())
+    return table
+
+
+
+  def filter(self, mask):
+    """Returns a new PairTable of the rows where the boolean mask is True."""
+    return self.take(np.flatnonzero(mask))
+
+
+
+  def head(self, k):
+    """Returns a new PairTable of the first k rows."""
+    return self.take(slice(0, k))
+
+
+
+  def sort_keys(self, names, strand='+'):
+    """Returns the key column of each sort key name (see
+    GuideBuilder._sort_key_names). Lower keys come first: pairs are ordered
+    by descending deletion count and fraction and by ascending separation
+    and location of gRNA 1 (descending on the - strand)."""
+
+    columns = self.columns
+    sign = -1 if strand == '-' else 1
+
+    keys = []
+    for name in names:
+      if name == 'genomic_location':
+        keys.append(self.gnm_locs[columns['guide1']] * sign)
+      elif name == 'genomic_separation':
+        keys.append(columns['genomic_separation'])
+      else:
+        keys.append(-columns[name])
+    return keys
+
+
+
+  def sort_order(self, names, strand='+'):
+    """Returns the row order of a stable sort by the sort key names."""
+
+    # lexsort sorts by its last key first
+    return np.lexsort(self.sort_keys(names, strand)[::-1] or [np.arange(len(self))])
+
+
+
+  def sort(self, names, strand='+'):
+    """Sorts the rows in place by the sort key names. The sort is stable."""
+
+    order = self.sort_order(names, strand)
+    self._columns = dict((name, column[order]) for name, column in self.columns.items())
+
+
+
+  def pair(self, row):
+    """Returns the GuidePair of a row."""
+
+    columns = self.columns
+    pair = gp.GuidePair(self.guides[columns['guide1'][row]], self.guides[columns['guide2'][row]])
+    pair.set_deletion_stats(int(columns['deletion_count'][row]),
+                            float(columns['deletion_fraction'][row]),
+                            int(columns['deletion_pct'][row]))
+    return pair
+
+
+
+  def __getitem__(self, index):
+    if isinstance(index, slice):
+      return self.take(index)
+    if index < 0:
+      index += len(self)
+    if not 0 <= index < len(self):
+      raise IndexError('PairTable index out of range')
+    return self.pair(index)
+
+
+
+  def __iter__(self):
+    """Yields the GuidePair of each row, built as it is reached."""
+
+    columns = self.columns
+    guides = self.guides
+    for start in xrange(0, len(self), PairTable._ITER_CHUNK_SIZE):
+      chunk = slice(start, start + PairTable._ITER_CHUNK_SIZE)
+      for guide1, guide2, count, frac, pct in zip(*[columns[name][chunk].tolist() for name in
+                                                    ['guide1', 'guide2', 'deletion_count',
+                                                     'deletion_fraction', 'deletion_pct']]):
+        pair = gp.GuidePair(guides[guide1], guides[guide2])
+        pair.set_deletion_stats(count, frac, pct)
+        yield pair
@@ -0,0 +1,103 @@
+import log
+import time
+import guidebuilder as gb
+import ccdsloader as ccds
+import annotationloader as al
+import outputformatter as of
+import resultcache as rc
+import instrumentation as instr
+
+
+logger = log.getLogger(__name__)
+
+
+
+def make_loader(settings, profile=None):
+  """Returns the loader of CCDS entries given by the settings: an
+  AnnotationLoader if an annotation_file is set, else a CcdsLoader."""
+
+  if settings.get('annotation_file') is not None:
+    return al.AnnotationLoader(settings['annotation_file'], cache_dir=settings.get('ccds_cache_dir'),
+                               profile=profile)
+  return ccds.CcdsLoader(profile=profile)
+
+
+
+def load_exon_index(settings, loader=None, profile=None):
+  """Loads the CCDS entry given by settings['CCDS_ID'], assigns the strand
+  setting and returns the ExonIndex of the gene (None if it cannot be loaded)."""
+
+  if loader is None:
+    loader = make_loader(settings, profile=profile)
+  loader.load(settings)
+  return loader.get_exon_index()
+
+
+
+def run(settings, constants_file, exon_index, profile=None, outputter=None, tables=None):
+  """Pairs the guides of one gene and writes the pairs to settings['output_file'].
+  Returns a summary dict of the run. An optional instrumentation.RunProfile
+  records the stages and counters of the run. A long-running process can pass
+  an OutputFormatter that has already read constants_file and a
+  tablecache.TableMemo of the tables it has already read."""
+
+  start = time.time()
+  profile = instr.as_profile(profile)
+
+  # A run with the same inputs as a cached run gives back its output
+  cache = rc.ResultCache.from_settings(settings)
+  if cache is not None:
+    with profile.stage('result_cache'):
+      key = cache.key(settings, exon_index, constants_file)
+      summary = cache.get(key, settings['output_file'])
+    if summary is not None:
+      profile.count('result_cache_hits')
+      logger.info('Copied cached pairs for %s to %s' %
+                  (settings['CCDS_ID'], settings['output_file'].split('/')[-1]))
+      summary.update({ 'input_file'  : settings['input_file'] ,
+                       'output_file' : settings['output_file'] if summary['pairs'] > 0 else '' ,
+                       'seconds'     : round(time.time() - start, 3) ,
+                       'cached'      : True })
+      return summary
+
+  builder = gb.GuideBuilder(settings, profile=profile, tables=tables)
+  builder.set_exon_edges(exon_index)
+
+  if outputter is None:
+    outputter = of.OutputFormatter(constants_file, profile=profile)
+
+  if settings['sort_key'] == 'none':
+    # No global sort is needed, so pairs are streamed straight to the output.
+    # The pairs are then built within the write stage.
+    with profile.cprofiled():
+      n_pairs = outputter.write(builder.iter_pairs(), settings['output_file'],
+                                settings.get('output_format'), settings.get('gene_blocks', 'full'))
+  elif settings.get('sort_memory') and not settings.get('top_k'):
+    # The pairs are sorted within the memory budget and merged straight
+    # into the output, so they are built within the write stage too
+    with profile.cprofiled():
+      n_pairs = outputter.write(builder.iter_sorted_pairs(), settings['output_file'],
+                                settings.get('output_format'), settings.get('gene_blocks', 'full'))
+  else:
+    builder.build_pairs()
+    n_pairs = outputter.write(builder.get_pairs(), settings['output_file'],
+                              settings.get('output_format'), settings.get('gene_blocks', 'full'))
+
+  if n_pairs == 0:
+    logger.warning('Unable to find guide pairs with given settings for %s.' % settings['CCDS_ID'])
+
+  summary = { 'CCDS_ID'     : settings['CCDS_ID'] ,
+              'input_file'  : settings['input_file'] ,
+              'output_file' : settings['output_file'] if n_pairs > 0 else '' ,
+              'strand'      : settings['strand'] ,
+              'sequences'   : len(builder.get_sequences()) ,
+              'pairs'       : n_pairs ,
+              'seconds'     : round(time.time() - start, 3) ,
+              'status'      : 'ok' if n_pairs > 0 else 'no pairs' ,
+              'cached'      : False
+             }
+
+  if cache is not None:
+    cache.put(key, summary, settings['output_file'])
+
+  return summary
@@ -0,0 +1,240 @@
+import log
+import os
+import json
+import shutil
+import hashlib
+import tempfile
+import tablecache as tc
+import ccdsloader as ccds
+import guidebuilder as gb
+import outputwriters as ow
+
+
+class ResultCache(object):
+  """A directory of finished pair-guides runs keyed by the hash of everything
+  that decides their output: the contents of the ChopChop results file, the
+  exon edges and strand of the gene, the settings and the gene block
+  constants. A hit gives back the output file and summary of the earlier run
+  without pairing again. The least recently used runs are evicted beyond
+  max_megabytes of output.
+  Usage:
+    cache = ResultCache.from_settings(settings)
+    key = cache.key(settings, exon_index, constants_file)
+    summary = cache.get(key, settings['output_file'])
+  """
+
+  SUBDIR = 'results'
+
+  # Bumped whenever the key or the output format changes
+  FORMAT_VERSION = 2
+
+  # A container for default settings
+  _DEFAULTS = { 'result_cache_dir'  : '~/.pair-guides' , # 'none' disables the cache
+                'result_cache_size' : 1000               # Max MB of cached output
+               }
+
+  # Settings that do not change the pairs written, so are left out of the key
+  _UNKEYED_SETTINGS = ['input_file', 'output_file', 'strand_conflict', 'workers', 'sort_memory', 'offline',
+                       'annotation_file', 'table_cache_dir', 'table_cache_size',
+                       'ccds_cache_dir', 'ccds_cache_ttl', 'ccds_cache_size',
+                       'ccds_workers', 'ccds_retries',
+                       'result_cache_dir', 'result_cache_size']
+
+  def __init__(self, cache_dir, max_megabytes=1000):
+
+    self.logger = log.getLogger(__name__)
+
+    self.cache_dir = os.path.join(os.path.expanduser(cache_dir), ResultCache.SUBDIR)
+    self.max_megabytes = max_megabytes
+
+    if not os.path.isdir(self.cache_dir):
+      try:
+        os.makedirs(self.cache_dir)
+      except OSError:
+        # Another process may have created it first
+        if not os.path.isdir(self.cache_dir):
+          raise
+
+
+
+  @staticmethod
+  def from_settings(settings):
+    """Returns the ResultCache given by the settings, or None if disabled."""
+
+    cache_dir = settings.get('result_cache_dir', ResultCache._DEFAULTS['result_cache_dir'])
+    if str(cache_dir).lower() == 'none':
+      return
+    return ResultCache(cache_dir, settings.get('result_cache_size',
+                                               ResultCache._DEFAULTS['result_cache_size']))
+
+
+
+  @staticmethod
+  def key(settings, exon_index, constants_file):
+    """Returns the key of a run: the sha1 hex digest of the results file
+    contents, the exon edges, the strand, the settings that change the
+    output (unset settings count as their defaults), the output format and
+    the constants."""
+
+    keyed = dict(gb.GuideBuilder._DEFAULTS)
+    keyed.update(settings)
+    for name in ResultCache._UNKEYED_SETTINGS:
+      keyed.pop(name, None)
+
+    # An unset output format follows the extension of the (unkeyed) output file
+    keyed['output_format'] = settings.get('output_format') or ow.format_of(settings['output_file'])
+
+    return hashlib.sha1(json.dumps([ResultCache.FORMAT_VERSION,
+                                    tc.file_key(settings['input_file']),
+                                    [list(edge) for edge in exon_index.edges],
+                                    settings.get('strand'),
+                                    sorted(keyed.items()),
+                                    tc.file_key(constants_file)])).hexdigest()
+
+
+
+  def _path(self, key, extension):
+    return os.path.join(self.cache_dir, '%s.v%d.%s' % (key, ResultCache.FORMAT_VERSION, extension))
+
+
+
+  def get(self, key, output_file):
+    """Copies the cached output of a run to output_file and returns its
+    summary, or returns None on a miss. Runs without pairs have no output."""
+
+    summary_path = self._path(key, 'json')
+    if not os.path.exists(summary_path):
+      return
+
+    try:
+      with open(summary_path, 'r') as summary_file:
+        summary = json.load(summary_file)
+      if summary['pairs'] > 0:
+        shutil.copyfile(self._path(key, 'output'), output_file)
+    except (IOError, OSError, ValueError, KeyError) as e:
+      self.logger.warning('Removing unreadable cached result %s: %s' % (key, e))
+      self.remove(key)
+      return
+
+    # Marks the entry as recently used for eviction
+    os.utime(summary_path, None)
+    return summary
+
+
+
+  def put(self, key, summary, output_file):
+    """Stores the summary and output_file of a run and evicts the least
+    recently used runs beyond max_megabytes."""
+
+    try:
+      if summary['pairs'] > 0:
+        def copy_output(tmp_file):
+          with open(output_file, 'rb') as outfile:
+            shutil.copyfileobj(outfile, tmp_file)
+        self._store(self._path(key, 'output'), copy_output)
+      # The summary is written last, so an entry is only found once complete
+      self._store(self._path(key, 'json'), lambda tmp_file: json.dump(summary, tmp_file))
+    except (IOError, OSError) as e:
+      self.logger.warning('Cannot cache run result: %s' % e)
+      return
+
+    self._evict()
+
+
+
+  def _store(self, path, write):
+    """Writes a file with write(file) to a temporary file first so that
+    readers never see a partial file."""
+
+    fd, tmp_path = tempfile.mkstemp(dir=self.cache_dir, suffix='.tmp')
+    try:
+      with os.fdopen(fd, 'wb') as tmp_file:
+        write(tmp_file)
+      os.rename(tmp_path, path)
+    finally:
+      if os.path.exists(tmp_path):
+        os.remove(tmp_path)
+
+
+
+  def _entries(self):
+    """Returns the (key, summary path) of every cached run."""
+    suffix = '.v%d.json' % ResultCache.FORMAT_VERSION
+    return [(name[:-len(suffix)], os.path.join(self.cache_dir, name))
+            for name in os.listdir(self.cache_dir) if name.endswith(suffix)]
+
+
+
+  def _evict(self):
+
+    if self.max_megabytes is None:
+      return
+
+    entries = []
+    for key, summary_path in self._entries():
+      output_path = self._path(key, 'output')
+      try:
+        size = os.path.getsize(summary_path)
+        if os.path.exists(output_path):
+          size += os.path.getsize(output_path)
+        entries.append((os.path.getmtime(summary_path), size, key))
+      except OSError:
+        # Removed by another process
+        continue
+
+    entries.sort(reverse=True)
+    total = 0
+    for mtime, size, key in entries:
+      total += size
+      if total > self.max_megabytes * (1 << 20):
+        self.remove(key)
+
+
+
+  def remove(self, key):
+    """Removes the cached run for a key."""
+
+    for extension in ['json', 'output']:
+      try:
+        os.remove(self._path(key, extension))
+      except OSError:
+        pass
+
+
+
+  def invalidate(self, targets=None):
+    """Removes the cached runs of the given CCDS ids or results files, or
+    every cached run if no targets are given. Returns the number removed."""
+
+    n_removed = 0
+    for key, summary_path in self._entries():
+      if targets:
+        try:
+          with open(summary_path, 'r') as summary_file:
+            summary = json.load(summary_file)
+        except (IOError, ValueError):
+          summary = {}
+        if not self._matches(summary, targets):
+          continue
+      self.remove(key)
+      n_removed += 1
+
+    return n_removed
+
+
+
+  @staticmethod
+  def _matches(summary, targets):
+    """Returns True if a cached run summary is for one of the targets."""
+
+    # CCDS ids match whatever their version suffix
+    ccds_key = ccds.CcdsLoader._split_id(summary.get('CCDS_ID'))
+
+    for target in targets:
+      target_key = ccds.CcdsLoader._split_id(target)
+      if ccds_key is not None and target_key is not None and target_key[0] == ccds_key[0]:
+        return True
+      if (summary.get('input_file') is not None and
+          os.path.realpath(os.path.expanduser(target)) == os.path.realpath(summary['input_file'])):
+        return True
+    return False
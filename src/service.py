@@ -0,0 +1,222 @@
+import log
+import os
+import copy
+import json
+import socket
+import threading
+import traceback
+import SocketServer
+import ccdsloader as ccds
+import tablecache as tc
+import outputformatter as of
+import settingsreader as sr
+import pipeline
+
+
+class PairService(object):
+  """A long-running pair-guides service that pairs one gene per request.
+  The gene block constants are read once, and the exon data of each CCDS
+  entry and the parsed results tables are kept in memory across requests,
+  so a request only pays for the pairing itself.
+
+  Requests and responses are JSON objects, one per line, over a Unix socket
+  or a localhost TCP port. Each request holds settings keyed as in a
+  settings file, with values given as in a settings file, e.g.
+    {"CCDS_ID": "CCDS7612", "input_file": "/data/NM_005308_results.txt",
+     "max_offtargets": "0 1 5 20"}
+  An optional "settings_file" is read first, and an optional "id" is echoed
+  in the response. The response is the run summary of pipeline.run. Each
+  connection is served in its own thread, so requests run concurrently.
+  Usage:
+    service = PairService(constants_file, defaults_file)
+    service.serve('/tmp/pair-guides.sock')
+  """
+
+  def __init__(self, constants_file, defaults_file=None, max_tables=16):
+
+    self.logger = log.getLogger(__name__)
+
+    self.constants_file = constants_file
+    self.outputter = of.OutputFormatter(constants_file)
+    self.tables = tc.TableMemo(max_tables)
+
+    # Settings shared by every request, which override them
+    self.defaults = {}
+    if defaults_file is not None:
+      self.defaults = sr.SettingsReader(defaults_file).settings
+      for key in ['CCDS_ID', 'input_file', 'output_file']:
+        self.defaults.pop(key, None)
+
+    # Maps (annotation_file, CCDS id key) to the (ExonIndex, strand, chromosome)
+    # of each loaded entry
+    self.entries = {}
+    self.lock = threading.Lock()
+
+    # Assigns the strand of the loaded entries to the request settings
+    self.strand_loader = ccds.CcdsLoader()
+
+
+
+  def settings(self, request):
+    """Returns the settings of a request."""
+
+    reader = sr.SettingsReader(request.get('settings_file'))
+    reader.update(dict((key, value) for key, value in request.items()
+                       if key not in ['settings_file', 'id']))
+
+    settings = copy.deepcopy(self.defaults)
+    settings.update(reader.settings)
+
+    # Relative paths are taken relative to the settings file
+    if request.get('settings_file') is not None:
+      settings_dir = os.path.dirname(os.path.abspath(request['settings_file']))
+      for key in ['input_file', 'output_file']:
+        if key in settings:
+          settings[key] = os.path.join(settings_dir, os.path.expanduser(settings[key]))
+
+    # A service cannot stop to ask about strand conflicts
+    if settings.get('strand_conflict', 'ask') == 'ask':
+      settings['strand_conflict'] = 'ccds'
+
+    return settings
+
+
+
+  def exon_index(self, settings):
+    """Returns the ExonIndex of the CCDS entry of the settings and assigns the
+    strand (and chromosome) settings. Entries are loaded once per service."""
+
+    key = (settings.get('annotation_file'), ccds.CcdsLoader._split_id(settings['CCDS_ID']))
+
+    with self.lock:
+      entry = self.entries.get(key)
+
+    if entry is None:
+      loader = pipeline.make_loader(settings)
+      loader.load(settings)
+      if loader.get_exon_index() is None:
+        return
+
+      entry = (loader.get_exon_index(), loader.get_strand(), settings.get('chromosome'))
+      with self.lock:
+        self.entries[key] = entry
+
+    else:
+      self.strand_loader.assign_strand(settings, entry[1])
+      if settings.get('chromosome') is None:
+        settings['chromosome'] = entry[2]
+
+    return entry[0]
+
+
+
+  def handle(self, request):
+    """Pairs the guides of the gene of a request and returns the run summary.
+    Failures are reported in the summary rather than raised."""
+
+    summary = { 'id' : request.get('id') }
+
+    try:
+      settings = self.settings(request)
+      summary.update({ 'CCDS_ID'    : settings.get('CCDS_ID') ,
+                       'input_file' : settings.get('input_file') })
+
+      exon_index = self.exon_index(settings)
+      if exon_index is None:
+        summary['status'] = 'error: cannot load CCDS entry'
+        return summary
+
+      summary.update(pipeline.run(settings, self.constants_file, exon_index,
+                                  outputter=self.outputter, tables=self.tables))
+
+    except Exception as e:
+      self.logger.error('Failed to pair guides for %s:\n%s' %
+                        (request.get('CCDS_ID'), traceback.format_exc()))
+      summary['status'] = 'error: %s' % e
+
+    return summary
+
+
+
+  def serve(self, address):
+    """Serves requests on address (see parse_address) until interrupted."""
+
+    family, server_address = parse_address(address)
+
+    if family == socket.AF_UNIX:
+      if os.path.exists(server_address):
+        os.remove(server_address)
+      server = _UnixServer(server_address, _RequestHandler)
+    else:
+      server = _TCPServer(server_address, _RequestHandler)
+    server.service = self
+
+    self.logger.info('Serving pair-guides requests on %s' % address)
+    try:
+      server.serve_forever()
+    except KeyboardInterrupt:
+      pass
+    finally:
+      server.server_close()
+      if family == socket.AF_UNIX and os.path.exists(server_address):
+        os.remove(server_address)
+
+
+
+def parse_address(address):
+  """Returns the (socket family, address) of a service address: a path for
+  a Unix socket, or a port or host:port for TCP (localhost by default)."""
+
+  address = str(address)
+  if '/' in address or address.endswith('.sock'):
+    return socket.AF_UNIX, address
+
+  host, port = 'localhost', address
+  if ':' in address:
+    host, port = address.rsplit(':', 1)
+  return socket.AF_INET, (host, int(port))
+
+
+
+def request(address, values):
+  """Sends one request (a dict of settings) to the service at address and
+  returns its response."""
+
+  family, server_address = parse_address(address)
+  conn = socket.socket(family, socket.SOCK_STREAM)
+  try:
+    conn.connect(server_address)
+    stream = conn.makefile('rwb')
+    stream.write(json.dumps(values) + '\n')
+    stream.flush()
+    return json.loads(stream.readline())
+  finally:
+    conn.close()
+
+
+
+class _RequestHandler(SocketServer.StreamRequestHandler):
+  """Answers each JSON request line of a connection with a JSON response line."""
+
+  def handle(self):
+    for line in iter(self.rfile.readline, ''):
+      if len(line.strip()) == 0:
+        continue
+
+      try:
+        response = self.server.service.handle(json.loads(line))
+      except ValueError as e:
+        response = { 'status' : 'error: invalid request: %s' % e }
+
+      self.wfile.write(json.dumps(response) + '\n')
+      self.wfile.flush()
+
+
+
+class _UnixServer(SocketServer.ThreadingMixIn, SocketServer.UnixStreamServer):
+  daemon_threads = True
+
+
+class _TCPServer(SocketServer.ThreadingMixIn, SocketServer.TCPServer):
+  daemon_threads = True
+  allow_reuse_address = True
@@ -1,17 +1,23 @@
 import log
+import instrumentation as instr
+import outputwriters as ow
 
 
 class SettingsReader(object):
-  """Reads the settings file for the grna-block-builder."""
+  """Reads the settings file for the grna-block-builder.
+  Settings can also be given as a dict of value strings with update()."""
 
-  def __init__(self, filepath):
+  def __init__(self, filepath=None, profile=None):
 
     self.logger = log.getLogger(__name__)
+    self.profile = instr.as_profile(profile)
 
     self.settings = {}
     self.filepath = filepath
 
-    self._read(self.filepath)
+    if self.filepath is not None:
+      with self.profile.stage('read_settings'):
+        self._read(self.filepath)
 
 
   def _read(self, filepath):
@@ -28,50 +34,164 @@ class SettingsReader(object):
 
         if len(tokens) == 0:
           continue
-        if len(tokens) < 2:
-          self.logger.warning('No value for %s' % str(tokens[0]))
+        self._set(tokens)
 
+    self._set_default_output_file()
 
-        if tokens[0].lower() == 'input_file':
-          self.settings['input_file'] = ' '.join(tokens[1:])
 
-        elif tokens[0].lower() == 'ccds_id':
-          self.settings['CCDS_ID'] = tokens[1]
 
-        elif tokens[0].lower() == 'strand':
-          self.settings['strand'] = tokens[1]
+  def update(self, values):
+    """Sets the settings given by a dict of keys and values. The values are
+    read as in a settings file: a list value or a string of space-separated
+    tokens gives the tokens after the key."""
 
-        elif tokens[0].lower() == 'output_file':
-          self.settings['output_file'] = ' '.join(tokens[1:])
+    for key, value in values.items():
+      if isinstance(value, (list, tuple)):
+        tokens = [str(token) for token in value]
+      else:
+        tokens = str(value).split()
+      self._set([str(key)] + tokens)
 
-        elif tokens[0].lower() == 'grna2_start_g':
-          if (str(tokens[1]).lower() == 't' or str(tokens[1]).lower() == 'true' or
-              str(tokens[1]).lower() == '1' or str(tokens[1]).lower() == 'y' or
-              str(tokens[1]).lower() == 'yes'):
-            self.settings['gRNA2_start_G'] = True
-          elif (str(tokens[1]).lower() == 'f' or str(tokens[1]).lower() == 'false' or
-                str(tokens[1]).lower() == '0' or str(tokens[1]).lower() == 'n' or
-                str(tokens[1]).lower() == 'no'):
-            self.settings['gRNA2_start_G'] = False
-          else:
-            self.logger.warning('Value for %s must be True or False.' % tokens[0])
+    self._set_default_output_file()
 
-        elif tokens[0].lower() == 'separation_limit':
-          self.settings['separation_limit'] = int(tokens[1]) * 1000 # converts to kbp
 
-        elif tokens[0].lower() == 'latest_grna2':
-          self.settings['latest_gRNA2'] = float(tokens[1])
 
-        elif tokens[0].lower() == 'min_exon_deletion':
-          self.settings['min_exon_deletion'] = int(tokens[1])
+  def _set_default_output_file(self):
 
-        elif tokens[0].lower() == 'max_offtargets':
-          self.settings['max_offtargets'] = tuple(map(int, tokens[1:5]))
+    if 'output_file' not in self.settings.keys() and 'input_file' in self.settings.keys():
+      self.settings['output_file'] = self.default_output_file(self.settings['input_file'],
+                                                              self.settings.get('output_format'))
 
-        else:
-          self.logger.warning('Invalid key: %s' % str(tokens[0]))
 
 
-    if 'output_file' not in self.settings.keys():
-      self.settings['output_file'] = ".".join(self.settings['input_file'].split('.')[:-1]) \
-                                             + '_pairs.csv'
\ No newline at end of file
+  def _set(self, tokens):
+    """Sets the setting given by a line of key and value tokens."""
+
+    if len(tokens) < 2:
+      self.logger.warning('No value for %s' % str(tokens[0]))
+
+    if tokens[0].lower() == 'input_file':
+      self.settings['input_file'] = ' '.join(tokens[1:])
+
+    elif tokens[0].lower() == 'ccds_id':
+      self.settings['CCDS_ID'] = tokens[1]
+
+    elif tokens[0].lower() == 'strand':
+      self.settings['strand'] = tokens[1]
+
+    elif tokens[0].lower() == 'output_file':
+      self.settings['output_file'] = ' '.join(tokens[1:])
+
+    elif tokens[0].lower() == 'output_format':
+      if tokens[1].lower() in ow.WRITERS:
+        self.settings['output_format'] = tokens[1].lower()
+      else:
+        self.logger.warning('Value for %s must be one of %s.' %
+                            (tokens[0], ', '.join(sorted(ow.WRITERS.keys()))))
+
+    elif tokens[0].lower() == 'gene_blocks':
+      if tokens[1].lower() in ['full', 'reference']:
+        self.settings['gene_blocks'] = tokens[1].lower()
+      else:
+        self.logger.warning('Value for %s must be full or reference.' % tokens[0])
+
+    elif tokens[0].lower() == 'grna2_start_g':
+      self._set_bool('gRNA2_start_G', tokens)
+
+    elif tokens[0].lower() == 'separation_limit':
+      self.settings['separation_limit'] = int(tokens[1]) * 1000 # converts to kbp
+
+    elif tokens[0].lower() == 'latest_grna2':
+      self.settings['latest_gRNA2'] = float(tokens[1])
+
+    elif tokens[0].lower() == 'min_exon_deletion':
+      self.settings['min_exon_deletion'] = int(tokens[1])
+
+    elif tokens[0].lower() == 'max_offtargets':
+      self.settings['max_offtargets'] = tuple(map(int, tokens[1:5]))
+
+    elif tokens[0].lower() == 'sort_key':
+      # Comma-separated keys may be written with spaces after the commas
+      self.settings['sort_key'] = ''.join(tokens[1:]).lower()
+
+    elif tokens[0].lower() == 'sort_memory':
+      self.settings['sort_memory'] = float(tokens[1])
+
+    elif tokens[0].lower() == 'top_k':
+      self.settings['top_k'] = int(tokens[1])
+
+    elif tokens[0].lower() == 'workers':
+      self.settings['workers'] = int(tokens[1])
+
+    elif tokens[0].lower() == 'genome_wide':
+      self._set_bool('genome_wide', tokens)
+
+    elif tokens[0].lower() == 'chromosome':
+      self.settings['chromosome'] = tokens[1]
+
+    elif tokens[0].lower() == 'table_cache_dir':
+      self.settings['table_cache_dir'] = ' '.join(tokens[1:])
+
+    elif tokens[0].lower() == 'table_cache_size':
+      self.settings['table_cache_size'] = int(tokens[1])
+
+    elif tokens[0].lower() == 'result_cache_dir':
+      self.settings['result_cache_dir'] = ' '.join(tokens[1:])
+
+    elif tokens[0].lower() == 'result_cache_size':
+      self.settings['result_cache_size'] = float(tokens[1])
+
+    elif tokens[0].lower() == 'ccds_cache_dir':
+      self.settings['ccds_cache_dir'] = ' '.join(tokens[1:])
+
+    elif tokens[0].lower() == 'ccds_cache_ttl':
+      self.settings['ccds_cache_ttl'] = float(tokens[1])
+
+    elif tokens[0].lower() == 'ccds_cache_size':
+      self.settings['ccds_cache_size'] = int(tokens[1])
+
+    elif tokens[0].lower() == 'offline':
+      self._set_bool('offline', tokens)
+
+    elif tokens[0].lower() == 'annotation_file':
+      self.settings['annotation_file'] = ' '.join(tokens[1:])
+
+    elif tokens[0].lower() == 'ccds_workers':
+      self.settings['ccds_workers'] = int(tokens[1])
+
+    elif tokens[0].lower() == 'ccds_retries':
+      self.settings['ccds_retries'] = int(tokens[1])
+
+    elif tokens[0].lower() == 'strand_conflict':
+      if tokens[1].lower() in ['ask', 'ccds', 'settings']:
+        self.settings['strand_conflict'] = tokens[1].lower()
+      else:
+        self.logger.warning('Value for %s must be ask, ccds or settings.' % tokens[0])
+
+    else:
+      self.logger.warning('Invalid key: %s' % str(tokens[0]))
+
+
+
+  @staticmethod
+  def default_output_file(input_file, output_format=None):
+    """Returns the default output filepath for an input filepath
+    (with the extension of output_format if given)."""
+    extension = ow.default_extension(output_format) if output_format is not None else '.csv'
+    return ".".join(input_file.split('.')[:-1]) + '_pairs' + extension
+
+
+
+  def _set_bool(self, key, tokens):
+    """Sets settings[key] to the True/False value given in tokens[1]."""
+
+    if (str(tokens[1]).lower() == 't' or str(tokens[1]).lower() == 'true' or
+        str(tokens[1]).lower() == '1' or str(tokens[1]).lower() == 'y' or
+        str(tokens[1]).lower() == 'yes'):
+      self.settings[key] = True
+    elif (str(tokens[1]).lower() == 'f' or str(tokens[1]).lower() == 'false' or
+          str(tokens[1]).lower() == '0' or str(tokens[1]).lower() == 'n' or
+          str(tokens[1]).lower() == 'no'):
+      self.settings[key] = False
+    else:
+      self.logger.warning('Value for %s must be True or False.' % tokens[0])
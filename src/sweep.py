@@ -0,0 +1,280 @@
+import log
+import csv
+import copy
+import itertools
+import numpy as np
+from collections import deque
+import guidebuilder as gb
+import guidepair as gp
+import pairtable as pt
+import settingsreader as sr
+import outputformatter as of
+import outputwriters as ow
+
+
+class GridReader(sr.SettingsReader):
+  """Reads a sweep grid file. The grid file is a settings file in which the
+  swept settings may list several values separated by commas, e.g.
+    separation_limit  5, 10, 20
+    max_offtargets    0 0 0 0, 1 1 0 0
+  """
+
+  # Settings that can take several values in one sweep
+  SWEEP_KEYS = ['max_offtargets', 'gRNA2_start_G', 'separation_limit',
+                'latest_gRNA2', 'min_exon_deletion']
+
+  def __init__(self, filepath):
+
+    # A list of (key, [values]) in grid file order
+    self.grid = []
+
+    super(GridReader, self).__init__(filepath)
+
+
+
+  def _set(self, tokens):
+
+    # The commas of a sort_key separate its keys, not alternatives
+    alternatives = ' '.join(tokens[1:]).split(',')
+    if len(alternatives) == 1 or tokens[0].lower() == 'sort_key':
+      return super(GridReader, self)._set(tokens)
+
+    # Parses each alternative value as its own settings line
+    settings = self.settings
+    values = []
+    for alternative in alternatives:
+      self.settings = {}
+      super(GridReader, self)._set([tokens[0]] + alternative.split())
+      values += self.settings.items()
+    self.settings = settings
+
+    if len(values) == 0:
+      return
+
+    key = values[0][0]
+    if key not in GridReader.SWEEP_KEYS:
+      self.logger.warning('Cannot sweep %s: using the first value' % key)
+      self.settings[key] = values[0][1]
+      return
+
+    self.grid.append((key, [value for k, value in values]))
+
+
+
+class ParameterSweep(object):
+  """Pairs the guides of one gene for every combination of a grid of settings.
+  The results file is parsed and filtered once at the loosest thresholds of
+  the grid and pairs are generated once over the widest window. Each
+  combination is then derived from those pairs by filtering.
+  Usage:
+    sweep = ParameterSweep(grid_file)
+    sweep.build(exon_index)
+    summaries = sweep.run(constants_file, write_outputs)
+  """
+
+  SUMMARY_FIELDS = ['combination'] + GridReader.SWEEP_KEYS + ['sequences', 'pairs', 'output_file']
+
+  def __init__(self, grid_file):
+
+    self.logger = log.getLogger(__name__)
+
+    reader = GridReader(grid_file)
+    self.settings = reader.settings
+    self.grid = reader.grid
+
+    # Fills the unswept settings from the GuideBuilder defaults
+    for key, value in gb.GuideBuilder._DEFAULTS.items():
+      if key not in self.settings.keys():
+        self.settings[key] = value
+
+    self.combinations = [dict(zip([key for key, values in self.grid], combination))
+                         for combination in itertools.product(*[values for key, values in self.grid])]
+
+    self.builder = None
+    self.columns = None
+    self.table = None
+
+
+
+  def _values(self, key):
+    """Returns every value of a setting across the grid."""
+
+    for grid_key, values in self.grid:
+      if grid_key == key:
+        return values
+    return [self.settings[key]]
+
+
+
+  def _loose_settings(self):
+    """Returns the settings at the loosest thresholds of the grid."""
+
+    settings = copy.deepcopy(self.settings)
+    settings['max_offtargets'] = tuple(max(values) for values in zip(*self._values('max_offtargets')))
+    settings['separation_limit'] = max(self._values('separation_limit'))
+    settings['latest_gRNA2'] = max(self._values('latest_gRNA2'))
+    settings['min_exon_deletion'] = min(self._values('min_exon_deletion'))
+    return settings
+
+
+
+  def build(self, exon_index):
+    """Reads the results file and generates the candidate pairs of every
+    combination in one pass."""
+
+    settings = self._loose_settings()
+
+    self.builder = gb.GuideBuilder(settings)
+    self.builder.set_exon_edges(exon_index)
+    sequences = self.builder.get_sequences()
+
+    self.offtargets = np.array([seq.offtargets for seq in sequences], dtype=np.int64).reshape(-1, 4)
+    self.gene_loc_fracs = np.array([seq.gene_loc_frac for seq in sequences], dtype=np.float64)
+
+    # gRNA 2 is paired up to the latest cutoff of any combination
+    last_gRNA2 = max(self._gRNA2_cutoff(combination) for combination in self.combinations)
+
+    g_modes = set(self._values('gRNA2_start_G'))
+
+    # Each candidate is recorded with the indices of its sequences, whether
+    # gRNA 2 is a G-start variant, and the indices of its two guides in the
+    # guide list of the pair table: every variant, then every sequence
+    seq1_idx, seq2_idx, g_start = [], [], []
+    guide1_idx, guide2_idx = [], []
+
+    g_starts = self.builder.expand_G_starts()
+    offsets = np.cumsum([0] + [len(g_seqs) for g_seqs in g_starts]).tolist()
+
+    window = deque()
+
+    for j, seq2 in enumerate(sequences):
+      if j > last_gRNA2:
+        break
+
+      while len(window) > 0 and abs(seq2.cut_site - window[0][2].cut_site) > settings['separation_limit']:
+        window.popleft()
+
+      g_seq2s = range(len(g_starts[j])) if True in g_modes else []
+
+      for i, guide1, seq1 in window:
+        if seq1.overlap_Q(seq2):
+          continue
+        if False in g_modes:
+          seq1_idx.append(i)
+          seq2_idx.append(j)
+          g_start.append(False)
+          guide1_idx.append(guide1)
+          guide2_idx.append(offsets[-1] + j)
+        for m in g_seq2s:
+          seq1_idx.append(i)
+          seq2_idx.append(j)
+          g_start.append(True)
+          guide1_idx.append(guide1)
+          guide2_idx.append(offsets[j] + m)
+
+      window.extend((j, offsets[j] + k, g_seq1) for k, g_seq1 in enumerate(g_starts[j]))
+
+    self.table = pt.PairTable([g_seq for g_seqs in g_starts for g_seq in g_seqs] + sequences)
+    guide1_idx = np.array(guide1_idx, dtype=np.int32)
+    guide2_idx = np.array(guide2_idx, dtype=np.int32)
+    self.table.extend(guide1_idx, guide2_idx,
+                      gp.batch_deletion_stats(self.builder.get_exon_index(), self.table.cut_sites,
+                                              self.table.cut_sites, seq1_idx=guide1_idx,
+                                              seq2_idx=guide2_idx))
+
+    self.columns = { 'seq1_idx'          : np.array(seq1_idx, dtype=np.int64) ,
+                     'seq2_idx'          : np.array(seq2_idx, dtype=np.int64) ,
+                     'gRNA2_start_G'     : np.array(g_start, dtype=bool) ,
+                     'separation'        : self.table.columns['genomic_separation'] ,
+                     'deletion_count'    : self.table.columns['deletion_count'] }
+
+    self.logger.info('Generated %d candidate pairs for %d combinations' %
+                     (len(self.table), len(self.combinations)))
+
+
+
+  def _offtargets_ok(self, combination):
+    """Returns a boolean array of the sequences that pass the combination's off-target filter."""
+
+    max_offtargets = combination.get('max_offtargets', self.settings['max_offtargets'])
+    return np.all(self.offtargets <= np.array(max_offtargets, dtype=np.int64), axis=1)
+
+
+
+  def _gRNA2_cutoff(self, combination):
+    """Returns the index of the last sequence that can be gRNA 2 for a
+    combination: the first passing sequence beyond latest_gRNA2."""
+
+    latest_gRNA2 = combination.get('latest_gRNA2', self.settings['latest_gRNA2'])
+    beyond = np.flatnonzero(self._offtargets_ok(combination) & (self.gene_loc_fracs > latest_gRNA2))
+    return beyond[0] if len(beyond) > 0 else len(self.gene_loc_fracs)
+
+
+
+  def select(self, combination):
+    """Returns the indices of the candidate pairs that are valid for a
+    combination, in the order a direct run would generate them."""
+
+    value = lambda key: combination.get(key, self.settings[key])
+
+    ok = self._offtargets_ok(combination)
+    mask = (ok[self.columns['seq1_idx']] & ok[self.columns['seq2_idx']] &
+            (self.columns['seq2_idx'] <= self._gRNA2_cutoff(combination)) &
+            (self.columns['gRNA2_start_G'] == value('gRNA2_start_G')) &
+            (self.columns['separation'] <= value('separation_limit')) &
+            (self.columns['deletion_count'] >= value('min_exon_deletion')))
+    return np.flatnonzero(mask)
+
+
+
+  def run(self, constants_file, write_outputs=False):
+    """Derives every combination from the candidate pairs and returns a
+    summary of each. If write_outputs is set, the pairs of each combination
+    are written to a numbered output file."""
+
+    outputter = of.OutputFormatter(constants_file) if write_outputs else None
+    basename, extension = ow.split_extension(self.settings['output_file'])
+
+    summaries = []
+    for n, combination in enumerate(self.combinations):
+      selected = self.select(combination)
+
+      summary = dict((key, combination.get(key, self.settings[key])) for key in GridReader.SWEEP_KEYS)
+      summary['combination'] = n + 1
+      summary['sequences'] = int(self._offtargets_ok(combination).sum())
+      summary['pairs'] = len(selected)
+
+      if outputter is not None and len(selected) > 0:
+        output_file = '%s_sweep%03d%s' % (basename, n + 1, extension or '.csv')
+        pairs = self.builder._order_table(self.table.take(selected), self.builder._sort_setting_names())
+        summary['pairs'] = outputter.write(pairs,
+                                           output_file, self.settings.get('output_format'),
+                                           self.settings.get('gene_blocks', 'full'))
+        summary['output_file'] = output_file
+      elif self.settings['top_k']:
+        summary['pairs'] = min(summary['pairs'], self.settings['top_k'])
+
+      summaries.append(summary)
+
+    return summaries
+
+
+
+  def write_summary(self, summaries, summary_file):
+    """Writes the combination summaries to a csv table."""
+
+    with open(summary_file, 'w') as outfile:
+      writer = csv.writer(outfile, dialect='excel')
+      writer.writerow(ParameterSweep.SUMMARY_FIELDS)
+      for summary in summaries:
+        row = []
+        for field in ParameterSweep.SUMMARY_FIELDS:
+          value = summary.get(field, '')
+          if field == 'separation_limit':
+            value = value // 1000   # reports kbp as in the settings file
+          elif field == 'max_offtargets':
+            value = ' '.join(str(n) for n in value)
+          row.append(value)
+        writer.writerow(row)
+
+    self.logger.info('Successfully wrote sweep summary to %s' % summary_file.split('/')[-1])
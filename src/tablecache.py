@@ -0,0 +1,421 @@
+import log
+import os
+import mmap
+import hashlib
+import threading
+import collections
+import multiprocessing
+import tempfile
+import numpy as np
+
+
+# All ChopChop results tables have these columns in order:
+#   Rank, Target_sequence, Genomic_location, Exon, Strand, GC_content,
+#   Self_complementarity, MM0, MM1, MM2, MM3, Efficiency
+# We discard the Rank, Self_complementarity, GC_content and Efficiency fields.
+# We also discard the PAM sites from the target sequences.
+
+# Fields of a parsed table record (the string fields are sized to the table).
+# Records also hold the 'chrom' of the Genomic_location column, which is used
+# to pull the rows of one gene out of a genome-wide table.
+FIELDS = ['sequence', 'gnm_loc', 'exon_num', 'strand', 'offtargets']
+
+
+
+# Smallest chunk of a results file parsed by one worker in a parallel read
+MIN_CHUNK_BYTES = 1 << 22
+
+
+
+def read_table(filepath, workers=1):
+  """Parses the ChopChop results file in filepath into a numpy record array
+  with one record per row and the fields in FIELDS. With workers above 1,
+  large files are memory-mapped, split at line boundaries into chunks and
+  the chunks are parsed in that many processes."""
+
+  if workers > 1:
+    ranges = _chunk_ranges(filepath, workers)
+    if len(ranges) > 1:
+      pool = multiprocessing.Pool(min(workers, len(ranges)))
+      try:
+        parts = pool.map(_read_chunk, [(filepath, start, stop) for start, stop in ranges])
+      finally:
+        pool.close()
+        pool.join()
+      return _concatenate(parts)
+
+  with open(filepath, 'r') as file:
+    next(file, None)  # The first line is a text header
+    return _parse_lines(file)
+
+
+
+def _parse_lines(lines):
+  """Parses an iterable of ChopChop results rows into a record array."""
+
+  sequences, chroms, gnm_locs, exon_nums, strands, offtargets = [], [], [], [], [], []
+
+  for line in lines:
+
+    tokens = line.split()
+    if len(tokens) == 0:
+      continue
+
+    sequences.append(tokens[1][:-3])
+    chrom, gnm_loc = tokens[2].split(':')
+    chroms.append(chrom.strip())
+    gnm_locs.append(int(gnm_loc.strip()))
+    exon_nums.append(int(tokens[3]))
+    strands.append(tokens[4])
+    offtargets.append(tuple(int(n) for n in tokens[7:11]))
+
+  records = np.empty(len(sequences), dtype=_table_dtype(
+                       max([len(seq) for seq in sequences] + [1]),
+                       max([len(chrom) for chrom in chroms] + [1]),
+                       max([len(strand) for strand in strands] + [1])))
+  records['sequence'] = sequences
+  records['chrom'] = chroms
+  records['gnm_loc'] = gnm_locs
+  records['exon_num'] = exon_nums
+  records['strand'] = strands
+  if len(offtargets) > 0:
+    records['offtargets'] = offtargets
+  return records
+
+
+
+def _table_dtype(sequence_size, chrom_size, strand_size):
+  """Returns the record dtype of a table with the given string field sizes."""
+
+  return np.dtype([('sequence', 'S%d' % sequence_size),
+                   ('chrom', 'S%d' % chrom_size),
+                   ('gnm_loc', np.int64),
+                   ('exon_num', np.int32),
+                   ('strand', 'S%d' % strand_size),
+                   ('offtargets', np.int32, (4,))])
+
+
+
+def _chunk_ranges(filepath, n_chunks):
+  """Returns the (start, stop) byte ranges that split the rows of filepath
+  (after the header line) into up to n_chunks chunks of at least
+  MIN_CHUNK_BYTES. Every range starts at the beginning of a line."""
+
+  size = os.path.getsize(filepath)
+  if size == 0:
+    return []
+
+  with open(filepath, 'rb') as file:
+    data = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+    try:
+      first = data.find(b'\n') + 1 or size
+      n_chunks = max(min(n_chunks, (size - first) // MIN_CHUNK_BYTES), 1)
+
+      bounds = [first]
+      for n in xrange(1, n_chunks):
+        # Moves each split forward to the start of the next line
+        split = data.find(b'\n', max(first + (size - first) * n // n_chunks, bounds[-1])) + 1
+        if split == 0:
+          break
+        bounds.append(split)
+      bounds.append(size)
+    finally:
+      data.close()
+
+  return [(start, stop) for start, stop in zip(bounds[:-1], bounds[1:]) if stop > start]
+
+
+
+def _read_chunk(chunk):
+  """Parses the rows in the (filepath, start, stop) byte range of a results
+  file in a worker process."""
+
+  filepath, start, stop = chunk
+  with open(filepath, 'rb') as file:
+    data = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+    try:
+      return _parse_lines(data[start:stop].splitlines())
+    finally:
+      data.close()
+
+
+
+def _concatenate(parts):
+  """Joins the record arrays of consecutive chunks into one table."""
+
+  records = np.empty(sum(len(part) for part in parts), dtype=_table_dtype(
+                       *[max(part.dtype[name].itemsize for part in parts)
+                         for name in ['sequence', 'chrom', 'strand']]))
+  offset = 0
+  for part in parts:
+    for name in part.dtype.names:
+      records[name][offset : offset + len(part)] = part[name]
+    offset += len(part)
+  return records
+
+
+
+def cut_sites(records):
+  """Returns an array of the cut sites of the table records, computed as in
+  TargetSequence. Records with an invalid strand get a cut site below any exon."""
+
+  lengths = np.char.str_len(records['sequence'])
+  return np.where(records['strand'] == '+', records['gnm_loc'] + lengths - 4,
+                  np.where(records['strand'] == '-', records['gnm_loc'] + 5,
+                           np.iinfo(np.int64).min))
+
+
+
+class GenomeTable(object):
+  """A position index over a parsed ChopChop table that may hold the rows of
+  many genes on many chromosomes. The rows are ordered by chromosome and
+  genomic location in one pass, so the rows of any genomic span are found by
+  binary search. Spans are returned in the row order of the file.
+  Usage:
+    table = GenomeTable(read_table(filepath))
+    records = table.rows_in_span('chr10', first, last)
+  """
+
+  def __init__(self, records):
+
+    self.records = records
+
+    # The sort is stable, so rows at the same location keep their file order
+    self._order = np.lexsort((records['gnm_loc'], records['chrom']))
+    self._locs = np.asarray(records['gnm_loc'])[self._order]
+
+    chroms = np.asarray(records['chrom'])[self._order]
+    names, firsts = np.unique(chroms, return_index=True)
+    lasts = list(firsts[1:]) + [len(chroms)]
+    self._bounds = dict((str(name), (int(first), int(last)))
+                        for name, first, last in zip(names, firsts, lasts))
+
+
+  def __len__(self):
+    return len(self.records)
+
+
+  @property
+  def chromosomes(self):
+    return sorted(self._bounds.keys())
+
+
+  def find_chromosome(self, name):
+    """Returns the chromosome of the table given by name, which may omit the
+    'chr' prefix, or None if the table has no rows on it."""
+
+    name = str(name)
+    for candidate in [name, 'chr' + name, name[3:] if name.startswith('chr') else None]:
+      if candidate in self._bounds:
+        return candidate
+
+
+  def rows_in_span(self, chrom, first, last):
+    """Returns the records on chrom whose genomic location lies in
+    [first, last] (INCLUSIVE), in file order."""
+
+    if chrom not in self._bounds:
+      return self.records[:0]
+
+    lo, hi = self._bounds[chrom]
+    start = lo + np.searchsorted(self._locs[lo:hi], first, side='left')
+    stop = lo + np.searchsorted(self._locs[lo:hi], last, side='right')
+    return self.records[np.sort(self._order[start:stop])]
+
+
+
+def file_stamp(filepath):
+  """Returns the (real path, size, modification time) of filepath, which
+  identifies the file contents within a process without reading them."""
+
+  stat = os.stat(filepath)
+  return os.path.realpath(filepath), stat.st_size, stat.st_mtime
+
+
+
+# The content hashes of files already hashed by this process, keyed by their
+# file_stamp, so that an unchanged file is hashed at most once per process
+_FILE_KEYS_SIZE = 256
+_file_keys = collections.OrderedDict()
+_file_keys_lock = threading.Lock()
+
+
+
+def file_key(filepath):
+  """Returns the sha1 hex digest of the contents of filepath. The digest is
+  kept for the process while the file_stamp of filepath is unchanged."""
+
+  stamp = file_stamp(filepath)
+  with _file_keys_lock:
+    key = _file_keys.pop(stamp, None)
+    if key is not None:
+      _file_keys[stamp] = key
+      return key
+
+  sha1 = hashlib.sha1()
+  with open(filepath, 'rb') as file:
+    for block in iter(lambda: file.read(1 << 20), b''):
+      sha1.update(block)
+  key = sha1.hexdigest()
+
+  with _file_keys_lock:
+    _file_keys[stamp] = key
+    while len(_file_keys) > _FILE_KEYS_SIZE:
+      _file_keys.popitem(last=False)
+  return key
+
+
+
+class TableMemo(object):
+  """An in-memory LRU of parsed tables keyed by the file_stamp of their files,
+  shared by the builders of a long-running process so that a table is not
+  read (or hashed) again while its file is unchanged. Safe to share across
+  threads."""
+
+  def __init__(self, max_entries=16):
+
+    self.max_entries = max_entries
+    self._tables = collections.OrderedDict()
+    self._lock = threading.Lock()
+
+
+
+  def get(self, filepath):
+    """Returns the table of filepath, or None if it is not held."""
+
+    key = file_stamp(filepath)
+    with self._lock:
+      records = self._tables.pop(key, None)
+      if records is not None:
+        # Marks the table as recently used for eviction
+        self._tables[key] = records
+    return records
+
+
+
+  def put(self, filepath, records):
+    """Holds the table of filepath and drops the least recently used tables
+    beyond max_entries."""
+
+    key = file_stamp(filepath)
+    with self._lock:
+      self._tables.pop(key, None)
+      self._tables[key] = records
+      while len(self._tables) > self.max_entries:
+        self._tables.popitem(last=False)
+
+
+
+  def clear(self):
+    with self._lock:
+      self._tables.clear()
+
+
+
+class TableCache(object):
+  """A directory of parsed ChopChop tables saved as binary .npy record arrays,
+  keyed by the hash of the table file contents. Cached tables are loaded as
+  read-only memory maps, so a re-run skips text parsing entirely. The least
+  recently used tables are evicted beyond max_entries."""
+
+  SUBDIR = 'tables'
+
+  # Bumped whenever the record layout changes so that old tables are not read
+  FORMAT_VERSION = 2
+
+  def __init__(self, cache_dir, max_entries=100):
+
+    self.logger = log.getLogger(__name__)
+
+    self.cache_dir = os.path.join(os.path.expanduser(cache_dir), TableCache.SUBDIR)
+    self.max_entries = max_entries
+
+    if not os.path.isdir(self.cache_dir):
+      try:
+        os.makedirs(self.cache_dir)
+      except OSError:
+        # Another process may have created it first
+        if not os.path.isdir(self.cache_dir):
+          raise
+
+
+
+  def _path(self, key):
+    return os.path.join(self.cache_dir, '%s.v%d.npy' % (key, TableCache.FORMAT_VERSION))
+
+
+
+  def get(self, key):
+    """Returns the cached record array for a key as a read-only memory map,
+    or None on a miss."""
+
+    path = self._path(key)
+    if not os.path.exists(path):
+      return
+
+    try:
+      records = np.load(path, mmap_mode='r')
+    except (IOError, ValueError) as e:
+      self.logger.warning('Removing unreadable cached table %s: %s' % (os.path.basename(path), e))
+      self.remove(key)
+      return
+
+    # Marks the entry as recently used for eviction
+    os.utime(path, None)
+    return records
+
+
+
+  def put(self, key, records):
+    """Stores a record array and evicts the least recently used tables
+    beyond max_entries."""
+
+    # Writes to a temporary file first so that readers never see a partial table
+    fd, tmp_path = tempfile.mkstemp(dir=self.cache_dir, suffix='.tmp')
+    try:
+      with os.fdopen(fd, 'wb') as tmp_file:
+        np.save(tmp_file, np.asarray(records))
+      os.rename(tmp_path, self._path(key))
+    except (IOError, OSError) as e:
+      self.logger.warning('Cannot cache parsed table: %s' % e)
+      if os.path.exists(tmp_path):
+        os.remove(tmp_path)
+      return
+
+    self._evict()
+
+
+
+  def _evict(self):
+
+    if self.max_entries is None:
+      return
+
+    paths = [os.path.join(self.cache_dir, name) for name in os.listdir(self.cache_dir)
+             if name.endswith('.npy')]
+    if len(paths) <= self.max_entries:
+      return
+
+    paths.sort(key=lambda path: os.path.getmtime(path), reverse=True)
+    for path in paths[self.max_entries:]:
+      try:
+        os.remove(path)
+      except OSError:
+        pass
+
+
+
+  def remove(self, key):
+    """Removes the cached table for a key."""
+
+    if os.path.exists(self._path(key)):
+      os.remove(self._path(key))
+
+
+
+  def clear(self):
+    """Removes every cached table."""
+
+    for name in os.listdir(self.cache_dir):
+      if name.endswith('.npy'):
+        os.remove(os.path.join(self.cache_dir, name))
@@ -1,14 +1,22 @@
 import log
+import exonindex as ei
+
+
+# A single logger is shared by every TargetSequence
+logger = log.getLogger(__name__)
 
 
 class TargetSequence(object):
   """A data container for a target sequence and its properties."""
 
+  # Slots keep the many sequence objects of a gene compact (no __dict__)
+  __slots__ = ('sequence', 'gnm_loc', 'exon_num', 'strand', 'offtargets',
+               'gc_content', 'cut_site', 'contains_seed_T', 'gene_loc_frac')
+
   def __init__(self, **kwargs):
-    self.logger = log.getLogger(__name__)
 
     if 'sequence' not in kwargs.keys():
-      self.logger.error('Cannot build a TargetSequence object without a sequence string.')
+      logger.error('Cannot build a TargetSequence object without a sequence string.')
 
     self.sequence = str(kwargs['sequence'])
 
@@ -41,6 +49,11 @@ class TargetSequence(object):
     return self.sequence
 
 
+  @property
+  def logger(self):
+    return logger
+
+
 
   def _convert_gnm_loc(self, gnm_loc):
     """The gnm_loc attribute should be an int but it will probably
@@ -83,23 +96,12 @@ class TargetSequence(object):
 
 
 
-  def set_gene_loc_frac(self, exon_edges, gene_strand):
+  def set_gene_loc_frac(self, exon_index, gene_strand):
     """Sets gene_loc_frac attribute, which is the ratio given by the
-    number of exon bps upstream of the cut site divided by the gene size."""
+    number of exon bps upstream of the cut site divided by the gene size.
+    Accepts an ExonIndex (or a list of exon edges)."""
 
-    gene_size = reduce(lambda tot, edge: tot + edge[1]+1 - edge[0],
-                          exon_edges, 0)
-
-    gene_loc = 0
-    for edge in exon_edges:
-      if edge[1] <= self.cut_site:
-        gene_loc += edge[1]+1 - edge[0]
-      else:
-        gene_loc += max(0 , self.cut_site+1 - edge[0])
-        break
-
-    self.gene_loc_frac = ((float(gene_loc) / gene_size) if gene_strand == '+'
-                          else (1 - (float(gene_loc) / gene_size)))
+    self.gene_loc_frac = ei.as_exon_index(exon_index).gene_loc_frac(self.cut_site, gene_strand)
 
 
 
@@ -119,10 +121,10 @@ class TargetSequence(object):
       return self
 
     if self.gene_loc_frac is None:
-      self.logger.warning('Truncating TargetSequence without gene location fraction.')
+      logger.warning('Truncating TargetSequence without gene location fraction.')
 
     if len(self.sequence) - n_trunc < 18:
-      self.logger.warning('Cannot truncate: resulting guide would have fewer than 18 bases.')
+      logger.warning('Cannot truncate: resulting guide would have fewer than 18 bases.')
       return
 
     return TargetSequence(sequence=self.sequence[n_trunc : ], 
@@ -150,23 +152,8 @@ class TargetSequence(object):
 
 
 
-  def cut_in_range(self, exon_edges):
-    """Returns True if the target site of this sequence falls
-    between any of the given boundaries (each exon edge a two-element list)."""
-
-
-    for edge in exon_edges:
-      # Each boundary is a 2-element list or tuple of ints
-      if len(edge) < 2:
-        self.logger.warning('Cannot validify cut site: improper exon boundary shape')
-        continue
-      if edge[0] >= edge[1]:
-        self.logger.error('Cannot validify cut site: invalid exon boundary specification')
-        continue
-
-      # Returns true if the target site is to the right of the first boundary
-      #   or to the right of the penultimate boundary.
-      if (edge[0] <= self.cut_site <= edge[1]-1):
-        return True
+  def cut_in_range(self, exon_index):
+    """Returns True if the target site of this sequence falls inside any
+    exon of the given ExonIndex (or list of exon edges)."""
 
-    return False
\ No newline at end of file
+    return ei.as_exon_index(exon_index).cut_in_exon(self.cut_site)
\ No newline at end of file